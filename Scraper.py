@@ -1,6 +1,8 @@
 import requests
+import mirrors
+import video_extractor
+from episode_parser import parse_episode_page
 from bs4 import BeautifulSoup
-import re
 import subprocess
 import os
 from urllib.parse import urljoin
@@ -9,12 +11,14 @@ import webbrowser
 
 init(autoreset=True)
 
-BASE_URL = "https://www.animesaturn.mx"
+# Stessi mirror dell'app web (ANIMESATURN_MIRRORS / ANIMESATURN_URL), con failover
+site = mirrors.MirrorPool()
+BASE_URL = site.canonical_url
 
 
 def search_anime(query):
     search_url = urljoin(BASE_URL, f"/animelist?search={query}")
-    response = requests.get(search_url)
+    response = site.get(search_url)
     response.raise_for_status()
     soup = BeautifulSoup(response.text, 'html.parser')
     results = soup.find_all('a', class_='badge-archivio')
@@ -22,76 +26,27 @@ def search_anime(query):
 
 
 def get_episodes(anime_url):
-    response = requests.get(anime_url)
+    response = site.get(anime_url)
     response.raise_for_status()
-    soup = BeautifulSoup(response.text, 'html.parser')
-    episodes = soup.find_all('a', class_='bottone-ep')
-    episode_data = []
-
-    for ep in episodes:
-        thumbnail_container = ep.find_previous('div', class_='container shadow rounded bg-dark-as-box mb-3 p-3 w-100 d-flex justify-content-center')
-        thumbnail_url = None
-        if thumbnail_container:
-            thumbnail_img = thumbnail_container.find('img', class_='img-fluid cover-anime rounded')
-            if thumbnail_img and 'src' in thumbnail_img.attrs:
-                thumbnail_url = thumbnail_img['src']
-
-        episode_data.append({
-            "title": ep.text.strip(),
-            "url": urljoin(BASE_URL, ep['href']),
-            "thumbnail": thumbnail_url
-        })
-
-    return episode_data
+    return [{
+        "title": ep.label,
+        "url": ep.url,
+        "thumbnail": ep.thumbnail
+    } for ep in parse_episode_page(response.text, BASE_URL)]
 
 
 def get_streaming_url(episode_url):
-    response = requests.get(episode_url)
+    response = site.get(episode_url)
     response.raise_for_status()
-    soup = BeautifulSoup(response.text, 'html.parser')
-    streaming_link = soup.find('a', href=lambda href: href and 'watch?file=' in href)
+    streaming_link = video_extractor.find_watch_link(response.text)
     if streaming_link:
-        return urljoin(BASE_URL, streaming_link['href'])
+        return urljoin(BASE_URL, streaming_link)
     return None
 
 
 def extract_video_url(url):
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        # Cerca un iframe nella pagina
-        iframe = soup.find('iframe')
-        if (iframe and 'src' in iframe.attrs):
-            iframe_src = iframe['src']
-            iframe_response = requests.get(iframe_src)
-            iframe_response.raise_for_status()
-            video_pattern = r'(https?://.*?\.(?:m3u8|mp4))'
-
-            # Cerca negli elementi script del iframe
-            iframe_soup = BeautifulSoup(iframe_response.text, 'html.parser')
-            for script in iframe_soup.find_all('script'):
-                match = re.search(video_pattern, str(script))
-                if match:
-                    return match.group(0)
-
-            # Cerca direttamente nel testo del iframe
-            match = re.search(video_pattern, iframe_response.text)
-            if match:
-                return match.group(0)
-
-        # Cerca direttamente nella pagina originale se non si trova nell'iframe
-        video_pattern = r'(https?://.*?\.(?:m3u8|mp4))'
-        for script in soup.find_all('script'):
-            match = re.search(video_pattern, str(script))
-            if match:
-                return match.group(0)
-
-        match = re.search(video_pattern, response.text)
-        if match:
-            return match.group(0)
-
+        return video_extractor.extract_video_url(url, get=site.get)
     except requests.RequestException as e:
         print(f"{Fore.RED}Errore nell'estrazione dell'URL video: {e}")
 
@@ -1,97 +1,85 @@
 import requests
+import http_client
+import mirrors
+import rate_limiter
+import video_extractor
+import range_downloader
+import hls_downloader
+from download_manifest import open_manifest
+from download_pipeline import DownloadPipeline
+from episode_parser import parse_episode_page
 from bs4 import BeautifulSoup
-import re
 import subprocess
 import os
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlparse
 from colorama import init, Fore, Style
 import multiprocessing
-from concurrent.futures import ThreadPoolExecutor, as_completed
 import time
 
 init(autoreset=True)
 
-BASE_URL = "https://www.animesaturn.cx"
-MAX_CONCURRENT_DOWNLOADS = 5
+# Stessi mirror dell'app web (ANIMESATURN_MIRRORS / ANIMESATURN_URL), con failover
+site = mirrors.MirrorPool()
+BASE_URL = site.canonical_url
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', 5))
+# Risoluzioni (scraping) in parallelo: poche, per non martellare il sito
+MAX_CONCURRENT_RESOLVES = int(os.getenv('MAX_CONCURRENT_RESOLVES', 2))
+# Limite di banda complessivo in KB/s (0 = nessun limite)
+MAX_BANDWIDTH_KBPS = int(os.getenv('MAX_BANDWIDTH_KBPS', 0))
+
+# Stessi limiti verso il sito dell'app web (con il backend su file valgono anche tra più downloader)
+for mirror in site.mirrors:
+    http_client.limiter.limit(mirror.netloc, rate_limiter.SITE_POLICY)
 
 def search_anime(query):
     search_url = urljoin(BASE_URL, f"/animelist?search={query}")
-    response = requests.get(search_url)
+    response = site.get(search_url)
     response.raise_for_status()
     soup = BeautifulSoup(response.text, 'html.parser')
     results = soup.find_all('a', class_='badge-archivio')
     return [(result.text.strip(), urljoin(BASE_URL, result['href'])) for result in results]
 
 def get_episodes(anime_url):
-    response = requests.get(anime_url)
+    response = site.get(anime_url)
     response.raise_for_status()
-    soup = BeautifulSoup(response.text, 'html.parser')
-    episodes = soup.find_all('a', class_='bottone-ep')
-    return [(ep.text.strip(), urljoin(BASE_URL, ep['href'])) for ep in episodes]
+    return [(ep.label, ep.url) for ep in parse_episode_page(response.text, BASE_URL)]
 
 def get_streaming_url(episode_url):
-    response = requests.get(episode_url)
+    response = site.get(episode_url)
     response.raise_for_status()
-    soup = BeautifulSoup(response.text, 'html.parser')
-    streaming_link = soup.find('a', href=lambda href: href and 'watch?file=' in href)
+    streaming_link = video_extractor.find_watch_link(response.text)
     if streaming_link:
-        return urljoin(BASE_URL, streaming_link['href'])
+        return urljoin(BASE_URL, streaming_link)
     return None
 
 def extract_video_url(url):
     try:
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        iframe = soup.find('iframe')
-        if iframe and 'src' in iframe.attrs:
-            iframe_src = iframe['src']
-            iframe_response = requests.get(iframe_src)
-            iframe_response.raise_for_status()
-            video_pattern = r'(https?://.*?\.(?:m3u8|mp4))'
-
-            iframe_soup = BeautifulSoup(iframe_response.text, 'html.parser')
-            for script in iframe_soup.find_all('script'):
-                match = re.search(video_pattern, str(script))
-                if match:
-                    return match.group(0)
-
-            match = re.search(video_pattern, iframe_response.text)
-            if match:
-                return match.group(0)
-
-        video_pattern = r'(https?://.*?\.(?:m3u8|mp4))'
-        for script in soup.find_all('script'):
-            match = re.search(video_pattern, str(script))
-            if match:
-                return match.group(0)
-
-        match = re.search(video_pattern, response.text)
-        if match:
-            return match.group(0)
-
+        return video_extractor.extract_video_url(url, get=site.get)
     except requests.RequestException as e:
         print(f"{Fore.RED}Errore nell'estrazione dell'URL video: {e}")
 
     return None
 
-def download_video(video_url, output_path):
+def download_video(video_url, output_path, manifest=None, progress=None, on_size=None):
     try:
-        if video_url.endswith('.mp4'):
+        path = urlparse(video_url).path
+        if path.endswith('.mp4'):
             print(f"{Fore.GREEN}Scaricamento episodio: {os.path.basename(output_path)}")
-            response = requests.get(video_url, stream=True)
-            total_size = int(response.headers.get('content-length', 0))
-            block_size = 1024 * 1024  # 1 MB
+            range_downloader.download(video_url, output_path, manifest=manifest, progress=progress, on_size=on_size)
 
-            with open(output_path, 'wb') as file:
-                for chunk in response.iter_content(chunk_size=block_size):
-                    if chunk:
-                        file.write(chunk)
-
-        elif video_url.endswith('.m3u8'):
+        elif path.endswith('.m3u8'):
             print(f"{Fore.GREEN}Scaricamento episodio: {os.path.basename(output_path)}")
-            subprocess.run(['ffmpeg', '-i', video_url, '-c', 'copy', output_path], check=True)
+            # Si scrive nel .part: il file finale compare solo a download completato
+            part_path = output_path + '.part'
+            try:
+                hls_downloader.download(video_url, part_path, progress=progress, on_size=on_size)
+            except hls_downloader.UnsupportedPlaylist as e:
+                print(f"{Fore.YELLOW}Download HLS nativo non disponibile ({e}), uso ffmpeg.")
+                subprocess.run(['ffmpeg', '-y', '-i', video_url, '-c', 'copy', '-f', 'mp4', part_path], check=True)
+            os.replace(part_path, output_path)
+            if manifest:
+                manifest.update(os.path.basename(output_path), video_url=video_url)
+                manifest.complete(os.path.basename(output_path), os.path.getsize(output_path))
 
         return output_path
 
@@ -99,18 +87,36 @@ def download_video(video_url, output_path):
         print(f"{Fore.RED}Errore durante il download del video: {e}")
         return None
 
-def download_episode(episode_num, episode_title, episode_url, output_dir):
+def episode_output(episode_num, output_dir):
+    output_filename = f"Episodio {episode_num}.mp4"
+    return output_filename, os.path.join(output_dir, output_filename)
+
+def is_episode_downloaded(episode_num, output_dir):
+    output_filename, output_path = episode_output(episode_num, output_dir)
+    return open_manifest(output_dir).is_complete(output_filename, output_path)
+
+def resolve_episode(episode_url):
     streaming_url = get_streaming_url(episode_url)
-    video_url = extract_video_url(streaming_url)
+    return extract_video_url(streaming_url) if streaming_url else None
+
+def download_resolved_episode(episode_num, episode_title, episode_url, video_url, output_dir, progress=None, on_size=None):
+    output_filename, output_path = episode_output(episode_num, output_dir)
+    manifest = open_manifest(output_dir)
+    manifest.update(output_filename, episode_url=episode_url)
+    if download_video(video_url, output_path, manifest, progress, on_size):
+        print(f"{Fore.GREEN}Episodio {episode_num} - {episode_title} scaricato con successo.")
+        return True
+    return False
+
+def download_episode(episode_num, episode_title, episode_url, output_dir):
+    if is_episode_downloaded(episode_num, output_dir):
+        print(f"{Fore.BLUE}Episodio {episode_num} - {episode_title} già scaricato, salto.")
+        return True
+
+    video_url = resolve_episode(episode_url)
     if video_url:
-        output_filename = f"Episodio {episode_num}.mp4"
-        output_path = os.path.join(output_dir, output_filename)
-        downloaded_path = download_video(video_url, output_path)
-        if downloaded_path:
-            print(f"{Fore.GREEN}Episodio {episode_num} - {episode_title} scaricato con successo.")
-            return True
-    else:
-        print(f"{Fore.YELLOW}Impossibile trovare l'URL video per l'episodio {episode_num} - {episode_title}.")
+        return download_resolved_episode(episode_num, episode_title, episode_url, video_url, output_dir)
+    print(f"{Fore.YELLOW}Impossibile trovare l'URL video per l'episodio {episode_num} - {episode_title}.")
     return False
 
 def download_season_or_range(episodes, output_dir):
@@ -125,19 +131,62 @@ def download_season_or_range(episodes, output_dir):
         end = int(input(f"{Fore.YELLOW}Inserisci il numero dell'episodio di fine: "))
         episode_range = range(start, end)
 
-    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_DOWNLOADS) as executor:
-        futures = []
-        for i in episode_range:
-            ep_num, (ep_title, ep_url) = i + 1, episodes[i]
-            future = executor.submit(download_episode, ep_num, ep_title, ep_url, output_dir)
-            futures.append(future)
-
-        completed = 0
-        for future in as_completed(futures):
-            completed += 1
-            print(f"{Fore.CYAN}Progresso: {completed}/{len(futures)} episodi completati.")
-
-    print(f"{Fore.GREEN}Tutti gli episodi selezionati sono stati scaricati!")
+    results = download_episodes([(i + 1, *episodes[i]) for i in episode_range], output_dir)
+    if all(results.values()):
+        print(f"{Fore.GREEN}Tutti gli episodi selezionati sono stati scaricati!")
+    else:
+        failed = sorted(ep_num for ep_num, ok in results.items() if not ok)
+        print(f"{Fore.RED}Episodi non scaricati: {', '.join(map(str, failed))}")
+
+def download_episodes(episodes, output_dir, **options):
+    """Scarica gli episodi (numero, titolo, url) di una serie in output_dir.
+
+    Restituisce {numero episodio: True/False}.
+    """
+    results = download_jobs([(output_dir, ep_num, ep_title, ep_url) for ep_num, ep_title, ep_url in episodes], **options)
+    return {job[1]: ok for job, ok in results.items()}
+
+def download_jobs(jobs, resolve_workers=MAX_CONCURRENT_RESOLVES, download_workers=MAX_CONCURRENT_DOWNLOADS,
+                  bandwidth_kbps=MAX_BANDWIDTH_KBPS, report=None, on_finished=None):
+    """Scarica gli episodi (cartella, numero, titolo, url), anche di serie diverse,
+    con un'unica pipeline risoluzione -> download e limiti di concorrenza globali.
+
+    Restituisce {job: True/False}.
+    """
+    results = {}
+
+    def resolve(job):
+        output_dir, ep_num, ep_title, ep_url = job
+        video_url = resolve_episode(ep_url)
+        if not video_url:
+            print(f"{Fore.YELLOW}Impossibile trovare l'URL video per l'episodio {ep_num} - {ep_title}.")
+        return video_url
+
+    def download(job, video_url, progress, on_size):
+        output_dir, ep_num, ep_title, ep_url = job
+        return download_resolved_episode(ep_num, ep_title, ep_url, video_url, output_dir, progress, on_size)
+
+    def finished(job, ok):
+        print(f"{Fore.CYAN}Progresso: {pipeline.progress.done_jobs}/{pipeline.progress.total_jobs} episodi completati.")
+        if on_finished:
+            on_finished(job, ok)
+
+    pipeline = DownloadPipeline(resolve, download, resolve_workers=resolve_workers, download_workers=download_workers,
+                                bandwidth=bandwidth_kbps * 1024, on_finished=finished)
+    for job in jobs:
+        output_dir, ep_num, ep_title, ep_url = job
+        # Gli episodi già completi vengono saltati prima di qualunque richiesta al sito
+        if is_episode_downloaded(ep_num, output_dir):
+            print(f"{Fore.BLUE}Episodio {ep_num} - {ep_title} già scaricato, salto.")
+            results[job] = True
+            if on_finished:
+                on_finished(job, True)
+        else:
+            pipeline.submit(ep_num, job)
+    if report is None:
+        report = lambda progress: print(f"{Fore.CYAN}Download: {progress.format()}")
+    results.update(pipeline.run(report=report))
+    return results
 
 def print_menu(options):
     for i, option in enumerate(options, 1):
@@ -1,19 +1,46 @@
 import os
-from flask import Flask, render_template, request, jsonify, Response, redirect, url_for, session, send_file, abort
+from dotenv import load_dotenv
+
+# Carica le variabili d'ambiente dal file .env prima dei moduli che le leggono all'import
+# (http_client, rate_limiter, mirrors, cache, metrics, proxy...) e delle impostazioni qui sotto
+load_dotenv()
+
+from flask import Flask, render_template, request, jsonify, Response, redirect, url_for, session, send_file, abort, stream_with_context, g
 from flask_sqlalchemy import SQLAlchemy
 import requests
+import http_client
+import video_extractor
+import async_scraper
+import stream_proxy
+import hls_proxy
+import image_proxy
+import metrics
+import rate_limiter
+import mirrors
+from episode_parser import parse_episode_page
+from cache import Cache, MemoryBackend, DBBackend
+from title_index import TitleIndex
+from catalogue_store import CatalogueStore
+from metadata_store import MetadataStore
+from playlist_store import PlaylistStore, PlaylistNotFound
 from bs4 import BeautifulSoup
 import re
-from urllib.parse import urljoin, unquote
+from urllib.parse import urljoin, urlparse, quote, unquote
 from collections import defaultdict
-from dotenv import load_dotenv
 from tmdbv3api import TMDb, TV, Season, Episode
 from fuzzywuzzy import fuzz
 import json
-import uuid
+import base64
+import gzip
+import hashlib
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+import time
+import contextvars
 from flask_cors import CORS
 
 app = Flask(__name__)
+log = metrics.get_logger('app')
 CORS(app, resources={r"/*": {"origins": ["http://localhost:5000", "https://animescraper.onrender.com"]}})
 
 # Configurazione del database
@@ -35,10 +62,110 @@ class SharedPlaylist(db.Model):
         self.name = name
         self.playlist = playlist
 
-BASE_URL = "https://www.animesaturn.cx"
-
-# Carica le variabili d'ambiente dal file .env
-load_dotenv()
+# Playlist condivise normalizzate: SharedPlaylist resta solo per le playlist salvate nel vecchio formato
+class Playlist(db.Model):
+    id = db.Column(db.String(36), primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    series_count = db.Column(db.Integer, nullable=False, default=0)
+    episode_count = db.Column(db.Integer, nullable=False, default=0)
+    version = db.Column(db.Integer, nullable=False, default=1)
+    updated_at = db.Column(db.Float, nullable=False)
+
+class PlaylistSeries(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    playlist_id = db.Column(db.String(36), db.ForeignKey('playlist.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.String(255), nullable=False)
+    episode_count = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.Index('ix_playlist_series_playlist_position', 'playlist_id', 'position'),)
+
+class PlaylistEpisode(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    series_id = db.Column(db.Integer, db.ForeignKey('playlist_series.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.Text, nullable=False)
+    url = db.Column(db.Text, nullable=False)
+    episode_url = db.Column(db.Text)
+    __table_args__ = (db.Index('ix_playlist_episode_series_position', 'series_id', 'position'),)
+
+class SeriesMetadata(db.Model):
+    key = db.Column(db.String(255), primary_key=True)  # titolo normalizzato|stagione
+    data = db.Column(db.Text, nullable=False)  # JSON, 'null' se la serie non è su TMDb
+    fetched_at = db.Column(db.Float, nullable=False)
+
+class CacheEntry(db.Model):
+    key = db.Column(db.String(40), primary_key=True)
+    value = db.Column(db.Text, nullable=False)
+    expires_at = db.Column(db.Float, nullable=False)
+    accessed_at = db.Column(db.Float, nullable=False, index=True)
+
+# Copia locale del catalogo, aggiornata in background da catalogue_store
+class CatalogueSeries(db.Model):
+    url = db.Column(db.String(512), primary_key=True)  # URL canonico della pagina della serie
+    title = db.Column(db.String(255), nullable=False)
+    search_title = db.Column(db.String(255), nullable=False)  # titolo normalizzato per la ricerca
+    thumbnail = db.Column(db.Text)
+    episode_count = db.Column(db.Integer, nullable=False, default=0)
+    airing = db.Column(db.Boolean, nullable=False, default=False)
+    etag = db.Column(db.String(255))
+    last_modified = db.Column(db.String(64))
+    content_hash = db.Column(db.String(40))
+    fetched_at = db.Column(db.Float)  # None: episodi mai scaricati
+    changed_at = db.Column(db.Float)  # ultimi episodi nuovi
+    next_check_at = db.Column(db.Float, nullable=False, default=0, index=True)
+
+class CatalogueEpisode(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    series_url = db.Column(db.String(512), db.ForeignKey('catalogue_series.url'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    label = db.Column(db.Text, nullable=False)
+    title = db.Column(db.Text, nullable=False)
+    url = db.Column(db.Text, nullable=False)
+    __table_args__ = (db.Index('ix_catalogue_episode_series_position', 'series_url', 'position'),)
+
+class CataloguePage(db.Model):
+    page = db.Column(db.Integer, primary_key=True)
+    entry_count = db.Column(db.Integer, nullable=False, default=-1)  # 0: oltre l'ultima pagina, -1: mai letta
+    etag = db.Column(db.String(255))
+    last_modified = db.Column(db.String(64))
+    content_hash = db.Column(db.String(40))
+    fetched_at = db.Column(db.Float)
+    next_check_at = db.Column(db.Float, nullable=False, default=0)
+
+class UpstreamLimit(db.Model):
+    host = db.Column(db.String(255), primary_key=True)
+    state = db.Column(db.Text, nullable=False)  # JSON: token, richieste in volo, backoff
+
+# Domini del sito (ANIMESATURN_MIRRORS, o ANIMESATURN_URL per uno solo, es. benchmarks/standin.py):
+# le richieste vanno al mirror più veloce, gli URL restituiti usano sempre il primo
+site = mirrors.MirrorPool()
+BASE_URL = site.canonical_url
+
+# 'sync' usa requests (http_client); 'async' delega le funzioni di scraping ad aiohttp (async_scraper)
+SCRAPER_ENGINE = os.getenv('SCRAPER_ENGINE', 'sync')
+async_engine = async_scraper.AsyncScraper(BASE_URL, site=site)
+
+# Proxy HLS con cache dei segmenti condivisa tra gli spettatori dello stesso episodio
+hls = hls_proxy.HLSProxy()
+
+# Proxy delle immagini (/img): miniature e poster scaricati una volta, ridimensionati e tenuti in cache su disco
+IMG_PROXY = int(os.getenv('IMG_PROXY', 1))  # 0: ai client vanno gli URL delle immagini di origine
+IMG_ALLOWED_HOSTS = [host.strip() for host in os.getenv('IMG_ALLOWED_HOSTS', 'image.tmdb.org').split(',') if host.strip()]
+
+def image_allowed(url):
+    """Solo immagini dei mirror del sito (e loro sottodomini) e degli host in IMG_ALLOWED_HOSTS."""
+    parsed = urlparse(url)
+    host = parsed.hostname or ''
+    allowed = IMG_ALLOWED_HOSTS + [urlparse(mirror.url).hostname.removeprefix('www.') for mirror in site.mirrors]
+    return parsed.scheme in ('http', 'https') and any(host == name or host.endswith('.' + name) for name in allowed)
+
+images = image_proxy.ImageProxy(image_allowed)
+
+def image_url(url, size):
+    return image_proxy.image_path(url, size) if IMG_PROXY else url
+
+# Numero massimo di episodi risolti in parallelo da /resolve_series
+MAX_RESOLVE_WORKERS = int(os.getenv('MAX_RESOLVE_WORKERS', 8))
 
 # Configurazione TMDb
 tmdb = TMDb()
@@ -46,191 +173,270 @@ tmdb.api_key = os.getenv('TMDB_API_KEY')
 tmdb.language = 'it,en'  # Modifica questa riga
 tv = TV()
 season = Season()
+# API alternativa con lo stesso formato di TMDb (es. benchmarks/standin.py)
+TMDB_API_BASE = os.getenv('TMDB_API_BASE')
+if TMDB_API_BASE:
+    tv._base = season._base = TMDB_API_BASE.rstrip('/')
+# Le chiamate a TMDb passano dalla session condivisa (pool, retry, limiti per host);
+# la cache interna di tmdbv3api non serve: i metadata sono già in metadata_store
+tmdb.cache = False
+tv._session = season._session = http_client.session
+
+# Limiti di richieste verso il sito e TMDb, condivisi tra i worker (file locale o database)
+if rate_limiter.BACKEND == 'db':
+    http_client.limiter.backend = rate_limiter.DBBackend(app, db, UpstreamLimit)
+for mirror in site.mirrors:
+    http_client.limiter.limit(mirror.netloc, rate_limiter.SITE_POLICY)
+http_client.limiter.limit(urlparse(tv._base).netloc, rate_limiter.TMDB_POLICY)
+
+# Configurazione cache: 'memory' (solo processo locale) o 'db' (memoria + database condiviso tra i worker)
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+CACHE_MAX_BYTES = int(os.getenv('CACHE_MAX_BYTES', 64 * 1024 * 1024))
+CACHE_TTL_SEARCH = int(os.getenv('CACHE_TTL_SEARCH', 600))
+CACHE_TTL_EPISODES = int(os.getenv('CACHE_TTL_EPISODES', 3600))
+CACHE_TTL_STREAM = int(os.getenv('CACHE_TTL_STREAM', 300))  # gli URL dei CDN scadono
+CACHE_TTL_M3U = int(os.getenv('CACHE_TTL_M3U', 24 * 3600))
+# ETag delle playlist condivise tenuto in cache (risponde 304 senza leggere il database):
+# gli altri worker vedono un aggiornamento al più dopo questo intervallo
+CACHE_TTL_M3U_ETAG = int(os.getenv('CACHE_TTL_M3U_ETAG', 60))
+
+cache_backends = [MemoryBackend(max_bytes=CACHE_MAX_BYTES)]
+if CACHE_BACKEND == 'db':
+    cache_backends.append(DBBackend(app, db, CacheEntry))
+cache = Cache(cache_backends)
+
+# Indice locale dei titoli per /search_suggestions, aggiornato in background dal catalogo
+TITLE_INDEX_PATH = os.getenv('TITLE_INDEX_PATH', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'title_index.json'))
+TITLE_INDEX_REFRESH = int(os.getenv('TITLE_INDEX_REFRESH', 6 * 3600))  # 0 disabilita l'aggiornamento
+
+# Copia locale del catalogo: /search e /episodes leggono dal database, il crawler in background
+# ricontrolla le pagine (prima le serie in corso) e scarica solo quello che è cambiato
+CATALOGUE_SYNC = int(os.getenv('CATALOGUE_SYNC', 1))  # 0 disabilita la copia locale
+catalogue = (CatalogueStore(app, db, CatalogueSeries, CatalogueEpisode, CataloguePage, BASE_URL, site=site,
+                            on_change=lambda series_url: cache.delete('episodes', series_url))
+             if CATALOGUE_SYNC else None)
+
+title_index = TitleIndex(TITLE_INDEX_PATH)
+title_index.load()
+site.start_probes()
+
+# Metadata TMDb: riscaricati dopo METADATA_TTL, le serie non trovate dopo METADATA_NEGATIVE_TTL
+METADATA_TTL = int(os.getenv('METADATA_TTL', 7 * 24 * 3600))
+METADATA_NEGATIVE_TTL = int(os.getenv('METADATA_NEGATIVE_TTL', 24 * 3600))
+metadata_store = MetadataStore(app, db, SeriesMetadata, METADATA_TTL, METADATA_NEGATIVE_TTL)
+
+playlist_store = PlaylistStore(app, db, Playlist, PlaylistSeries, PlaylistEpisode, legacy_model=SharedPlaylist)
 
 # Dizionario per memorizzare i titoli rinominati
 renamed_titles = {}
+# Cambia a ogni rinomina: i titoli influiscono sulle playlist M3U già generate
+renamed_titles_version = 0
 
 app.secret_key = os.getenv('SECRET_KEY', 'una_chiave_segreta_predefinita')
 
+# Metriche per endpoint (in /metrics, separate per ogni worker di gunicorn). Con l'header
+# X-Trace la risposta riporta anche i tempi di ogni fase (Server-Timing) e l'id della traccia
+TRACE_HEADER = 'X-Trace'
+_trace_id_re = re.compile(r'[\w.-]{1,64}')
+http_requests = metrics.counter('animescraper_http_requests_total', "Richieste HTTP servite", ('endpoint', 'method', 'status'))
+http_request_seconds = metrics.histogram('animescraper_http_request_duration_seconds',
+                                         "Durata delle richieste fino all'invio degli header", ('endpoint',))
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    trace_id = request.headers.get(TRACE_HEADER)
+    if trace_id:
+        # Un id scelto dal client permette di ritrovare la richiesta nei suoi log
+        metrics.start_trace(trace_id if _trace_id_re.fullmatch(trace_id) and trace_id != '1' else None)
+
+@app.after_request
+def finish_request_metrics(response):
+    endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+    elapsed = time.perf_counter() - g.get('request_started', time.perf_counter())
+    http_requests.inc(endpoint=endpoint, method=request.method, status=response.status_code)
+    http_request_seconds.observe(elapsed, endpoint=endpoint)
+    trace = metrics.current_trace()
+    if trace is not None:
+        timing = ', '.join(part for part in (response.headers.get('Server-Timing'), trace.server_timing(),
+                                             f'total;dur={elapsed * 1000:.1f}') if part)
+        response.headers['Server-Timing'] = timing
+        response.headers['X-Trace-Id'] = trace.id
+        log.info("Traccia %s: %s %s -> %d, %s", trace.id, request.method, request.path, response.status_code, timing)
+    return response
+
+@app.teardown_request
+def end_request_trace(exc):
+    metrics.end_trace()
+
 @app.route('/rename_title', methods=['POST'])
 def rename_title():
     data = request.json
     original_title = data['original_title']
     new_title = data['new_title']
     renamed_titles[original_title] = new_title
+    global renamed_titles_version
+    renamed_titles_version += 1
     return jsonify({"message": "Titolo rinominato con successo"})
 
+@cache.memoize('search', CACHE_TTL_SEARCH, key=lambda query: query.strip().lower())
 def search_anime(query):
+    if catalogue is not None:
+        # Una serie appena uscita può non essere ancora nella copia locale: allora si chiede al sito
+        results = catalogue.search(query)
+        if results:
+            return results
+    if SCRAPER_ENGINE == 'async':
+        return async_scraper.run(async_engine.search_anime(query))
     search_url = urljoin(BASE_URL, f"/animelist?search={query}")
-    response = requests.get(search_url)
+    response = site.get(search_url)
     response.raise_for_status()
-    soup = BeautifulSoup(response.text, 'html.parser')
-    results = soup.find_all('a', class_='badge-archivio')
-    return [{"title": result.text.strip(), "url": urljoin(BASE_URL, result['href'])} for result in results]
+    with metrics.span('html_parse'):
+        soup = BeautifulSoup(response.text, 'html.parser')
+        results = soup.find_all('a', class_='badge-archivio')
+    return [{"title": result.text.strip(), "url": site.canonical(urljoin(BASE_URL, result['href']))} for result in results]
 
+@cache.memoize('episodes', CACHE_TTL_EPISODES, key=lambda anime_url: anime_url)
 def get_episodes(anime_url):
-    response = requests.get(anime_url)
+    if catalogue is not None:
+        # Le serie che il crawler non conosce vengono lette dal sito senza salvarle
+        episodes = catalogue.episodes(anime_url)
+        if episodes is not None:
+            return format_episodes(episodes)
+    if SCRAPER_ENGINE == 'async':
+        return format_episodes(async_scraper.run(async_engine.get_episodes(anime_url)))
+    response = site.get(anime_url)
     response.raise_for_status()
-    soup = BeautifulSoup(response.text, 'html.parser')
-    episodes = soup.find_all('a', class_='bottone-ep')
+    return format_episodes(parse_episode_page(response.text, BASE_URL))
+
+def format_episodes(episodes):
     episode_data = []
 
     for ep in episodes:
-        thumbnail_container = ep.find_previous('div', class_='container shadow rounded bg-dark-as-box mb-3 p-3 w-100 d-flex justify-content-center')
-        thumbnail_url = None
-        if thumbnail_container:
-            thumbnail_img = thumbnail_container.find('img', class_='img-fluid cover-anime rounded')
-            if thumbnail_img and 'src' in thumbnail_img.attrs:
-                thumbnail_url = thumbnail_img['src']
-
-        episode_title = ep.get('title', '') or ep.text.strip()
+        episode_title = ep.title or ep.label
         if not episode_title:
             episode_title = f"Episodio {len(episode_data) + 1}"
 
+        url = site.canonical(ep.url)
         episode_data.append({
             "title": episode_title,
-            "url": urljoin(BASE_URL, ep['href']),
-            "thumbnail": thumbnail_url
+            "url": url,
+            "play_path": play_path(url),
+            "thumbnail": image_url(site.canonical(ep.thumbnail), 'thumb') if ep.thumbnail else None
         })
 
     return episode_data
 
+def episode_id(episode_url):
+    """Identificativo stabile di un episodio: il percorso della sua pagina sul sito."""
+    return urlparse(episode_url).path.lstrip('/')
+
+def play_path(episode_url):
+    """Percorso /play dell'episodio, da usare nelle playlist al posto dell'URL del CDN."""
+    return '/play/' + quote(episode_id(episode_url))
+
+# Più player che aprono lo stesso episodio insieme: una sola risoluzione
+@cache.memoize('stream', CACHE_TTL_STREAM, key=lambda episode_url: episode_url, coalesce=True)
 def get_streaming_url(episode_url):
+    if SCRAPER_ENGINE == 'async':
+        return async_scraper.run(async_engine.get_streaming_url(episode_url))
     try:
-        print(f"DEBUG: Inizio estrazione URL streaming da: {episode_url}")
-        response = requests.get(episode_url)
+        log.debug("Inizio estrazione URL streaming da: %s", episode_url)
+        response = site.get(episode_url)
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-        streaming_link = soup.find('a', href=lambda href: href and 'watch?file=' in href)
+        streaming_link = video_extractor.find_watch_link(response.text)
         if streaming_link:
-            watch_url = urljoin(BASE_URL, streaming_link['href'])
-            print(f"DEBUG: URL watch trovato: {watch_url}")
+            watch_url = urljoin(BASE_URL, streaming_link)
+            log.debug("URL watch trovato: %s", watch_url)
             video_url = extract_video_url(watch_url)
             if video_url:
-                print(f"DEBUG: URL video estratto con successo: {video_url}")
+                log.debug("URL video estratto con successo: %s", video_url)
                 return video_url
             else:
-                print("DEBUG: Impossibile estrarre l'URL video dalla pagina watch")
+                log.info("Impossibile estrarre l'URL video dalla pagina watch %s", watch_url)
         else:
-            print("DEBUG: Nessun link di streaming trovato nella pagina dell'episodio")
+            log.info("Nessun link di streaming trovato nella pagina dell'episodio %s", episode_url)
     except requests.RequestException as e:
-        print(f"DEBUG: Errore durante la richiesta HTTP: {str(e)}")
-    except Exception as e:
-        print(f"DEBUG: Errore imprevisto durante l'estrazione dell'URL streaming: {str(e)}")
+        log.warning("Errore durante la richiesta HTTP: %s", e)
+    except Exception:
+        log.exception("Errore imprevisto durante l'estrazione dell'URL streaming")
     return None
 
 def extract_video_url(url):
     try:
-        print(f"DEBUG: Inizio estrazione URL video da: {url}")
-        response = requests.get(url)
-        response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
-
-        iframe = soup.find('iframe')
-        if iframe and 'src' in iframe.attrs:
-            iframe_src = iframe['src']
-            print(f"DEBUG: URL iframe trovato: {iframe_src}")
-            iframe_response = requests.get(iframe_src)
-            iframe_response.raise_for_status()
-            video_pattern = r'(https?://.*?\.(?:m3u8|mp4))'
-
-            iframe_soup = BeautifulSoup(iframe_response.text, 'html.parser')
-            for script in iframe_soup.find_all('script'):
-                match = re.search(video_pattern, str(script))
-                if match:
-                    video_url = match.group(0)
-                    print(f"DEBUG: URL video trovato nello script dell'iframe: {video_url}")
-                    return video_url
-
-            match = re.search(video_pattern, iframe_response.text)
-            if match:
-                video_url = match.group(0)
-                print(f"DEBUG: URL video trovato nel testo dell'iframe: {video_url}")
-                return video_url
-
-        video_pattern = r'(https?://.*?\.(?:m3u8|mp4))'
-        for script in soup.find_all('script'):
-            match = re.search(video_pattern, str(script))
-            if match:
-                video_url = match.group(0)
-                print(f"DEBUG: URL video trovato nello script della pagina principale: {video_url}")
-                return video_url
-
-        match = re.search(video_pattern, response.text)
-        if match:
-            video_url = match.group(0)
-            print(f"DEBUG: URL video trovato nel testo della pagina principale: {video_url}")
-            return video_url
-
-        print("DEBUG: Nessun URL video trovato")
+        log.debug("Inizio estrazione URL video da: %s", url)
+        candidates = video_extractor.extract_video_urls(url, get=site.get)
+        if candidates:
+            log.debug("URL video trovato (%d candidati): %s", len(candidates), candidates[0].url)
+            return candidates[0].url
+        log.info("Nessun URL video trovato in %s", url)
     except requests.RequestException as e:
-        print(f"DEBUG: Errore durante la richiesta HTTP: {str(e)}")
-    except Exception as e:
-        print(f"DEBUG: Errore imprevisto durante l'estrazione dell'URL video: {str(e)}")
+        log.warning("Errore durante la richiesta HTTP: %s", e)
+    except Exception:
+        log.exception("Errore imprevisto durante l'estrazione dell'URL video")
 
     return None
 
+def normalize_series_title(title, season_number=1):
+    search_title = renamed_titles.get(title, title)
+    search_title = re.sub(r'\s*(\(ITA\)|\(SUB ITA\)|\(TV\)|\(OAV\)|\(OVA\))\s*', '', search_title).strip()
+
+    # Rimuovi il numero della stagione dal titolo di ricerca
+    season_match = re.search(r'\s+(\d+)$', search_title)
+    if season_match:
+        season_number = int(season_match.group(1))
+        search_title = re.sub(r'\s+\d+$', '', search_title)
+    return search_title, season_number
+
 def get_series_metadata(title, season_number=1):
-    try:
-        print(f"DEBUG: Cercando serie su TMDb: {title}")
-        search_title = renamed_titles.get(title, title)
-        search_title = re.sub(r'\s*(\(ITA\)|\(SUB ITA\)|\(TV\)|\(OAV\)|\(OVA\))\s*', '', search_title).strip()
-        
-        # Rimuovi il numero della stagione dal titolo di ricerca
-        original_season_number = season_number
-        season_match = re.search(r'\s+(\d+)$', search_title)
-        if season_match:
-            season_number = int(season_match.group(1))
-            search_title = re.sub(r'\s+\d+$', '', search_title)
-        
-        print(f"DEBUG: Titolo di ricerca modificato: {search_title}, Stagione: {season_number}")
-        
-        search = tv.search(search_title)
-        if not search:
-            print(f"DEBUG: Nessun risultato trovato per '{search_title}', provo con la prima metà del titolo")
-            search = tv.search(search_title[:len(search_title)//2])
-        
-        if search:
-            best_match = max(search, key=lambda x: fuzz.ratio(x.name.lower(), search_title.lower()))
-            print(f"DEBUG: Serie trovata su TMDb: {best_match.name} (ID: {best_match.id})")
-            details = tv.details(best_match.id)
-            
-            # Cerca la stagione specificata
-            target_season = next((s for s in details.seasons if s.season_number == season_number), None)
-            if not target_season:
-                print(f"DEBUG: Stagione {season_number} non trovata, uso la prima stagione disponibile")
-                target_season = details.seasons[0]
-            
-            print(f"DEBUG: Recuperando dettagli per la stagione {target_season.season_number}")
-            season_details = Season().details(best_match.id, target_season.season_number)
-            episodes = []
-            for ep in season_details.episodes:
-                episode_name = ep.name if ep.name else f"Episodio {ep.episode_number}"
-                episodes.append({
-                    'season_number': target_season.season_number,
-                    'episode_number': ep.episode_number,
-                    'name': episode_name,
-                    'title': f"S{target_season.season_number}E{ep.episode_number} - {episode_name}"
-                })
-            print(f"DEBUG: Totale episodi trovati: {len(episodes)}")
-            return {
-                'id': best_match.id,
-                'title': f"{details.name} - Stagione {season_number}",
-                'original_title': details.original_name,
-                'overview': details.overview,
-                'first_air_date': details.first_air_date,
-                'genres': [genre['name'] for genre in details.genres],
-                'poster_path': f"https://image.tmdb.org/t/p/w500{details.poster_path}" if details.poster_path else None,
-                'episodes': episodes,
-                'season_number': target_season.season_number
-            }
-        
-        print(f"DEBUG: Nessuna serie trovata su TMDb per: {search_title}")
-    except Exception as e:
-        print(f"DEBUG: Errore nel recupero dei metadata da TMDb: {e}")
-        import traceback
-        traceback.print_exc()
-    return None
+    search_title, season_number = normalize_series_title(title, season_number)
+    log.debug("Metadata per %s: titolo di ricerca %s, stagione %d", title, search_title, season_number)
+    key = f"{search_title.lower()}|{season_number}"
+    return metadata_store.get(key, lambda: fetch_series_metadata(search_title, season_number))
+
+@metrics.timed('tmdb')
+def fetch_series_metadata(search_title, season_number):
+    search = tv.search(search_title)
+    if not search:
+        log.debug("Nessun risultato trovato per '%s', provo con la prima metà del titolo", search_title)
+        search = tv.search(search_title[:len(search_title)//2])
+
+    if not search:
+        log.info("Nessuna serie trovata su TMDb per: %s", search_title)
+        return None
+
+    best_match = max(search, key=lambda x: fuzz.ratio(x.name.lower(), search_title.lower()))
+    log.debug("Serie trovata su TMDb: %s (ID: %s)", best_match.name, best_match.id)
+    details = tv.details(best_match.id)
+
+    # Cerca la stagione specificata
+    target_season = next((s for s in details.seasons if s.season_number == season_number), None)
+    if not target_season:
+        log.debug("Stagione %d non trovata, uso la prima stagione disponibile", season_number)
+        target_season = details.seasons[0]
+
+    season_details = season.details(best_match.id, target_season.season_number)
+    episodes = []
+    for ep in season_details.episodes:
+        episode_name = ep.name if ep.name else f"Episodio {ep.episode_number}"
+        episodes.append({
+            'season_number': target_season.season_number,
+            'episode_number': ep.episode_number,
+            'name': episode_name,
+            'title': f"S{target_season.season_number}E{ep.episode_number} - {episode_name}"
+        })
+    log.debug("Episodi trovati su TMDb per %s: %d", search_title, len(episodes))
+    return {
+        'id': best_match.id,
+        'title': f"{details.name} - Stagione {season_number}",
+        'original_title': details.original_name,
+        'overview': details.overview,
+        'first_air_date': details.first_air_date,
+        'genres': [genre['name'] for genre in details.genres],
+        'poster_path': f"https://image.tmdb.org/t/p/w500{details.poster_path}" if details.poster_path else None,
+        'episodes': episodes,
+        'season_number': target_season.season_number
+    }
 
 @app.route('/')
 def index():
@@ -245,77 +451,240 @@ def search():
 @app.route('/search_suggestions', methods=['POST'])
 def search_suggestions():
     query = request.form['query']
-    results = search_anime(query)[:10]  # Limita a 10 suggerimenti
+    results = title_index.suggest(query, limit=10)  # Limita a 10 suggerimenti
+    if not results:
+        # Titolo non ancora nell'indice: ricerca remota e aggiunta all'indice
+        results = search_anime(query)[:10]
+        title_index.add(results)
     return jsonify(results)
 
 @app.route('/episodes', methods=['POST'])
 def episodes():
     anime_url = request.form['anime_url']
-    print(f"Richiesta per gli episodi di: {anime_url}")
     episodes = get_episodes(anime_url)
-    print(f"Episodi trovati: {episodes}")
+    log.debug("Episodi di %s: %d", anime_url, len(episodes))
     return jsonify(episodes)
 
 @app.route('/stream', methods=['POST'])
 def stream():
     episode_url = request.form['episode_url']
-    print(f"DEBUG: Richiesta per lo streaming dell'episodio: {episode_url}")
     video_url = get_streaming_url(episode_url)
     if video_url:
-        print(f"DEBUG: URL video estratto: {video_url}")
         return jsonify({"video_url": video_url})
-    print("DEBUG: Impossibile trovare il link dello streaming.")
     return jsonify({"error": "Impossibile trovare il link dello streaming."}), 404
 
-@app.route('/save_playlist', methods=['POST'])
-def save_playlist():
-    playlist = request.json['playlist']
-    playlist_name = request.json.get('playlist_name', '').strip()
-    
-    if not playlist_name:
-        return jsonify({"error": "Il nome della playlist non può essere vuoto"}), 400
-    
-    m3u_content = "#EXTM3U\n"
-    
+@app.route('/resolve_series', methods=['POST'])
+def resolve_series():
+    anime_url = request.form.get('anime_url')
+    if not anime_url:
+        return jsonify({"error": "URL anime mancante"}), 400
+
+    episodes = get_episodes(anime_url)
+
+    # Risolve tutti gli episodi in parallelo e restituisce una riga NDJSON
+    # per ogni episodio non appena è pronto (l'ordine non è garantito)
+    def generate():
+        yield json.dumps({"type": "start", "total": len(episodes)}) + "\n"
+        executor = ThreadPoolExecutor(max_workers=MAX_RESOLVE_WORKERS)
+        try:
+            futures = {executor.submit(get_streaming_url, ep['url']): i for i, ep in enumerate(episodes)}
+            resolved = 0
+            for future in as_completed(futures):
+                index = futures[future]
+                episode = episodes[index]
+                video_url = future.result()
+                if video_url:
+                    resolved += 1
+                yield json.dumps({
+                    "type": "episode",
+                    "index": index,
+                    "title": episode['title'],
+                    "episode_url": episode['url'],
+                    "video_url": video_url
+                }) + "\n"
+            yield json.dumps({"type": "done", "total": len(episodes), "resolved": resolved}) + "\n"
+        finally:
+            # Se il client si disconnette non serve risolvere gli episodi rimanenti
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/play/<path:episode_id>')
+def play(episode_id):
+    # L'URL del CDN viene risolto solo quando un player apre l'episodio (e scade presto)
+    episode_url = urljoin(BASE_URL, '/' + episode_id)
+    video_url = get_streaming_url(episode_url)
+    if not video_url:
+        return "Impossibile trovare il link dello streaming.", 404
+    response = redirect(video_url, code=302)
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+M3U_FORMAT_VERSION = 1
+
+# Metadata delle serie di una playlist cercati in parallelo, con un limite di tempo per serie
+METADATA_WORKERS = int(os.getenv('METADATA_WORKERS', 8))
+METADATA_TIMEOUT = float(os.getenv('METADATA_TIMEOUT', 8))
+metadata_executor = ThreadPoolExecutor(max_workers=METADATA_WORKERS, thread_name_prefix='metadata')
+
+def _timed_series_metadata(series_title, season_number):
+    started = time.perf_counter()
+    metadata = get_series_metadata(series_title, season_number)
+    return metadata, time.perf_counter() - started
+
+def enrich_playlist(playlist, season_titles=True, timeout=METADATA_TIMEOUT):
+    """Cerca i metadata di tutte le serie in parallelo e li restituisce nell'ordine della playlist.
+
+    Restituisce ([(serie, metadata, stagione)], [(titolo, secondi, esito)]). Una serie che
+    supera timeout (o va in errore) resta senza metadata e userà titoli generici, senza
+    rallentare le altre; la ricerca continua in background e finisce comunque in cache.
+    """
+    jobs = []
     for series in playlist:
+        season_number = 1
+        if season_titles:
+            # Estrai il numero della stagione dal titolo, se presente
+            season_match = re.search(r'\s+(\d+)$', series['title'])
+            season_number = int(season_match.group(1)) if season_match else 1
+        # copy_context: le fasi dei thread (TMDb, database) finiscono nella traccia della richiesta
+        jobs.append((series, season_number, metadata_executor.submit(
+            contextvars.copy_context().run, _timed_series_metadata, series['title'], season_number)))
+
+    # Tutte le ricerche partono insieme: il limite di tempo è calcolato dallo stesso istante
+    deadline = time.perf_counter() + timeout
+    enriched = []
+    timings = []
+    for series, season_number, future in jobs:
+        try:
+            metadata, elapsed = future.result(timeout=max(0, deadline - time.perf_counter()))
+            outcome = 'ok' if metadata else 'not_found'
+        except FutureTimeoutError:
+            metadata, elapsed, outcome = None, timeout, 'timeout'
+            log.warning("Timeout dei metadata per %s dopo %ss, uso titoli generici", series['title'], timeout)
+        except Exception as e:
+            metadata, elapsed, outcome = None, None, 'error'
+            log.warning("Errore nei metadata per %s: %s", series['title'], e)
+        enriched.append((series, metadata, season_number))
+        timings.append((series['title'], elapsed, outcome))
+    return enriched, timings
+
+def server_timing(timings):
+    """Header Server-Timing con la durata della ricerca dei metadata di ogni serie."""
+    entries = []
+    for index, (title, elapsed, outcome) in enumerate(timings):
+        description = title.encode('ascii', 'ignore').decode('ascii').replace('"', "'")
+        entry = f'series{index};desc="{description} ({outcome})"'
+        if elapsed is not None:
+            entry += f';dur={elapsed * 1000:.1f}'
+        entries.append(entry)
+    return ', '.join(entries)
+
+def iter_m3u(enriched, season_titles=True):
+    """Genera la playlist M3U una serie alla volta a partire da enrich_playlist().
+
+    Con season_titles gli episodi sono "S1E3 - ...", altrimenti "Ep. 3 - ...".
+    """
+    yield "#EXTM3U\n"
+    for series, metadata, season_number in enriched:
         series_title = series['title']
-        print(f"DEBUG: Elaborazione serie: {series_title}")
-        
-        # Estrai il numero della stagione dal titolo, se presente
-        season_match = re.search(r'\s+(\d+)$', series_title)
-        season_number = int(season_match.group(1)) if season_match else 1
-        
-        metadata = get_series_metadata(series_title, season_number)
-        
         if metadata and 'episodes' in metadata:
             tmdb_episodes = {ep['episode_number']: ep['name'] for ep in metadata['episodes']}
-            print(f"DEBUG: Episodi trovati su TMDb per {series_title} (Stagione {metadata['season_number']}): {tmdb_episodes}")
+            season_number = metadata.get('season_number', season_number)
         else:
             tmdb_episodes = {}
-            print(f"DEBUG: Nessun episodio trovato su TMDb per {series_title}")
-        
-        for i, episode in enumerate(series['episodes'], 1):
-            episode_number = i
-            episode_title = tmdb_episodes.get(episode_number)
-            
-            if episode_title:
-                print(f"DEBUG: Usando titolo TMDb per episodio {episode_number}: {episode_title}")
-                m3u_content += f"#EXTINF:-1,S{metadata['season_number']}E{episode_number} - {episode_title} - {series_title}\n"
-            else:
-                print(f"DEBUG: Usando titolo generico per episodio {episode_number}")
-                m3u_content += f"#EXTINF:-1,S{metadata['season_number']}E{episode_number} - Episodio {episode_number} - {series_title}\n"
-            
-            m3u_content += f"{episode['url']}\n"
-        
-        m3u_content += "#EXT-X-ENDLIST\n\n"  # Separatore tra serie
-    
-    print(f"DEBUG: Contenuto M3U generato:\n{m3u_content}")
+
+        lines = []
+        for episode_number, episode in enumerate(series['episodes'], 1):
+            episode_title = tmdb_episodes.get(episode_number) or f"Episodio {episode_number}"
+            prefix = f"S{season_number}E{episode_number}" if season_titles else f"Ep. {episode_number}"
+            lines.append(f"#EXTINF:-1,{prefix} - {episode_title} - {series_title}\n{episode['url']}\n")
+        lines.append("#EXT-X-ENDLIST\n\n")  # Separatore tra serie
+        yield ''.join(lines)
+
+def m3u_etag(*parts):
+    """Versione del contenuto M3U: cambia se cambiano playlist, nome, formato o titoli rinominati."""
+    digest = hashlib.sha1()
+    for part in (M3U_FORMAT_VERSION, renamed_titles_version) + parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\0')
+    return digest.hexdigest()
+
+def encoded_etag(etag):
+    """ETag della rappresentazione inviata a questo client: il corpo gzip ha un ETag diverso da quello non compresso."""
+    return f'{etag}-gzip' if 'gzip' in request.accept_encodings else etag
+
+def m3u_not_modified(etag):
+    return request.if_none_match.contains(encoded_etag(etag))
+
+def m3u_response(etag, load_playlist, playlist_name, season_titles):
+    """Risposta M3U: dalla cache se già generata per questo etag, altrimenti generata in streaming
+    (compressa con gzip se il client lo accetta) e salvata in cache a fine generazione.
+    La versione gzip è in cache a parte (base64) e viene compressa una volta sola.
+    load_playlist() viene chiamata solo se serve generarla; i tempi dei metadata di
+    ogni serie sono nell'header Server-Timing."""
+    headers = {
+        'Content-Disposition': f'attachment; filename="{playlist_name}.m3u"',
+        'ETag': f'"{encoded_etag(etag)}"',
+        'Cache-Control': 'public, no-cache',
+        'Vary': 'Accept-Encoding',
+    }
+    use_gzip = 'gzip' in request.accept_encodings
+    if use_gzip:
+        headers['Content-Encoding'] = 'gzip'
+        compressed = cache.get('m3u_gzip', etag)
+        if compressed is not None:
+            return Response(base64.b64decode(compressed), mimetype='text/plain', headers=headers)
+
+    body = cache.get('m3u', etag)
+    if body is not None:
+        data = body.encode('utf-8')
+        if use_gzip:
+            data = gzip.compress(data)
+            cache.set('m3u_gzip', etag, base64.b64encode(data).decode('ascii'), CACHE_TTL_M3U)
+        return Response(data, mimetype='text/plain', headers=headers)
+
+    enriched, timings = enrich_playlist(load_playlist(), season_titles)
+    headers['Server-Timing'] = server_timing(timings)
+    # Con titoli generici dovuti a timeout o errori il risultato non va in cache
+    complete = all(outcome in ('ok', 'not_found') for _, _, outcome in timings)
+
+    def generate():
+        parts = []
+        compressed = []
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if use_gzip else None  # wbits 31 = formato gzip
+        for chunk in iter_m3u(enriched, season_titles):
+            parts.append(chunk)
+            data = chunk.encode('utf-8')
+            if compressor:
+                data = compressor.compress(data)
+                compressed.append(data)
+            if data:
+                yield data
+        if compressor:
+            data = compressor.flush()
+            compressed.append(data)
+            yield data
+        if complete:
+            cache.set('m3u', etag, ''.join(parts), CACHE_TTL_M3U)
+            if compressor:
+                cache.set('m3u_gzip', etag, base64.b64encode(b''.join(compressed)).decode('ascii'), CACHE_TTL_M3U)
+
+    return Response(generate(), mimetype='text/plain', headers=headers)
+
+def not_modified(etag):
+    return Response(status=304, headers={'ETag': f'"{encoded_etag(etag)}"', 'Cache-Control': 'public, no-cache',
+                                         'Vary': 'Accept-Encoding'})
+
+@app.route('/save_playlist', methods=['POST'])
+def save_playlist():
+    playlist = request.json['playlist']
+    playlist_name = request.json.get('playlist_name', '').strip()
     
-    return Response(
-        m3u_content,
-        mimetype='text/plain',
-        headers={'Content-Disposition': f'attachment; filename="{playlist_name}.m3u"'}
-    )
+    if not playlist_name:
+        return jsonify({"error": "Il nome della playlist non può essere vuoto"}), 400
+
+    etag = m3u_etag('save', playlist_name, json.dumps(playlist, sort_keys=True))
+    return m3u_response(etag, lambda: playlist, playlist_name, season_titles=True)
 
 @app.route('/share_playlist', methods=['POST'])
 def share_playlist():
@@ -329,82 +698,51 @@ def share_playlist():
             return jsonify({"error": "Playlist mancante"}), 400
         
         playlist_name = data.get('playlist_name', 'Playlist Anime')
-        share_id = str(uuid.uuid4())
-        
-        print(f"DEBUG: Creazione nuova playlist condivisa - ID: {share_id}, Nome: {playlist_name}")
-        
-        new_playlist = SharedPlaylist(id=share_id, name=playlist_name, playlist=json.dumps(playlist))
-        db.session.add(new_playlist)
-        db.session.commit()
+        share_id = playlist_store.create(playlist_name, playlist)
+        log.info("Playlist condivisa creata - ID: %s, Nome: %s", share_id, playlist_name)
         
         share_url = url_for('download_shared_playlist', share_id=share_id, _external=True)
-        print(f"DEBUG: Playlist condivisa creata con successo - URL: {share_url}")
         
         return jsonify({'share_url': share_url, 'share_id': share_id})
-    except Exception as e:
-        print(f"DEBUG: Errore durante la condivisione della playlist - {str(e)}")
-        db.session.rollback()
+    except Exception:
+        log.exception("Errore durante la condivisione della playlist")
         return jsonify({"error": "Si è verificato un errore durante la condivisione della playlist"}), 500
 
 @app.route('/download_shared_playlist/<share_id>')
 def download_shared_playlist(share_id):
-    shared_playlist = SharedPlaylist.query.get(share_id)
-    if not shared_playlist:
+    summary = playlist_store.summary(share_id)
+    if not summary:
         return "Playlist non trovata", 404
     
-    playlist = json.loads(shared_playlist.playlist)
-    playlist_name = shared_playlist.name
-    
-    total_episodes = sum(len(series['episodes']) for series in playlist)
-    total_series = len(playlist)
-    series_list = [{'title': series['title'], 'episode_count': len(series['episodes'])} for series in playlist]
-    
     download_url = url_for('generate_m3u', share_id=share_id, _external=True)
     
     return render_template('shared_playlist.html', 
-                           playlist_name=playlist_name,
-                           total_episodes=total_episodes,
-                           total_series=total_series,
-                           series_list=series_list,
+                           playlist_name=summary['name'],
+                           total_episodes=summary['total_episodes'],
+                           total_series=summary['total_series'],
+                           series_list=summary['series'],
                            download_url=download_url)
 
 @app.route('/generate_m3u/<share_id>')
 def generate_m3u(share_id):
-    shared_playlist = SharedPlaylist.query.get(share_id)
-    if not shared_playlist:
+    # Link condiviso già scaricato dal client e non modificato: 304 senza toccare il database
+    etag = cache.get('m3u_etag', share_id)
+    if etag and m3u_not_modified(etag):
+        return not_modified(etag)
+
+    version = playlist_store.version(share_id)
+    if not version:
         return "Playlist non trovata", 404
-    
-    playlist = json.loads(shared_playlist.playlist)
-    playlist_name = shared_playlist.name
-    
-    m3u_content = "#EXTM3U\n"
-    for series in playlist:
-        series_title = series['title']
-        metadata = get_series_metadata(series_title)
-        
-        if metadata and 'episodes' in metadata:
-            tmdb_episodes = {ep['episode_number']: ep['name'] for ep in metadata['episodes']}
-        else:
-            tmdb_episodes = {}
-        
-        for i, episode in enumerate(series['episodes'], 1):
-            episode_number = i
-            episode_title = tmdb_episodes.get(episode_number)
-            
-            if episode_title:
-                m3u_content += f"#EXTINF:-1,Ep. {episode_number} - {episode_title} - {series_title}\n"
-            else:
-                m3u_content += f"#EXTINF:-1,Ep. {episode_number} - Episodio {episode_number} - {series_title}\n"
-            
-            m3u_content += f"{episode['url']}\n"
-        
-        m3u_content += "#EXT-X-ENDLIST\n\n"  # Separatore tra serie
-    
-    return Response(
-        m3u_content,
-        mimetype='text/plain',
-        headers={'Content-Disposition': f'attachment; filename="{playlist_name}.m3u"'}
-    )
+
+    playlist_name, playlist_version = version
+    etag = m3u_etag('share', share_id, playlist_name, playlist_version)
+    cache.set('m3u_etag', share_id, etag, CACHE_TTL_M3U_ETAG)
+    if m3u_not_modified(etag):
+        return not_modified(etag)
+
+    # Gli episodi vengono letti solo se l'M3U di questa versione non è già in cache
+    return m3u_response(etag, lambda: (playlist_store.get(share_id) or {}).get('playlist', []), playlist_name,
+                        season_titles=False)
 
 @app.route('/update_shared_playlist', methods=['POST'])
 def update_shared_playlist():
@@ -417,21 +755,37 @@ def update_shared_playlist():
         if not all([playlist, playlist_name, share_id]):
             return jsonify({"error": "Dati mancanti per l'aggiornamento della playlist"}), 400
 
-        shared_playlist = SharedPlaylist.query.get(share_id)
-        if not shared_playlist:
-            return jsonify({"error": "Playlist non trovata"}), 404
-
-        shared_playlist.name = playlist_name
-        shared_playlist.playlist = json.dumps(playlist)
-        db.session.commit()
+        playlist_store.replace(share_id, playlist_name, playlist)
+        cache.delete('m3u_etag', share_id)
 
         share_url = url_for('download_shared_playlist', share_id=share_id, _external=True)
         return jsonify({'share_url': share_url, 'share_id': share_id})
-    except Exception as e:
-        print(f"DEBUG: Errore durante l'aggiornamento della playlist condivisa - {str(e)}")
-        db.session.rollback()
+    except PlaylistNotFound:
+        return jsonify({"error": "Playlist non trovata"}), 404
+    except Exception:
+        log.exception("Errore durante l'aggiornamento della playlist condivisa")
         return jsonify({"error": "Si è verificato un errore durante l'aggiornamento della playlist"}), 500
 
+@app.route('/patch_shared_playlist', methods=['POST'])
+def patch_shared_playlist():
+    # Modifiche parziali: vengono riscritte solo le serie aggiunte, rimosse o modificate
+    data = request.json or {}
+    share_id = data.get('share_id')
+    operations = data.get('operations')
+    if not share_id or not isinstance(operations, list):
+        return jsonify({"error": "Dati mancanti per l'aggiornamento della playlist"}), 400
+
+    try:
+        playlist_name, version = playlist_store.patch(share_id, operations)
+    except PlaylistNotFound:
+        return jsonify({"error": "Playlist non trovata"}), 404
+    except (ValueError, KeyError, TypeError) as e:
+        return jsonify({"error": f"Operazione non valida: {e}"}), 400
+    cache.delete('m3u_etag', share_id)
+
+    share_url = url_for('download_shared_playlist', share_id=share_id, _external=True)
+    return jsonify({'share_url': share_url, 'share_id': share_id, 'playlist_name': playlist_name, 'version': version})
+
 @app.route('/get_series_metadata', methods=['POST'])
 def get_series_metadata_route():
     data = request.json
@@ -441,7 +795,9 @@ def get_series_metadata_route():
     
     metadata = get_series_metadata(title)
     if metadata:
-        return jsonify(metadata)
+        # Il poster salvato resta l'URL di TMDb; ai client va la versione ridimensionata per le schede
+        return jsonify(dict(metadata, poster_path=image_url(metadata['poster_path'], 'card')) if metadata.get('poster_path')
+                       else metadata)
     else:
         return jsonify({"error": "Metadata non trovati"}), 404
 
@@ -449,52 +805,122 @@ def get_series_metadata_route():
 def stream_video(video_url):
     try:
         decoded_url = unquote(video_url)
-        response = requests.get(decoded_url, stream=True)
-        def generate():
-            for chunk in response.iter_content(chunk_size=8192):
-                yield chunk
-        return Response(generate(), content_type=response.headers.get('Content-Type', 'video/mp4'))
-    except Exception as e:
-        print(f"Errore nello streaming del video: {str(e)}")
+        return stream_proxy.proxy_stream(decoded_url, request.headers, default_content_type='video/mp4')
+    except Exception:
+        log.exception("Errore nello streaming del video")
         abort(500)
 
 @app.route('/proxy')
 def proxy():
     url = request.args.get('url')
     if not url:
-        print("DEBUG: URL mancante nella richiesta proxy")
         return jsonify({"error": "URL mancante"}), 400
     
-    print(f"DEBUG: Richiesta proxy per URL: {url}")
+    log.debug("Richiesta proxy per URL: %s (Range: %s)", url, request.headers.get('Range'))
     try:
-        resp = requests.get(url, stream=True, timeout=10)
-        resp.raise_for_status()
-        
-        print(f"DEBUG: Risposta proxy ricevuta. Status: {resp.status_code}, Content-Type: {resp.headers.get('Content-Type')}")
-        
-        excluded_headers = ['content-encoding', 'content-length', 'transfer-encoding', 'connection']
-        headers = [(name, value) for (name, value) in resp.raw.headers.items()
-                   if name.lower() not in excluded_headers]
-        
-        def generate():
-            for chunk in resp.iter_content(chunk_size=8192):
-                yield chunk
-        
-        response = Response(generate(), resp.status_code, headers)
+        if hls_proxy.is_playlist_url(url):
+            # Playlist HLS: segmenti e varianti vengono riscritti per passare da /proxy
+            response = hls.proxy_playlist(url, proxy_url=lambda target: url_for('proxy', url=target))
+        elif 'Range' not in request.headers and hls.is_known_segment(url):
+            response = hls.proxy_segment(url)
+        else:
+            response = stream_proxy.proxy_stream(url, request.headers, timeout=10)
         response.headers['Access-Control-Allow-Origin'] = '*'
-        print("DEBUG: Risposta proxy inviata al client")
         return response
     except requests.RequestException as e:
-        print(f"DEBUG: Errore proxy: {str(e)}")
+        log.warning("Errore proxy per %s: %s", url, e)
         return jsonify({"error": f"Errore nel proxy: {str(e)}"}), 500
 
+@app.route('/img')
+def img():
+    url = request.args.get('url')
+    size = request.args.get('size', 'card')
+    if not url or size not in image_proxy.SIZES:
+        return jsonify({"error": "URL mancante o dimensione non valida"}), 400
+    try:
+        return images.serve(request, url, size)
+    except image_proxy.ImageNotAllowed as e:
+        return jsonify({"error": str(e)}), 403
+    except requests.RequestException as e:
+        log.warning("Errore nel recupero dell'immagine %s: %s", url, e)
+        return jsonify({"error": "Immagine non disponibile"}), 502
+
+@app.route('/proxy_stats')
+def proxy_stats():
+    return jsonify(dict(stream_proxy.stats.snapshot(), hls=hls.info(), images=images.info()))
+
+@app.route('/cache_stats')
+def cache_stats():
+    return jsonify(cache.stats())
+
+@app.route('/catalogue_stats')
+def catalogue_stats():
+    if catalogue is None:
+        return jsonify({"enabled": False})
+    return jsonify(dict(catalogue.stats(), enabled=True))
+
+@app.route('/mirror_stats')
+def mirror_stats():
+    return jsonify(site.snapshot())
+
+@metrics.REGISTRY.collector
+def cache_metrics():
+    counters = cache.counters()
+    return [('animescraper_cache_requests_total', 'counter', "Letture dalla cache per namespace",
+             [({'namespace': namespace, 'result': result}, stats[field])
+              for namespace, stats in counters.items() for result, field in (('hit', 'hits'), ('miss', 'misses'))])]
+
+@metrics.REGISTRY.collector
+def proxy_metrics():
+    proxy = stream_proxy.stats.snapshot()
+    segments = hls.info()
+    image_cache = images.info()
+    return [
+        ('animescraper_proxy_active_streams', 'gauge', "Stream video aperti in questo momento", [({}, proxy['active_streams'])]),
+        ('animescraper_proxy_streams_total', 'counter', "Stream video serviti dal proxy", [({}, proxy['total_streams'])]),
+        ('animescraper_proxy_rejected_streams_total', 'counter', "Stream rifiutati per troppi stream attivi",
+         [({}, proxy['rejected_streams'])]),
+        ('animescraper_proxy_bytes_total', 'counter', "Byte inviati dal proxy", [({}, proxy['bytes_total'])]),
+        ('animescraper_hls_segment_requests_total', 'counter', "Segmenti HLS serviti dalla cache o scaricati",
+         [({'result': 'hit'}, segments['hits']), ({'result': 'miss'}, segments['misses'])]),
+        ('animescraper_hls_segment_cache_bytes', 'gauge', "Byte dei segmenti HLS in cache",
+         [({'tier': 'memory'}, segments['bytes']), ({'tier': 'disk'}, segments['disk_bytes'])]),
+        ('animescraper_hls_prefetched_segments_total', 'counter', "Segmenti HLS scaricati in anticipo",
+         [({}, segments['prefetched'])]),
+        ('animescraper_image_cache_requests_total', 'counter', "Immagini e varianti lette dalla cache su disco",
+         [({'result': 'hit'}, image_cache['hits']), ({'result': 'miss'}, image_cache['misses'])]),
+        ('animescraper_image_cache_bytes', 'gauge', "Byte delle immagini in cache su disco", [({}, image_cache['bytes'])]),
+    ]
+
+@metrics.REGISTRY.collector
+def mirror_metrics():
+    snapshot = site.snapshot()
+    return [
+        ('animescraper_mirror_latency_seconds', 'gauge', "Latenza media (EWMA) del mirror",
+         [({'mirror': m['url']}, m['ewma_ms'] / 1000) for m in snapshot if m['ewma_ms'] is not None]),
+        ('animescraper_mirror_available', 'gauge', "1 se il mirror riceve richieste (circuit breaker chiuso)",
+         [({'mirror': m['url']}, int(m['state'] == mirrors.CLOSED)) for m in snapshot]),
+    ]
+
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 def init_db():
     with app.app_context():
         db.create_all()
-        print("Database tables created.")
+        metrics.instrument_engine(db.engine)
+        log.info("Database tables created.")
 
 # Aggiungi questa riga dopo la definizione di init_db()
 init_db()
+# Thread in background avviati dopo la creazione delle tabelle
+if catalogue is not None:
+    catalogue.start_background_sync()
+if TITLE_INDEX_REFRESH > 0:
+    # Con la copia del catalogo l'elenco delle serie viene già scaricato dal suo crawler
+    title_index.start_background_refresh(BASE_URL, TITLE_INDEX_REFRESH, site=site,
+                                         source=catalogue.titles if catalogue else None)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5000))
@@ -0,0 +1,165 @@
+"""Modalità ASGI: le route di scraping più lente girano su asyncio, il resto resta Flask.
+
+/search, /episodes, /stream e /resolve_series sono gestite da handler async
+(async_scraper su aiohttp), così migliaia di attese verso animesaturn possono
+restare in corso su un solo worker senza occupare thread. Con la copia locale
+del catalogo /search e /episodes la leggono prima (nel threadpool, come le
+letture della cache). Tutte le altre route passano all'app Flask tramite WsgiToAsgi.
+
+    uvicorn asgi:application --host 0.0.0.0 --port $PORT --workers 2
+"""
+import asyncio
+import json
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+
+import app as flask_app  # per primo: carica il file .env prima degli altri moduli del progetto
+from cache import MISSING
+
+engine = flask_app.async_engine
+wsgi_application = WsgiToAsgi(flask_app.app)
+
+
+async def run_sync(fn, *args):
+    """Esegue una funzione bloccante (database, cache su database) nel threadpool, fuori dall'event loop."""
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+async def cached(namespace, key, ttl, fetch):
+    # Stesse chiavi di cache.memoize in app.py: sync e async condividono le voci. Con CACHE_BACKEND=db
+    # get e set sono query SQL bloccanti: girano nel threadpool per non fermare l'event loop
+    value = await run_sync(flask_app.cache.get, namespace, key, MISSING)
+    if value is not MISSING:
+        return value
+    value = await fetch()
+    if value is not None:
+        await run_sync(flask_app.cache.set, namespace, key, value, ttl)
+    return value
+
+
+async def read_form(receive):
+    body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    return {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+
+
+async def send_json(send, data, status=200):
+    body = json.dumps(data).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def search(form, send):
+    query = form.get('query')
+    if not query:
+        return await send_json(send, {"error": "Query mancante"}, 400)
+    results = await cached('search', query.strip().lower(), flask_app.CACHE_TTL_SEARCH,
+                           lambda: search_anime(query))
+    await send_json(send, results)
+
+
+async def search_anime(query):
+    catalogue = flask_app.catalogue
+    if catalogue is not None:
+        # Come search_anime in app.py: la copia locale del catalogo, poi il sito
+        results = await run_sync(catalogue.search, query)
+        if results:
+            return results
+    return await engine.search_anime(query)
+
+
+async def get_episodes(anime_url):
+    catalogue = flask_app.catalogue
+    if catalogue is not None:
+        episodes = await run_sync(catalogue.episodes, anime_url)
+        if episodes is not None:
+            return flask_app.format_episodes(episodes)
+    return flask_app.format_episodes(await engine.get_episodes(anime_url))
+
+
+async def episodes(form, send):
+    anime_url = form.get('anime_url')
+    if not anime_url:
+        return await send_json(send, {"error": "URL anime mancante"}, 400)
+    results = await cached('episodes', anime_url, flask_app.CACHE_TTL_EPISODES, lambda: get_episodes(anime_url))
+    await send_json(send, results)
+
+
+async def get_streaming_url(episode_url):
+    return await cached('stream', episode_url, flask_app.CACHE_TTL_STREAM, lambda: engine.get_streaming_url(episode_url))
+
+
+async def stream(form, send):
+    episode_url = form.get('episode_url')
+    if not episode_url:
+        return await send_json(send, {"error": "URL episodio mancante"}, 400)
+    video_url = await get_streaming_url(episode_url)
+    if video_url:
+        return await send_json(send, {"video_url": video_url})
+    await send_json(send, {"error": "Impossibile trovare il link dello streaming."}, 404)
+
+
+async def resolve_series(form, send):
+    anime_url = form.get('anime_url')
+    if not anime_url:
+        return await send_json(send, {"error": "URL anime mancante"}, 400)
+    episode_list = await cached('episodes', anime_url, flask_app.CACHE_TTL_EPISODES, lambda: get_episodes(anime_url))
+
+    async def send_line(data):
+        await send({'type': 'http.response.body', 'body': (json.dumps(data) + "\n").encode('utf-8'), 'more_body': True})
+
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/x-ndjson')]})
+    await send_line({"type": "start", "total": len(episode_list)})
+    results = engine.resolve_many([ep['url'] for ep in episode_list], resolve=get_streaming_url)
+    resolved = 0
+    try:
+        async for index, video_url in results:
+            if video_url:
+                resolved += 1
+            episode = episode_list[index]
+            await send_line({
+                "type": "episode",
+                "index": index,
+                "title": episode['title'],
+                "episode_url": episode['url'],
+                "video_url": video_url
+            })
+    finally:
+        # Chiude il generatore (e annulla le risoluzioni pendenti) anche se il client si disconnette
+        await results.aclose()
+    await send_line({"type": "done", "total": len(episode_list), "resolved": resolved})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+ASYNC_ROUTES = {
+    '/search': search,
+    '/episodes': episodes,
+    '/stream': stream,
+    '/resolve_series': resolve_series,
+}
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await engine.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    handler = ASYNC_ROUTES.get(scope.get('path'))
+    if scope['type'] == 'http' and handler is not None and scope['method'] == 'POST':
+        return await handler(await read_form(receive), send)
+    return await wsgi_application(scope, receive, send)
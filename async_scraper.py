@@ -0,0 +1,185 @@
+import asyncio
+import os
+import threading
+import time
+from urllib.parse import quote_plus, urljoin, urlparse
+
+import aiohttp
+from bs4 import BeautifulSoup, SoupStrainer
+
+import http_client
+import metrics
+import mirrors
+import rate_limiter
+import video_extractor
+from episode_parser import parse_episode_page
+from http_client import CONNECT_TIMEOUT, MAX_RETRIES, READ_TIMEOUT, RETRY_AFTER_MAX, RETRY_BACKOFF, RETRY_STATUSES
+
+# Con asyncio le richieste in attesa non occupano thread: i limiti possono essere molto più alti
+CONNECTOR_LIMIT = int(os.getenv('ASYNC_CONNECTOR_LIMIT', 1000))
+CONNECTOR_LIMIT_PER_HOST = int(os.getenv('ASYNC_CONNECTOR_LIMIT_PER_HOST', 100))
+RESOLVE_CONCURRENCY = int(os.getenv('ASYNC_RESOLVE_CONCURRENCY', 32))
+
+_search_strainer = SoupStrainer('a', class_='badge-archivio')
+
+log = metrics.get_logger('async_scraper')
+
+
+class AsyncScraper:
+    """Versione asyncio (aiohttp) della pipeline di scraping: ricerca, episodi, URL video.
+
+    Mantiene una ClientSession condivisa per ogni event loop in cui viene usata. Con site
+    (un mirrors.MirrorPool) le pagine del sito vengono scaricate dal mirror migliore, con
+    failover sugli altri, e gli URL restituiti usano il dominio canonico.
+    """
+
+    def __init__(self, base_url, site=None):
+        self.base_url = base_url
+        self.site = site
+        self._sessions = {}
+
+    async def session(self):
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            connector = aiohttp.TCPConnector(limit=CONNECTOR_LIMIT, limit_per_host=CONNECTOR_LIMIT_PER_HOST, ttl_dns_cache=300)
+            timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+            session = aiohttp.ClientSession(connector=connector, timeout=timeout, auto_decompress=True)
+            self._sessions[loop] = session
+        return session
+
+    async def close(self):
+        loop = asyncio.get_running_loop()
+        session = self._sessions.pop(loop, None)
+        if session is not None:
+            await session.close()
+
+    async def fetch_text(self, url):
+        site = self.site
+        if site is None or not site.is_site_url(url):
+            return await self._fetch(url)
+        error = None
+        attempt = 0
+        for mirror in site.candidates():
+            if not site.claim(mirror):
+                continue
+            if attempt:
+                mirrors.failovers.inc(mirror=mirror.netloc)
+            attempt += 1
+            started = time.perf_counter()
+            try:
+                text = await self._fetch(site.on(mirror, url))
+            except rate_limiter.RateLimitTimeout:
+                site.release(mirror)
+                raise
+            except aiohttp.ClientResponseError as e:
+                # Una risposta 4xx arriva da un mirror funzionante: niente failover
+                site.record(mirror, time.perf_counter() - started, ok=e.status < 500)
+                if e.status < 500:
+                    raise
+                error = e
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                site.record(mirror, time.perf_counter() - started, ok=False)
+                error = e
+                continue
+            site.record(mirror, time.perf_counter() - started, ok=True)
+            return text
+        raise error or aiohttp.ClientConnectionError("Nessun mirror disponibile")
+
+    async def _fetch(self, url):
+        session = await self.session()
+        parsed = urlparse(url)
+        host = parsed.hostname or ''
+        limiter = http_client.limiter
+        with metrics.span('upstream_fetch'):
+            for attempt in range(MAX_RETRIES + 1):
+                # Stessi limiti per host della versione sync: l'attesa di uno slot avviene in un thread
+                lease = (await asyncio.get_running_loop().run_in_executor(None, limiter.acquire, parsed.netloc)
+                         if limiter.is_limited(parsed.netloc) else None)
+                try:
+                    async with session.get(url) as response:
+                        metrics.UPSTREAM_RESPONSES.inc(host=host, status=response.status)
+                        retry_after = rate_limiter.parse_retry_after(response.headers.get('Retry-After'))
+                        limiter.record(parsed.netloc, response.status, retry_after)
+                        if response.status in RETRY_STATUSES and attempt < MAX_RETRIES:
+                            # Come CappedRetry di http_client: le pause più lunghe le gestisce il rate limiter
+                            delay = (min(retry_after, RETRY_AFTER_MAX) if retry_after is not None
+                                     else RETRY_BACKOFF * (2 ** attempt))
+                        else:
+                            response.raise_for_status()
+                            return await response.text()
+                except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                    metrics.UPSTREAM_RESPONSES.inc(host=host, status='error')
+                    raise
+                finally:
+                    limiter.release(parsed.netloc, lease)
+                await asyncio.sleep(delay)
+
+    async def search_anime(self, query):
+        text = await self.fetch_text(urljoin(self.base_url, f"/animelist?search={quote_plus(query)}"))
+        with metrics.span('html_parse'):
+            soup = BeautifulSoup(text, 'html.parser', parse_only=_search_strainer)
+        canonical = self.site.canonical if self.site else (lambda url: url)
+        return [{"title": result.text.strip(), "url": canonical(urljoin(self.base_url, result['href']))}
+                for result in soup.find_all('a', href=True)]
+
+    async def get_episodes(self, anime_url):
+        return parse_episode_page(await self.fetch_text(anime_url), self.base_url)
+
+    async def extract_video_urls(self, url):
+        page = await self.fetch_text(url)
+        candidates = []
+        iframe_src = video_extractor.find_iframe_src(page)
+        if iframe_src:
+            candidates.extend(video_extractor.find_video_urls(await self.fetch_text(urljoin(url, iframe_src))))
+        seen = {candidate.url for candidate in candidates}
+        candidates.extend(candidate for candidate in video_extractor.find_video_urls(page) if candidate.url not in seen)
+        return candidates
+
+    async def get_streaming_url(self, episode_url):
+        try:
+            watch_link = video_extractor.find_watch_link(await self.fetch_text(episode_url))
+            if not watch_link:
+                return None
+            candidates = await self.extract_video_urls(urljoin(self.base_url, watch_link))
+            return candidates[0].url if candidates else None
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            log.warning("Errore durante la richiesta HTTP (async): %s", e)
+            return None
+
+    async def resolve_many(self, episode_urls, concurrency=RESOLVE_CONCURRENCY, resolve=None):
+        """Risolve gli URL video in parallelo; restituisce (indice, url video) man mano che finiscono."""
+        resolve = resolve or self.get_streaming_url
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def worker(index, url):
+            async with semaphore:
+                return index, await resolve(url)
+
+        tasks = [asyncio.ensure_future(worker(i, url)) for i, url in enumerate(episode_urls)]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            # Client disconnesso: annulla le risoluzioni ancora in corso
+            for task in tasks:
+                task.cancel()
+
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def _background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name='async-scraper-loop', daemon=True).start()
+    return _loop
+
+
+def run(coro, timeout=None):
+    """Esegue una coroutine sull'event loop condiviso in background e ne attende il risultato."""
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop()).result(timeout)
@@ -0,0 +1,111 @@
+"""Benchmark della copia locale del catalogo: latenza di /search e /episodes e traffico dei ricontrolli.
+
+Avvia standin.py, popola la copia locale con un giro completo del crawler e
+confronta search_anime/get_episodes (senza la cache in memoria) letti dal sito e
+dal database. Poi rende scadute tutte le pagine e ripete il giro due volte: a
+sito invariato (richieste condizionate, risposte 304) e dopo l'uscita di un
+nuovo episodio per ogni serie.
+
+    python benchmarks/bench_catalogue.py [--pages 4] [--episodes 24] [--latency-ms 50] [--json]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import standin  # noqa: E402
+
+
+def timed(fn, args_list):
+    latencies = []
+    for args in args_list:
+        started = time.perf_counter()
+        fn(*args)
+        latencies.append(time.perf_counter() - started)
+    return {'p50_ms': round(statistics.median(latencies) * 1000, 2), 'max_ms': round(max(latencies) * 1000, 2)}
+
+
+def crawl(server, store):
+    before = dict(server.requests)
+    started = time.perf_counter()
+    while store.sync():
+        pass
+    return {
+        'seconds': round(time.perf_counter() - started, 2),
+        'requests': server.requests.get('page', 0) - before.get('page', 0),
+        'not_modified': server.requests.get('not_modified', 0) - before.get('not_modified', 0),
+    }
+
+
+def expire_all(store):
+    with store.engine.begin() as conn:
+        conn.execute(store.series.update().values(next_check_at=0))
+        conn.execute(store.pages.update().values(next_check_at=0))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pages', type=int, default=4, help="pagine del catalogo (50 serie ciascuna)")
+    parser.add_argument('--episodes', type=int, default=24)
+    parser.add_argument('--latency-ms', type=int, default=50)
+    parser.add_argument('--json', action='store_true', help="stampa i risultati in JSON")
+    args = parser.parse_args()
+
+    server = standin.StandInServer(episodes=args.episodes, catalogue_pages=args.pages, search_results=20,
+                                   page_latency=args.latency_ms / 1000).start()
+    tmp = tempfile.TemporaryDirectory()
+    os.environ.update({
+        'ANIMESATURN_URL': server.url,
+        'TMDB_API_KEY': 'bench',
+        'DATABASE_URL': f"sqlite:///{os.path.join(tmp.name, 'bench.db')}",
+        'TITLE_INDEX_PATH': os.path.join(tmp.name, 'title_index.json'),
+        'TITLE_INDEX_REFRESH': '0',
+        'RATE_LIMIT_DIR': os.path.join(tmp.name, 'ratelimit'),
+        'UPSTREAM_RATE': '0',
+        'UPSTREAM_MAX_IN_FLIGHT': '0',
+        'MIRROR_PROBE_INTERVAL': '0',
+        'CATALOGUE_SYNC': '0',  # il crawler viene fatto girare qui, non in background
+        'CATALOGUE_MAX_RATE': '0',
+    })
+    import app  # noqa: E402
+    import catalogue_store  # noqa: E402
+
+    store = catalogue_store.CatalogueStore(app.app, app.db, app.CatalogueSeries, app.CatalogueEpisode, app.CataloguePage,
+                                           app.BASE_URL, site=app.site)
+    results = {'series': args.pages * 50, 'episodes': args.episodes, 'latency_ms': args.latency_ms}
+    results['first_crawl'] = crawl(server, store)
+
+    series = [(entry['url'],) for entry in store.titles()[:100]]
+    queries = [(f'Catalogo {n % args.pages + 1} {n % 50 + 1}',) for n in range(100)]
+    results['live'] = {'search': timed(app.search_anime.uncached, queries),
+                       'episodes': timed(app.get_episodes.uncached, series)}
+    app.catalogue = store
+    results['catalogue'] = {'search': timed(app.search_anime.uncached, queries),
+                            'episodes': timed(app.get_episodes.uncached, series)}
+
+    expire_all(store)
+    results['recrawl_unchanged'] = crawl(server, store)
+    server.episodes += 1
+    expire_all(store)
+    results['recrawl_new_episode'] = crawl(server, store)
+    results['recrawl_new_episode']['airing'] = store.stats()['airing']
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name in ('live', 'catalogue'):
+        row = results[name]
+        print(f"{name:>10}: search p50 {row['search']['p50_ms']:>7.2f} ms  episodes p50 {row['episodes']['p50_ms']:>7.2f} ms")
+    for name in ('first_crawl', 'recrawl_unchanged', 'recrawl_new_episode'):
+        row = results[name]
+        print(f"{name:>19}: {row['seconds']:>6.2f} s  richieste {row['requests']:>5}  304 {row['not_modified']:>5}")
+
+
+if __name__ == '__main__':
+    main()
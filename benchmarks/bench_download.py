@@ -0,0 +1,119 @@
+"""Benchmark del download mp4: uno stream singolo contro range paralleli (range_downloader).
+
+Avvia un server HTTP locale che limita la banda di ogni connessione (come fanno i CDN)
+e supporta i Range, poi scarica lo stesso file nei due modi.
+
+    python benchmarks/bench_download.py [--size-mb 32] [--per-connection-kbps 4096] [--segments 8] [--json]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import range_downloader  # noqa: E402
+
+RANGE_RE = re.compile(r'bytes=(\d+)-(\d*)')
+
+
+class ThrottledFileServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, data, bytes_per_second, accept_ranges=True):
+        super().__init__(('127.0.0.1', 0), ThrottledHandler)
+        self.data = data
+        self.bytes_per_second = bytes_per_second
+        self.accept_ranges = accept_ranges
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/episodio.mp4"
+
+
+class ThrottledHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def _send_headers(self):
+        data = self.server.data
+        start, end = 0, len(data) - 1
+        match = RANGE_RE.match(self.headers.get('Range', '')) if self.server.accept_ranges else None
+        if match:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), end) if match.group(2) else end
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {start}-{end}/{len(data)}')
+        else:
+            self.send_response(200)
+        if self.server.accept_ranges:
+            self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        return start, end
+
+    def do_HEAD(self):
+        self._send_headers()
+
+    def do_GET(self):
+        start, end = self._send_headers()
+        chunk = 64 * 1024
+        delay = chunk / self.server.bytes_per_second
+        try:
+            for offset in range(start, end + 1, chunk):
+                self.wfile.write(self.server.data[offset:min(offset + chunk, end + 1)])
+                time.sleep(delay)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def run(url, output_path, segments, segment_size):
+    start = time.perf_counter()
+    range_downloader.download(url, output_path, segments=segments, segment_size=segment_size)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=int, default=32)
+    parser.add_argument('--per-connection-kbps', type=int, default=4096, help="limite di banda per connessione (KB/s)")
+    parser.add_argument('--segments', type=int, default=8)
+    parser.add_argument('--segment-size-mb', type=int, default=2)
+    parser.add_argument('--json', action='store_true', help="stampa i risultati in JSON")
+    args = parser.parse_args()
+
+    data = os.urandom(args.size_mb * 1024 * 1024)
+    server = ThrottledFileServer(data, args.per_connection_kbps * 1024)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    results = {'size_mb': args.size_mb, 'per_connection_kbps': args.per_connection_kbps}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, segments in (('single_stream', 1), ('segmented', args.segments)):
+            output_path = os.path.join(tmp, f"{name}.mp4")
+            elapsed = run(server.url, output_path, segments, args.segment_size_mb * 1024 * 1024)
+            with open(output_path, 'rb') as f:
+                assert f.read() == data, name
+            results[name] = {'seconds': round(elapsed, 2), 'mb_per_second': round(args.size_mb / elapsed, 2), 'connections': segments}
+    server.shutdown()
+    results['speedup'] = round(results['single_stream']['seconds'] / results['segmented']['seconds'], 1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name in ('single_stream', 'segmented'):
+        row = results[name]
+        print(f"{name:>14}: {row['seconds']:>7.2f} s  {row['mb_per_second']:>7.2f} MB/s  ({row['connections']} connessioni)")
+    print(f"{'speedup':>14}: {results['speedup']}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Benchmark del parsing della pagina episodi su pagine sintetiche con N bottoni bottone-ep.
+
+Confronta la vecchia get_episodes (find_previous per ogni episodio, O(n²)) con
+episode_parser (un solo passaggio): il costo per episodio deve restare costante.
+
+    python benchmarks/bench_episodes.py [--sizes 100 500 1000 2000] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from episode_parser import parse_episode_page  # noqa: E402
+
+BASE_URL = "https://www.animesaturn.cx"
+CONTAINER_CLASS = 'container shadow rounded bg-dark-as-box mb-3 p-3 w-100 d-flex justify-content-center'
+
+
+def build_episode_page(n):
+    buttons = '\n'.join(
+        f'<div class="btn-group episodes-button episodi-link-button">'
+        f'<a class="btn btn-dark mb-1 bottone-ep" href="{BASE_URL}/ep/Serie-ep-{i}" target="_blank">Episodio {i}</a></div>'
+        for i in range(1, n + 1)
+    )
+    return f'''<!DOCTYPE html><html><head><title>Serie</title></head><body>
+<div class="{CONTAINER_CLASS}">
+<img src="https://cdn.animesaturn.cx/static/images/copertine/serie.jpg" class="img-fluid cover-anime rounded" alt="Serie">
+</div>
+<div class="container p-3 shadow rounded bg-dark-as-box text-white">
+<div class="tab-content">
+<div class="tab-pane fade show active" id="range-anime-0" role="tabpanel">
+{buttons}
+</div></div></div>
+</body></html>'''
+
+
+def legacy_parse(html):
+    soup = BeautifulSoup(html, 'html.parser')
+    episode_data = []
+    for ep in soup.find_all('a', class_='bottone-ep'):
+        thumbnail_container = ep.find_previous('div', class_=CONTAINER_CLASS)
+        thumbnail_url = None
+        if thumbnail_container:
+            thumbnail_img = thumbnail_container.find('img', class_='img-fluid cover-anime rounded')
+            if thumbnail_img and 'src' in thumbnail_img.attrs:
+                thumbnail_url = thumbnail_img['src']
+        episode_data.append((ep.text.strip(), urljoin(BASE_URL, ep['href']), thumbnail_url))
+    return episode_data
+
+
+def new_parse(html):
+    return parse_episode_page(html, BASE_URL)
+
+
+def measure(fn, html, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(html)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 500, 1000, 2000])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', action='store_true', help="stampa i risultati in JSON")
+    args = parser.parse_args()
+
+    results = []
+    for n in args.sizes:
+        html = build_episode_page(n)
+        row = {'episodes': n}
+        for name, fn in (('legacy', legacy_parse), ('episode_parser', new_parse)):
+            episodes, elapsed = measure(fn, html, args.repeat)
+            assert len(episodes) == n and episodes[-1][-1], name
+            row[name] = {'ms': round(elapsed * 1e3, 2), 'us_per_episode': round(elapsed / n * 1e6, 2)}
+        results.append(row)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'episodi':>8} | {'legacy ms':>10} {'us/ep':>8} | {'nuovo ms':>10} {'us/ep':>8}")
+    for row in results:
+        legacy, new = row['legacy'], row['episode_parser']
+        print(f"{row['episodes']:>8} | {legacy['ms']:>10} {legacy['us_per_episode']:>8} | {new['ms']:>10} {new['us_per_episode']:>8}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Micro-benchmark del costo di parsing di extract_video_url sulle pagine salvate in fixtures/.
+
+Confronta l'implementazione precedente (BeautifulSoup + re.search per ogni <script>)
+con video_extractor. Non usa la rete.
+
+    python benchmarks/bench_extractor.py [--iterations 200] [--json]
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import video_extractor  # noqa: E402
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES, name), encoding='utf-8') as f:
+        return f.read()
+
+
+def legacy_extract(page, iframe_page):
+    # Stessa logica della vecchia extract_video_url, senza le richieste HTTP
+    video_pattern = r'(https?://.*?\.(?:m3u8|mp4))'
+    soup = BeautifulSoup(page, 'html.parser')
+    iframe = soup.find('iframe')
+    if iframe and 'src' in iframe.attrs:
+        iframe_soup = BeautifulSoup(iframe_page, 'html.parser')
+        for script in iframe_soup.find_all('script'):
+            match = re.search(video_pattern, str(script))
+            if match:
+                return match.group(0)
+        match = re.search(video_pattern, iframe_page)
+        if match:
+            return match.group(0)
+    for script in soup.find_all('script'):
+        match = re.search(video_pattern, str(script))
+        if match:
+            return match.group(0)
+    match = re.search(video_pattern, page)
+    return match.group(0) if match else None
+
+
+def new_extract(page, iframe_page):
+    candidates = []
+    if video_extractor.find_iframe_src(page):
+        candidates.extend(video_extractor.find_video_urls(iframe_page))
+    candidates.extend(video_extractor.find_video_urls(page))
+    return candidates[0].url if candidates else None
+
+
+def measure(fn, iterations, *args):
+    fn(*args)  # riscaldamento
+    start = time.perf_counter()
+    for _ in range(iterations):
+        result = fn(*args)
+    elapsed = time.perf_counter() - start
+    return result, elapsed / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=200)
+    parser.add_argument('--json', action='store_true', help="stampa i risultati in JSON")
+    args = parser.parse_args()
+
+    page = load_fixture('watch_page.html')
+    iframe_page = load_fixture('iframe_page.html')
+
+    results = {}
+    for name, fn in (('legacy', legacy_extract), ('video_extractor', new_extract)):
+        url, us = measure(fn, args.iterations, page, iframe_page)
+        results[name] = {'us_per_request': round(us, 1), 'url': url}
+    results['speedup'] = round(results['legacy']['us_per_request'] / results['video_extractor']['us_per_request'], 1)
+    results['parser'] = 'selectolax' if video_extractor._SelectolaxParser else video_extractor.BS_PARSER
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name in ('legacy', 'video_extractor'):
+        print(f"{name:>16}: {results[name]['us_per_request']:>10.1f} us/richiesta  -> {results[name]['url']}")
+    print(f"{'speedup':>16}: {results['speedup']}x (parser di riserva: {results['parser']})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Benchmark del download HLS: segmenti uno alla volta (come ffmpeg) contro il downloader parallelo.
+
+Avvia un server HLS locale (master playlist con due varianti, segmenti .ts con
+latenza simulata) e scarica la stessa variante con 1 e con N worker.
+
+    python benchmarks/bench_hls.py [--segments 60] [--segment-kb 512] [--latency-ms 80] [--workers 8] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hls_downloader  # noqa: E402
+
+
+class HLSFixtureServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, segments, latency):
+        super().__init__(('127.0.0.1', 0), HLSFixtureHandler)
+        self.segments = segments
+        self.latency = latency
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}/master.m3u8"
+
+    def media_playlist(self):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+        for index in range(len(self.segments)):
+            lines += ['#EXTINF:4.0,', f'seg{index}.ts']
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+
+class HLSFixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/master.m3u8':
+            body = ('#EXTM3U\n'
+                    '#EXT-X-STREAM-INF:BANDWIDTH=800000,RESOLUTION=640x360\nlow/index.m3u8\n'
+                    '#EXT-X-STREAM-INF:BANDWIDTH=2500000,RESOLUTION=1280x720\nhigh/index.m3u8\n').encode()
+            content_type = 'application/vnd.apple.mpegurl'
+        elif path.endswith('/index.m3u8'):
+            body = self.server.media_playlist().encode()
+            content_type = 'application/vnd.apple.mpegurl'
+        elif path.endswith('.ts'):
+            time.sleep(self.server.latency)
+            body = self.server.segments[int(path.rsplit('seg', 1)[1][:-3])]
+            content_type = 'video/mp2t'
+        else:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+def run(url, output_path, workers):
+    start = time.perf_counter()
+    hls_downloader.download(url, output_path, workers=workers, remux_to_mp4=False)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--segments', type=int, default=60)
+    parser.add_argument('--segment-kb', type=int, default=512)
+    parser.add_argument('--latency-ms', type=int, default=80, help="latenza simulata per segmento")
+    parser.add_argument('--workers', type=int, default=hls_downloader.WORKERS)
+    parser.add_argument('--json', action='store_true', help="stampa i risultati in JSON")
+    args = parser.parse_args()
+
+    segments = [os.urandom(args.segment_kb * 1024) for _ in range(args.segments)]
+    expected = b''.join(segments)
+    server = HLSFixtureServer(segments, args.latency_ms / 1000)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    size_mb = len(expected) / (1024 * 1024)
+    results = {'segments': args.segments, 'size_mb': round(size_mb, 1), 'latency_ms': args.latency_ms}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, workers in (('serial', 1), ('parallel', args.workers)):
+            output_path = os.path.join(tmp, f"{name}.ts")
+            elapsed = run(server.url, output_path, workers)
+            with open(output_path, 'rb') as f:
+                assert f.read() == expected, name
+            results[name] = {'seconds': round(elapsed, 2), 'mb_per_second': round(size_mb / elapsed, 2), 'workers': workers}
+    server.shutdown()
+    results['speedup'] = round(results['serial']['seconds'] / results['parallel']['seconds'], 1)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name in ('serial', 'parallel'):
+        row = results[name]
+        print(f"{name:>9}: {row['seconds']:>7.2f} s  {row['mb_per_second']:>7.2f} MB/s  ({row['workers']} worker)")
+    print(f"{'speedup':>9}: {results['speedup']}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark del proxy delle immagini: una pagina di risultati con molte copertine, dall'origine e da /img.
+
+Avvia standin.py (copertine da 100 KB, 500x750, con --latency-ms di latenza) e
+l'app in un server locale, poi scarica --covers copertine diverse con 6
+connessioni parallele come un browser: direttamente dall'origine, da /img a
+cache vuota e da /img a cache piena (WebP, size=card). Misura anche quante
+richieste arrivano all'origine per 20 richieste contemporanee della stessa
+immagine e la risposta a un If-None-Match.
+
+    python benchmarks/bench_images.py [--covers 48] [--latency-ms 150] [--json]
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import standin  # noqa: E402
+
+BROWSER_CONNECTIONS = 6
+
+
+def load_page(urls, headers=None):
+    session = requests.Session()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=BROWSER_CONNECTIONS) as executor:
+        sizes = list(executor.map(lambda url: len(session.get(url, headers=headers).content), urls))
+    return {'seconds': round(time.perf_counter() - started, 3), 'kb': round(sum(sizes) / 1024, 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--covers', type=int, default=48)
+    parser.add_argument('--latency-ms', type=int, default=150)
+    parser.add_argument('--json', action='store_true', help="stampa i risultati in JSON")
+    args = parser.parse_args()
+
+    server = standin.StandInServer(media_latency=args.latency_ms / 1000).start()
+    tmp = tempfile.TemporaryDirectory()
+    os.environ.update({
+        'ANIMESATURN_URL': server.url,
+        'TMDB_API_KEY': 'bench',
+        'DATABASE_URL': f"sqlite:///{os.path.join(tmp.name, 'bench.db')}",
+        'TITLE_INDEX_PATH': os.path.join(tmp.name, 'title_index.json'),
+        'TITLE_INDEX_REFRESH': '0',
+        'RATE_LIMIT_DIR': os.path.join(tmp.name, 'ratelimit'),
+        'UPSTREAM_RATE': '0',
+        'UPSTREAM_MAX_IN_FLIGHT': '0',
+        'MIRROR_PROBE_INTERVAL': '0',
+        'CATALOGUE_SYNC': '0',
+        'IMG_CACHE_DIR': os.path.join(tmp.name, 'img'),
+    })
+    import app  # noqa: E402
+    import image_proxy  # noqa: E402
+    from werkzeug.serving import make_server  # noqa: E402
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    http = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=http.serve_forever, daemon=True).start()
+    app_url = f'http://127.0.0.1:{http.server_port}'
+
+    origin = [f'{server.url}/img/serie-{n}.jpg' for n in range(args.covers)]
+    proxied = [f'{app_url}/img?' + urlencode({'url': url, 'size': 'card'}) for url in origin]
+    webp = {'Accept': 'image/webp,image/*,*/*;q=0.8'}
+    results = {'covers': args.covers, 'latency_ms': args.latency_ms, 'resize': image_proxy.Image is not None}
+    results['origin'] = load_page(origin)
+    results['img_cold'] = load_page(proxied, webp)
+    results['img_warm'] = load_page(proxied, webp)
+
+    before = server.requests.get('image', 0)
+    same = f'{app_url}/img?' + urlencode({'url': f'{server.url}/img/nuova.jpg', 'size': 'card'})
+    with ThreadPoolExecutor(max_workers=20) as executor:
+        list(executor.map(lambda _: requests.get(same, headers=webp), range(20)))
+    results['coalesced_origin_requests'] = server.requests.get('image', 0) - before
+
+    etag = requests.get(same, headers=webp).headers['ETag']
+    results['revalidation_status'] = requests.get(same, headers=dict(webp, **{'If-None-Match': etag})).status_code
+    http.shutdown()
+    server.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name in ('origin', 'img_cold', 'img_warm'):
+        row = results[name]
+        print(f"{name:>8}: {row['seconds']:>6.3f} s  {row['kb']:>8.1f} KB")
+    print(f"20 richieste contemporanee della stessa immagine -> {results['coalesced_origin_requests']} all'origine")
+    print(f"If-None-Match -> {results['revalidation_status']}")
+
+
+if __name__ == '__main__':
+    main()
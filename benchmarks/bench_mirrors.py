@@ -0,0 +1,87 @@
+"""Benchmark della scelta del mirror: latenza delle pagine con il primo dominio lento o irraggiungibile.
+
+Avvia due istanze di standin.py (la prima con --slow-ms di latenza, la seconda
+veloce) e scarica le stesse pagine episodio con un solo dominio (quello lento,
+come con BASE_URL fisso) e con mirrors.MirrorPool su entrambi. Ripete la prova
+con il primo dominio spento per misurare il failover (senza mirror bastano
+poche richieste: ognuna esaurisce i retry di http_client).
+
+    python benchmarks/bench_mirrors.py [--requests 200] [--slow-ms 400] [--fast-ms 20] [--json]
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_client  # noqa: E402
+import mirrors  # noqa: E402
+import rate_limiter  # noqa: E402
+import standin  # noqa: E402
+
+
+def free_port():
+    # Una porta libera su cui non ascolta nessuno: simula un dominio irraggiungibile
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def run(urls, requests_count):
+    pool = mirrors.MirrorPool(urls, cooldown=3600)
+    # Come la prima probe di start_probes() all'avvio dell'app
+    pool.probe_all()
+    latencies = []
+    failed = 0
+    for n in range(requests_count):
+        started = time.perf_counter()
+        try:
+            pool.get(f'/ep/bench-ep-{n % 50 + 1}').raise_for_status()
+        except Exception:
+            failed += 1
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    return {
+        'p50_ms': round(statistics.median(latencies) * 1000, 1),
+        'p99_ms': round(latencies[int(len(latencies) * 0.99) - 1] * 1000, 1),
+        'total_s': round(sum(latencies), 2),
+        'failed': failed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--slow-ms', type=int, default=400)
+    parser.add_argument('--fast-ms', type=int, default=20)
+    parser.add_argument('--json', action='store_true', help="stampa i risultati in JSON")
+    args = parser.parse_args()
+
+    http_client.limiter = rate_limiter.RateLimiter(rate_limiter.LocalBackend())
+    slow = standin.StandInServer(episodes=50, padding_kb=4, page_latency=args.slow_ms / 1000).start()
+    fast = standin.StandInServer(episodes=50, padding_kb=4, page_latency=args.fast_ms / 1000).start()
+    dead = f'http://127.0.0.1:{free_port()}'
+
+    results = {'requests': args.requests, 'slow_ms': args.slow_ms, 'fast_ms': args.fast_ms}
+    results['single_slow'] = run([slow.url], args.requests)
+    results['mirrors_slow'] = run([slow.url, fast.url], args.requests)
+    results['single_down'] = run([dead], min(args.requests, 10))
+    results['mirrors_down'] = run([dead, fast.url], args.requests)
+    slow.shutdown()
+    fast.shutdown()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name in ('single_slow', 'mirrors_slow', 'single_down', 'mirrors_down'):
+        row = results[name]
+        print(f"{name:>12}: p50 {row['p50_ms']:>7.1f} ms  p99 {row['p99_ms']:>7.1f} ms  "
+              f"totale {row['total_s']:>6.2f} s  falliti {row['failed']:>4}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark del limitatore per host: raffica di risoluzioni verso un sito che risponde 429 oltre un certo rate.
+
+Avvia standin.py con --rate-limit e risolve gli stessi episodi (pagina episodio,
+watch e iframe) con molti thread, senza limiti e poi con http_client.limiter
+configurato poco sotto il limite del sito. Conta i 429 ricevuti, le risoluzioni
+fallite e il tempo totale.
+
+    python benchmarks/bench_rate_limit.py [--episodes 150] [--threads 32] [--site-rate 20] [--json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_client  # noqa: E402
+import rate_limiter  # noqa: E402
+import video_extractor  # noqa: E402
+import standin  # noqa: E402
+
+
+def resolve(episode_url):
+    try:
+        response = http_client.get(episode_url)
+        response.raise_for_status()
+        watch_url = urljoin(episode_url, video_extractor.find_watch_link(response.text))
+        return bool(video_extractor.extract_video_urls(watch_url))
+    except Exception:
+        return False
+
+
+def run(policy, args):
+    site = standin.StandInServer(episodes=args.episodes, padding_kb=4, page_latency=args.latency_ms / 1000,
+                                 rate_limit=args.site_rate).start()
+    http_client.limiter = rate_limiter.RateLimiter(rate_limiter.LocalBackend())
+    if policy:
+        http_client.limiter.limit(urlparse(site.url).netloc, policy)
+    urls = [f'{site.url}/ep/bench-ep-{n}' for n in range(1, args.episodes + 1)]
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        results = list(executor.map(resolve, urls))
+    elapsed = time.perf_counter() - started
+    site.shutdown()
+    return {
+        'seconds': round(elapsed, 2),
+        'resolved': sum(results),
+        'failed': len(results) - sum(results),
+        'requests': site.requests.get('page', 0),
+        'throttled': site.requests.get('throttled', 0),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--episodes', type=int, default=150)
+    parser.add_argument('--threads', type=int, default=32)
+    parser.add_argument('--site-rate', type=int, default=20, help="richieste/s accettate dal sito simulato")
+    parser.add_argument('--latency-ms', type=int, default=30)
+    parser.add_argument('--json', action='store_true', help="stampa i risultati in JSON")
+    args = parser.parse_args()
+
+    policy = rate_limiter.Policy(rate=args.site_rate * 0.9, burst=max(args.site_rate // 2, 1), max_in_flight=args.threads)
+    results = {'episodes': args.episodes, 'threads': args.threads, 'site_rate': args.site_rate}
+    results['unlimited'] = run(None, args)
+    results['limited'] = run(policy, args)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for name in ('unlimited', 'limited'):
+        row = results[name]
+        print(f"{name:>9}: {row['seconds']:>7.2f} s  risolti {row['resolved']:>4}  falliti {row['failed']:>4}  "
+              f"richieste {row['requests']:>5}  429 {row['throttled']:>5}")
+
+
+if __name__ == '__main__':
+    main()
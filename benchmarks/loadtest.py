@@ -0,0 +1,377 @@
+"""Load test degli endpoint dell'app e del downloader contro il server locale di standin.py (niente rete).
+
+Per ogni scenario esegue --requests richieste con --concurrency thread e misura
+throughput e latenza (media, p50, p95, p99, massimo), tramite il test client di
+Flask (--target flask) oppure contro gunicorn avviato con la configurazione del
+Procfile (--target gunicorn). Con --keys 0 ogni richiesta usa una serie o un
+episodio diverso (cache fredda); con --keys N le richieste ciclano su N chiavi.
+
+    python benchmarks/loadtest.py [--target flask|gunicorn] [--scenarios search episodes stream proxy generate_m3u download]
+        [--requests 200] [--concurrency 8] [--keys 0] [--output risultati.json] [--compare precedente.json] [--json]
+"""
+import argparse
+import builtins
+import contextlib
+import io
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import requests
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import standin  # noqa: E402
+
+SCENARIOS = ('search', 'episodes', 'stream', 'proxy', 'proxy_hls', 'generate_m3u', 'download')
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, p):
+    """Percentile con il metodo nearest-rank (valori già ordinati)."""
+    if not sorted_values:
+        return None
+    return sorted_values[max(math.ceil(p / 100 * len(sorted_values)) - 1, 0)]
+
+
+def summarize(latencies, errors, seconds):
+    values = sorted(latencies)
+    summary = {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'throughput_rps': round(len(latencies) / seconds, 2) if seconds else None,
+        'latency_ms': {
+            'mean': round(sum(values) / len(values) * 1000, 2) if values else None,
+            'max': round(values[-1] * 1000, 2) if values else None,
+        },
+    }
+    for p in PERCENTILES:
+        value = percentile(values, p)
+        summary['latency_ms'][f'p{p}'] = round(value * 1000, 2) if value is not None else None
+    return summary
+
+
+# Client: stessa interfaccia per il test client di Flask e per HTTP verso gunicorn
+
+class FlaskTarget:
+    def __init__(self, env):
+        os.environ.update(env)
+        with contextlib.redirect_stdout(io.StringIO()):
+            import app
+        self.app = app.app
+        self._local = threading.local()
+
+    def client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.app.test_client()
+        return self._local.client
+
+    def request(self, method, path, **kwargs):
+        response = self.client().open(path, method=method, headers=kwargs.get('headers'), data=kwargs.get('data'),
+                                      json=kwargs.get('json'), follow_redirects=False)
+        body = response.get_data()
+        response.close()
+        return response.status_code, body
+
+    def close(self):
+        pass
+
+
+class GunicornTarget:
+    def __init__(self, env, workers, threads):
+        port = free_port()
+        self.url = f"http://127.0.0.1:{port}"
+        self.env = dict(os.environ, **env)
+        # Tabelle create prima dell'avvio: i worker di gunicorn non fanno a gara su create_all
+        subprocess.run([sys.executable, '-c', 'import app'], cwd=ROOT, env=self.env, check=True,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.process = subprocess.Popen(
+            ['gunicorn', 'app:app', '--workers', str(workers), '--threads', str(threads), '--timeout', '300',
+             '--bind', f'127.0.0.1:{port}'],
+            cwd=ROOT, env=self.env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self._local = threading.local()
+        self.wait_ready()
+
+    def wait_ready(self, timeout=60):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("gunicorn è terminato durante l'avvio")
+            try:
+                requests.get(f"{self.url}/metrics", timeout=1)
+                return
+            except requests.RequestException:
+                time.sleep(0.2)
+        raise RuntimeError("gunicorn non risponde")
+
+    def session(self):
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def request(self, method, path, **kwargs):
+        response = self.session().request(method, self.url + path, allow_redirects=False, timeout=120, **kwargs)
+        return response.status_code, response.content
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Scenari: setup() prepara i dati (fuori dalla misura), request(i) esegue la richiesta i-esima
+
+class Scenario:
+    def __init__(self, target, site, args):
+        self.target = target
+        self.site = site
+        self.args = args
+
+    def key(self, i):
+        return i % self.args.keys if self.args.keys else i
+
+    def setup(self):
+        pass
+
+    def request(self, i):
+        raise NotImplementedError
+
+    def check(self, status, body):
+        return status < 400
+
+
+class SearchScenario(Scenario):
+    def request(self, i):
+        return self.target.request('POST', '/search', data={'query': f'serie {self.key(i)}'})
+
+
+class EpisodesScenario(Scenario):
+    def request(self, i):
+        return self.target.request('POST', '/episodes', data={'anime_url': f'{self.site.url}/anime/serie-{self.key(i)}'})
+
+
+class StreamScenario(Scenario):
+    def request(self, i):
+        key = self.key(i)
+        episode_url = f'{self.site.url}/ep/serie-{key // self.site.episodes}-ep-{key % self.site.episodes + 1}'
+        return self.target.request('POST', '/stream', data={'episode_url': episode_url})
+
+
+class ProxyScenario(Scenario):
+    """Un Range da 1 MB dell'mp4 attraverso /proxy."""
+
+    def request(self, i):
+        url = f'{self.site.url}/media/ep-{self.key(i)}/video.mp4'
+        return self.target.request('GET', f'/proxy?url={quote(url, safe="")}', headers={'Range': 'bytes=0-1048575'})
+
+
+class ProxyHLSScenario(Scenario):
+    """Playlist HLS riscritta da /proxy più il primo segmento (dalla cache condivisa se già richiesto)."""
+
+    def request(self, i):
+        url = f'{self.site.url}/media/ep-{self.key(i)}/index.m3u8'
+        status, body = self.target.request('GET', f'/proxy?url={quote(url, safe="")}')
+        if status >= 400:
+            return status, body
+        segment = next(line for line in body.decode('utf-8').splitlines() if line and not line.startswith('#'))
+        return self.target.request('GET', segment)
+
+
+class GenerateM3UScenario(Scenario):
+    """/generate_m3u di playlist condivise: la prima richiesta di ciascuna cerca i metadata su TMDb."""
+
+    def setup(self):
+        self.share_ids = []
+        for key in range(self.args.keys or self.args.requests):
+            playlist = [{'title': f'Serie {key} {n}', 'episodes': [
+                {'title': f'Episodio {e}', 'url': f'{self.site.url}/ep/serie-{key}-{n}-ep-{e}'}
+                for e in range(1, self.site.episodes + 1)]} for n in range(1, 4)]
+            status, body = self.target.request('POST', '/share_playlist',
+                                               json={'playlist': playlist, 'playlist_name': f'Bench {key}'})
+            if status != 200:
+                raise RuntimeError(f"Creazione della playlist fallita: {status}")
+            self.share_ids.append(json.loads(body)['share_id'])
+
+    def request(self, i):
+        return self.target.request('GET', f'/generate_m3u/{self.share_ids[i % len(self.share_ids)]}')
+
+
+class DownloadScenario(Scenario):
+    """animedownloader.download_season_or_range (intera stagione) in processo: una richiesta = una serie."""
+
+    def setup(self):
+        import animedownloader
+        self.downloader = animedownloader
+        self.output = tempfile.TemporaryDirectory()
+
+    def request(self, i):
+        series_url = f'{self.site.url}/anime/download-{self.key(i)}-{time.monotonic_ns()}'
+        episodes = self.downloader.get_episodes(series_url)
+        output_dir = os.path.join(self.output.name, str(i))
+        os.makedirs(output_dir)
+        # Risponde "1" (intera stagione) al menu interattivo
+        with _patched_input('1'), contextlib.redirect_stdout(io.StringIO()):
+            self.downloader.download_season_or_range(episodes, output_dir)
+        complete = all(self.downloader.is_episode_downloaded(n, output_dir) for n in range(1, len(episodes) + 1))
+        return (200 if complete else 500), b''
+
+
+@contextlib.contextmanager
+def _patched_input(answer):
+    original = builtins.input
+    builtins.input = lambda prompt='': answer
+    try:
+        yield
+    finally:
+        builtins.input = original
+
+
+SCENARIO_CLASSES = {
+    'search': SearchScenario,
+    'episodes': EpisodesScenario,
+    'stream': StreamScenario,
+    'proxy': ProxyScenario,
+    'proxy_hls': ProxyHLSScenario,
+    'generate_m3u': GenerateM3UScenario,
+    'download': DownloadScenario,
+}
+
+
+def run_scenario(scenario, requests_count, concurrency):
+    scenario.setup()
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(i):
+        nonlocal errors
+        started = time.perf_counter()
+        try:
+            status, body = scenario.request(i)
+            ok = scenario.check(status, body)
+        except Exception:
+            ok = False
+        elapsed = time.perf_counter() - started
+        with lock:
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(requests_count)))
+    return summarize(latencies, errors, time.perf_counter() - started)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def print_table(results, previous=None):
+    print(f"{'scenario':>13} {'req':>6} {'err':>4} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name, row in results['scenarios'].items():
+        latency = row['latency_ms']
+        line = (f"{name:>13} {row['requests']:>6} {row['errors']:>4} {row['throughput_rps'] or 0:>8.1f} "
+                f"{latency['p50'] or 0:>9.1f} {latency['p95'] or 0:>9.1f} {latency['p99'] or 0:>9.1f}")
+        old = (previous or {}).get('scenarios', {}).get(name)
+        if old and old['latency_ms'].get('p95') and latency['p95']:
+            change = (latency['p95'] - old['latency_ms']['p95']) / old['latency_ms']['p95'] * 100
+            line += f"   p95 {change:+.0f}% rispetto a {previous.get('git_commit') or 'precedente'}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--target', choices=('flask', 'gunicorn'), default='flask')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=200, help="richieste per scenario")
+    parser.add_argument('--download-requests', type=int, default=3, help="serie scaricate nello scenario download")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--keys', type=int, default=0, help="chiavi distinte (0 = ogni richiesta diversa)")
+    parser.add_argument('--gunicorn-workers', type=int, default=2)
+    parser.add_argument('--gunicorn-threads', type=int, default=8)
+    parser.add_argument('--output', help="scrive i risultati JSON in questo file")
+    parser.add_argument('--compare', help="file JSON di un'esecuzione precedente da confrontare")
+    parser.add_argument('--json', action='store_true', help="stampa i risultati in JSON")
+    standin.add_arguments(parser)
+    args = parser.parse_args()
+
+    site = standin.from_arguments(args).start()
+    tmp = tempfile.TemporaryDirectory()
+    env = {
+        'ANIMESATURN_URL': site.url,
+        'TMDB_API_BASE': site.tmdb_url,
+        'TMDB_API_KEY': 'bench',
+        'DATABASE_URL': f"sqlite:///{os.path.join(tmp.name, 'bench.db')}",
+        'TITLE_INDEX_PATH': os.path.join(tmp.name, 'title_index.json'),
+        'TITLE_INDEX_REFRESH': '0',
+        'HTTP_POOL_SIZE': str(max(args.concurrency * 2, 16)),
+        'RATE_LIMIT_DIR': os.path.join(tmp.name, 'ratelimit'),
+    }
+    # Il server locale non limita le richieste: senza limiti espliciti nell'ambiente si misura l'app, non il limitatore
+    for name in ('UPSTREAM_RATE', 'UPSTREAM_MAX_IN_FLIGHT', 'TMDB_RATE', 'TMDB_MAX_IN_FLIGHT'):
+        env[name] = os.environ.get(name, '0')
+    # Copia locale del catalogo disattivata salvo richiesta, per confronti omogenei (benchmarks/bench_catalogue.py la misura)
+    env['CATALOGUE_SYNC'] = os.environ.get('CATALOGUE_SYNC', '0')
+    # Anche animedownloader (scenario download) legge ANIMESATURN_URL
+    os.environ.update(env)
+    if args.target == 'gunicorn':
+        target = GunicornTarget(env, args.gunicorn_workers, args.gunicorn_threads)
+    else:
+        target = FlaskTarget(env)
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'target': args.target,
+        'config': {name: value for name, value in vars(args).items() if name not in ('output', 'compare', 'json')},
+        'scenarios': {},
+    }
+    try:
+        for name in args.scenarios:
+            count = args.download_requests if name == 'download' else args.requests
+            concurrency = 1 if name == 'download' else args.concurrency
+            results['scenarios'][name] = run_scenario(SCENARIO_CLASSES[name](target, site, args), count, concurrency)
+    finally:
+        target.close()
+        site.shutdown()
+    results['standin_requests'] = site.requests
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+    print_table(results, previous)
+
+
+if __name__ == '__main__':
+    main()
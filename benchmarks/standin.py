@@ -0,0 +1,324 @@
+"""Server locale che sostituisce animesaturn, l'host dell'iframe, il CDN e l'API TMDb nei benchmark.
+
+Un solo ThreadingHTTPServer serve:
+
+    /animelist?search=q       risultati di ricerca (badge-archivio)
+    /animelist?page=N         pagine del catalogo (vuote oltre catalogue_pages)
+    /anime/<serie>            pagina della serie con N bottoni bottone-ep
+    /ep/<serie>-ep-<n>        pagina dell'episodio con il link watch?file=
+    /watch?file=<id>          pagina watch con l'iframe del player
+    /iframe/<id>              pagina del player con l'URL video (m3u8 o mp4)
+    /media/<id>/index.m3u8    playlist HLS, segmenti /media/<id>/seg<k>.ts
+    /media/<id>/video.mp4     file mp4 con supporto ai Range (HEAD, 206, 416)
+    /3/search/tv, /3/tv/<id>, /3/tv/<id>/season/<n>   JSON nel formato di TMDb
+    /img/<serie>.jpg, /t/p/<size>/<file>   copertine e poster (fixtures/cover.jpg, 500x750)
+
+Con pages='recorded' le pagine watch e iframe sono quelle salvate in fixtures/,
+con gli URL riscritti verso questo server. La latenza è configurabile per tipo
+di risorsa (page, media, tmdb); con rate_limit le pagine e TMDb rispondono 429
+(Retry-After: 1) oltre quel numero di richieste al secondo, come il sito vero.
+Le pagine HTML hanno un ETag e rispondono 304 a un If-None-Match uguale.
+
+    python benchmarks/standin.py [--port 8001] [--episodes 24] [--page-latency-ms 50]
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, quote, unquote, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+RECORDED_IFRAME_SRC = 'https://player.example-host.net/embed/op-1000?autoplay=1&amp;t=0'
+RECORDED_VIDEO_URL = 'https://cdn.example-host.net/dl/op-1000-720p.mp4?token=abc123&expires=1700000000'
+
+_range_re = re.compile(r'bytes=(\d*)-(\d*)$')
+_slug_re = re.compile(r'[^a-z0-9]+')
+
+
+def slugify(text):
+    return _slug_re.sub('-', text.lower()).strip('-') or 'serie'
+
+
+def tmdb_id(name):
+    return int(hashlib.sha1(name.encode('utf-8')).hexdigest()[:6], 16)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 512
+
+    def __init__(self, port=0, episodes=24, search_results=20, catalogue_pages=3, padding_kb=40,
+                 media='m3u8', media_kb=4096, segments=10, pages='synthetic',
+                 page_latency=0.05, media_latency=0.02, tmdb_latency=0.1, rate_limit=0):
+        super().__init__(('127.0.0.1', port), StandInHandler)
+        self.episodes = episodes
+        self.search_results = search_results
+        self.catalogue_pages = catalogue_pages
+        # Le pagine vere sono grandi (menu, script, footer): il parsing deve costare come in produzione
+        self.padding = '<div class="footer">' + '<a class="menu" href="/genere/x">Genere</a>' * (padding_kb * 24) + '</div>'
+        self.media = media
+        self.media_size = media_kb * 1024
+        self.segments = segments
+        self.pages = pages
+        self.latency = {'page': page_latency, 'media': media_latency, 'image': media_latency, 'tmdb': tmdb_latency}
+        self.blob = os.urandom(self.media_size)
+        with open(os.path.join(FIXTURES_DIR, 'cover.jpg'), 'rb') as f:
+            self.cover = f.read()
+        self.rate_limit = rate_limit
+        self._tokens = rate_limit
+        self._updated = time.monotonic()
+        self.requests = {}
+        self._lock = threading.Lock()
+        if pages == 'recorded':
+            with open(os.path.join(FIXTURES_DIR, 'watch_page.html'), encoding='utf-8') as f:
+                self.watch_page = f.read()
+            with open(os.path.join(FIXTURES_DIR, 'iframe_page.html'), encoding='utf-8') as f:
+                self.iframe_page = f.read()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_port}"
+
+    @property
+    def tmdb_url(self):
+        return f"{self.url}/3"
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def count(self, kind):
+        with self._lock:
+            self.requests[kind] = self.requests.get(kind, 0) + 1
+
+    def allow(self):
+        """Token bucket del limite simulato (burst pari a un secondo di richieste)."""
+        if not self.rate_limit:
+            return True
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.rate_limit, self._tokens + (now - self._updated) * self.rate_limit)
+            self._updated = now
+            if self._tokens < 1:
+                self.requests['throttled'] = self.requests.get('throttled', 0) + 1
+                return False
+            self._tokens -= 1
+            return True
+
+    def segment(self, index):
+        size = max(self.media_size // self.segments, 1)
+        start = (index * size) % max(self.media_size - size, 1)
+        return self.blob[start:start + size]
+
+    def html(self, body):
+        return f'<!DOCTYPE html><html><head><title>AnimeSaturn</title></head><body>{body}{self.padding}</body></html>'
+
+    # Pagine del sito
+
+    def search_page(self, query):
+        slug = slugify(query)
+        return self.html(''.join(f'<a class="badge-archivio" href="/anime/{slug}-{i}">{query} {i}</a>'
+                                 for i in range(1, self.search_results + 1)))
+
+    def catalogue_page(self, page):
+        if page > self.catalogue_pages:
+            return self.html('')
+        return self.html(''.join(f'<a class="badge-archivio" href="/anime/catalogo-{page}-{i}">Catalogo {page} {i}</a>'
+                                 for i in range(1, 51)))
+
+    def series_page(self, slug):
+        buttons = ''.join(
+            f'<div class="btn-group episodes-button"><a class="btn btn-dark mb-1 bottone-ep" href="/ep/{slug}-ep-{n}" '
+            f'title="Episodio {n}">Episodio {n}</a></div>'
+            for n in range(1, self.episodes + 1))
+        return self.html(f'<img class="img-fluid cover-anime rounded" src="{self.url}/img/{slug}.jpg">{buttons}')
+
+    def episode_page(self, episode):
+        return self.html(f'<a href="{self.url}/watch?file={quote(episode)}" target="_blank">Guarda lo streaming</a>')
+
+    def watch_page_for(self, episode):
+        iframe_src = f'{self.url}/iframe/{quote(episode)}'
+        if self.pages == 'recorded':
+            return self.watch_page.replace(RECORDED_IFRAME_SRC, iframe_src)
+        return self.html(f'<iframe class="embed-responsive-item" src="{iframe_src}" allowfullscreen></iframe>')
+
+    def video_url(self, episode):
+        name = 'index.m3u8' if self.media == 'm3u8' else 'video.mp4'
+        return f'{self.url}/media/{quote(episode)}/{name}'
+
+    def iframe_page_for(self, episode):
+        if self.pages == 'recorded':
+            return self.iframe_page.replace(RECORDED_VIDEO_URL, self.video_url(episode))
+        return self.html(f'<script>var player = jwplayer("player").setup({{file: "{self.video_url(episode)}"}});</script>')
+
+    def media_playlist(self, episode):
+        lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:4', '#EXT-X-MEDIA-SEQUENCE:0']
+        for index in range(self.segments):
+            lines += ['#EXTINF:4.0,', f'seg{index}.ts']
+        lines.append('#EXT-X-ENDLIST')
+        return '\n'.join(lines) + '\n'
+
+    # TMDb
+
+    def tmdb_search(self, query):
+        return {'page': 1, 'total_results': 1, 'total_pages': 1,
+                'results': [{'id': tmdb_id(query), 'name': query, 'original_name': query}]}
+
+    def tmdb_details(self, show_id):
+        return {'id': show_id, 'name': f'Serie {show_id}', 'original_name': f'Serie {show_id}',
+                'overview': 'Trama della serie.', 'first_air_date': '2020-01-01', 'poster_path': f'/{show_id}.jpg',
+                'genres': [{'id': 16, 'name': 'Animazione'}],
+                'seasons': [{'season_number': n, 'episode_count': self.episodes} for n in (1, 2)]}
+
+    def tmdb_season(self, show_id, season_number):
+        return {'id': show_id, 'season_number': season_number,
+                'episodes': [{'episode_number': n, 'name': f'Titolo episodio {n}'} for n in range(1, self.episodes + 1)]}
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_HEAD(self):
+        self.handle_request(head=True)
+
+    def do_GET(self):
+        self.handle_request(head=False)
+
+    def handle_request(self, head):
+        server = self.server
+        parsed = urlparse(self.path)
+        path, query = unquote(parsed.path), parse_qs(parsed.query)
+        if path.startswith('/media/'):
+            kind = 'media'
+        elif path.startswith(('/img/', '/t/p/')):
+            kind = 'image'
+        elif path.startswith('/3/'):
+            kind = 'tmdb'
+        else:
+            kind = 'page'
+        server.count(kind)
+        if kind not in ('media', 'image') and not server.allow():
+            return self.send_body('Too Many Requests', 'text/plain', head, status=429, headers={'Retry-After': '1'})
+        time.sleep(server.latency[kind])
+
+        if path == '/animelist' and 'search' in query:
+            return self.send_body(server.search_page(query['search'][0]), 'text/html', head)
+        if path == '/animelist':
+            return self.send_body(server.catalogue_page(int(query.get('page', ['1'])[0])), 'text/html', head)
+        if path.startswith('/anime/'):
+            return self.send_body(server.series_page(path[len('/anime/'):]), 'text/html', head)
+        if path.startswith('/ep/'):
+            return self.send_body(server.episode_page(path[len('/ep/'):]), 'text/html', head)
+        if path == '/watch' and 'file' in query:
+            return self.send_body(server.watch_page_for(query['file'][0]), 'text/html', head)
+        if path.startswith('/iframe/'):
+            return self.send_body(server.iframe_page_for(path[len('/iframe/'):]), 'text/html', head)
+        if path.startswith('/media/'):
+            episode, _, name = path[len('/media/'):].rpartition('/')
+            if name == 'index.m3u8':
+                return self.send_body(server.media_playlist(episode), 'application/vnd.apple.mpegurl', head)
+            if name.startswith('seg') and name.endswith('.ts'):
+                return self.send_body(server.segment(int(name[3:-3])), 'video/mp2t', head)
+            if name == 'video.mp4':
+                return self.send_media(server.blob, head)
+        if kind == 'image':
+            return self.send_body(server.cover, 'image/jpeg', head, headers={'Cache-Control': 'max-age=86400'})
+        if path == '/3/search/tv':
+            return self.send_json(server.tmdb_search(query.get('query', [''])[0]), head)
+        match = re.fullmatch(r'/3/tv/(\d+)(?:/season/(\d+))?', path)
+        if match:
+            show_id = int(match.group(1))
+            if match.group(2):
+                return self.send_json(server.tmdb_season(show_id, int(match.group(2))), head)
+            return self.send_json(server.tmdb_details(show_id), head)
+        self.send_body('', 'text/plain', head, status=404)
+
+    def send_json(self, data, head):
+        self.send_body(json.dumps(data), 'application/json', head)
+
+    def send_body(self, body, content_type, head, status=200, headers=None):
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        if status == 200 and content_type == 'text/html':
+            etag = '"%s"' % hashlib.sha1(data).hexdigest()[:16]
+            headers = dict(headers or {}, ETag=etag)
+            if self.headers.get('If-None-Match') == etag:
+                self.server.count('not_modified')
+                status, data = 304, b''
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not head:
+            try:
+                self.wfile.write(data)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    def send_media(self, blob, head):
+        size = len(blob)
+        headers = {'Accept-Ranges': 'bytes', 'ETag': '"standin"'}
+        range_header = self.headers.get('Range')
+        if not range_header:
+            return self.send_body(blob, 'video/mp4', head, headers=headers)
+        match = _range_re.match(range_header.strip())
+        if not match or not (match.group(1) or match.group(2)):
+            return self.send_body(b'', 'video/mp4', head, status=416, headers={'Content-Range': f'bytes */{size}'})
+        if match.group(1):
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+        else:
+            start, end = max(size - int(match.group(2)), 0), size - 1
+        if start >= size or start > end:
+            return self.send_body(b'', 'video/mp4', head, status=416, headers={'Content-Range': f'bytes */{size}'})
+        headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        self.send_body(blob[start:end + 1], 'video/mp4', head, status=206, headers=headers)
+
+    def log_message(self, *args):
+        pass
+
+
+def add_arguments(parser):
+    """Opzioni del server condivise con loadtest.py."""
+    parser.add_argument('--episodes', type=int, default=24, help="episodi per serie")
+    parser.add_argument('--search-results', type=int, default=20)
+    parser.add_argument('--padding-kb', type=int, default=40, help="dimensione aggiuntiva delle pagine HTML")
+    parser.add_argument('--media', choices=('m3u8', 'mp4'), default='m3u8', help="tipo di URL video nell'iframe")
+    parser.add_argument('--media-kb', type=int, default=4096)
+    parser.add_argument('--segments', type=int, default=10)
+    parser.add_argument('--pages', choices=('synthetic', 'recorded'), default='synthetic',
+                        help="pagine watch/iframe sintetiche o da fixtures/")
+    parser.add_argument('--page-latency-ms', type=int, default=50)
+    parser.add_argument('--media-latency-ms', type=int, default=20)
+    parser.add_argument('--tmdb-latency-ms', type=int, default=100)
+    parser.add_argument('--rate-limit', type=int, default=0, help="richieste/s oltre le quali le pagine rispondono 429")
+
+
+def from_arguments(args, port=0):
+    return StandInServer(port=port, episodes=args.episodes, search_results=args.search_results, padding_kb=args.padding_kb,
+                         media=args.media, media_kb=args.media_kb, segments=args.segments, pages=args.pages,
+                         page_latency=args.page_latency_ms / 1000, media_latency=args.media_latency_ms / 1000,
+                         tmdb_latency=args.tmdb_latency_ms / 1000, rate_limit=args.rate_limit)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--port', type=int, default=8001)
+    add_arguments(parser)
+    args = parser.parse_args()
+    server = from_arguments(args, port=args.port)
+    print(f"Sito: {server.url}  TMDb: {server.tmdb_url}")
+    print(f"Avvia l'app con ANIMESATURN_URL={server.url} TMDB_API_BASE={server.tmdb_url} TMDB_API_KEY=bench")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
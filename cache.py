@@ -0,0 +1,276 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+MISSING = object()
+
+
+def upsert(conn, table, key_column, key, values):
+    """UPDATE della riga con chiave key, o INSERT se non esiste (portabile tra SQLite e Postgres)."""
+    column = table.c[key_column]
+    if conn.execute(update(table).where(column == key).values(**values)).rowcount:
+        return
+    try:
+        with conn.begin_nested():
+            conn.execute(insert(table).values({key_column: key, **values}))
+    except IntegrityError:
+        # Un altro worker ha inserito la stessa chiave nel frattempo
+        conn.execute(update(table).where(column == key).values(**values))
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Coalescer:
+    """Esegue una sola volta le chiamate concorrenti con la stessa chiave.
+
+    Chi arriva mentre una chiamata è in corso attende e riceve lo stesso risultato.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+
+        if not leader:
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return call.result
+
+
+class MemoryBackend:
+    """Cache LRU in memoria con scadenza per chiave e limite di memoria (approssimato)."""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entries=20000):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.size = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # chiave -> (scadenza, dimensione, valore)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, size, value = entry
+            if expires_at < time.time():
+                del self._data[key]
+                self.size -= size
+                return MISSING
+            self._data.move_to_end(key)
+            return expires_at, value
+
+    def set(self, key, value, expires_at):
+        size = len(json.dumps(value))
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+            self._data[key] = (expires_at, size, value)
+            self.size += size
+            while self._data and (self.size > self.max_bytes or len(self._data) > self.max_entries):
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self.size -= evicted_size
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.size -= old[1]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.size = 0
+
+    def info(self):
+        return {'backend': 'memory', 'entries': len(self._data), 'bytes': self.size, 'evictions': self.evictions}
+
+
+class DBBackend:
+    """Cache condivisa tra i worker di gunicorn, salvata nel database di SQLAlchemy.
+
+    Usa direttamente l'engine (non db.session) così funziona anche dai thread
+    dei ThreadPoolExecutor, fuori dal contesto dell'applicazione.
+    """
+
+    def __init__(self, app, db, model, max_entries=50000, trim_every=200):
+        self.app = app
+        self.db = db
+        self.table = model.__table__
+        self.max_entries = max_entries
+        self.trim_every = trim_every
+        self._engine = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = self.db.engine
+        return self._engine
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        key = self._hash(key)
+        now = time.time()
+        t = self.table
+        with self.engine.begin() as conn:
+            row = conn.execute(select(t.c.value, t.c.expires_at).where(t.c.key == key)).first()
+            if row is None:
+                return MISSING
+            if row.expires_at < now:
+                conn.execute(delete(t).where(t.c.key == key))
+                return MISSING
+            conn.execute(update(t).where(t.c.key == key).values(accessed_at=now))
+        return row.expires_at, json.loads(row.value)
+
+    def set(self, key, value, expires_at):
+        key = self._hash(key)
+        values = {'value': json.dumps(value), 'expires_at': expires_at, 'accessed_at': time.time()}
+        with self.engine.begin() as conn:
+            upsert(conn, self.table, 'key', key, values)
+
+        with self._lock:
+            self._writes += 1
+            trim = self._writes % self.trim_every == 0
+        if trim:
+            self.trim()
+
+    def trim(self):
+        # Rimuove le voci scadute e quelle usate meno di recente oltre max_entries
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(delete(t).where(t.c.expires_at < time.time()))
+            excess = conn.execute(select(func.count()).select_from(t)).scalar() - self.max_entries
+            if excess > 0:
+                oldest = select(t.c.key).order_by(t.c.accessed_at).limit(excess)
+                conn.execute(delete(t).where(t.c.key.in_(oldest.scalar_subquery())))
+
+    def delete(self, key):
+        t = self.table
+        with self.engine.begin() as conn:
+            conn.execute(delete(t).where(t.c.key == self._hash(key)))
+
+    def clear(self):
+        with self.engine.begin() as conn:
+            conn.execute(delete(self.table))
+
+    def info(self):
+        with self.engine.connect() as conn:
+            entries = conn.execute(select(func.count()).select_from(self.table)).scalar()
+        return {'backend': 'db', 'entries': entries}
+
+
+class Cache:
+    """Cache a più livelli (es. memoria locale davanti al database) con contatori per namespace."""
+
+    def __init__(self, backends):
+        self.backends = backends
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def _count(self, namespace, field):
+        with self._lock:
+            stats = self._stats.setdefault(namespace, {'hits': 0, 'misses': 0})
+            stats[field] += 1
+
+    def get(self, namespace, key, default=None):
+        full_key = f"{namespace}:{key}"
+        for level, backend in enumerate(self.backends):
+            entry = backend.get(full_key)
+            if entry is MISSING:
+                continue
+            expires_at, value = entry
+            # Riporta il valore nei livelli più veloci
+            for upper in self.backends[:level]:
+                upper.set(full_key, value, expires_at)
+            self._count(namespace, 'hits')
+            return value
+        self._count(namespace, 'misses')
+        return default
+
+    def set(self, namespace, key, value, ttl):
+        full_key = f"{namespace}:{key}"
+        expires_at = time.time() + ttl
+        for backend in self.backends:
+            backend.set(full_key, value, expires_at)
+
+    def delete(self, namespace, key):
+        full_key = f"{namespace}:{key}"
+        for backend in self.backends:
+            backend.delete(full_key)
+
+    def memoize(self, namespace, ttl, key=None, cache_if=lambda result: result is not None, coalesce=False):
+        """Decoratore che mette in cache il risultato della funzione per ttl secondi.
+
+        Con coalesce=True le chiamate concorrenti con la stessa chiave (a cache
+        vuota) eseguono la funzione una sola volta e ne condividono il risultato.
+        """
+        def decorator(fn):
+            coalescer = Coalescer() if coalesce else None
+
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                cache_key = key(*args, **kwargs) if key else json.dumps([args, kwargs], sort_keys=True, default=str)
+                result = self.get(namespace, cache_key, MISSING)
+                if result is not MISSING:
+                    return result
+
+                def compute():
+                    result = fn(*args, **kwargs)
+                    if cache_if(result):
+                        self.set(namespace, cache_key, result, ttl)
+                    return result
+
+                return coalescer.do(cache_key, compute) if coalescer else compute()
+            wrapper.uncached = fn
+            return wrapper
+        return decorator
+
+    def counters(self):
+        """{namespace: {'hits', 'misses'}} senza interrogare i backend (per /metrics)."""
+        with self._lock:
+            return {namespace: dict(stats) for namespace, stats in self._stats.items()}
+
+    def stats(self):
+        namespaces = {
+            namespace: dict(stats, hit_rate=round(stats['hits'] / max(1, stats['hits'] + stats['misses']), 3))
+            for namespace, stats in self.counters().items()
+        }
+        return {'namespaces': namespaces, 'backends': [backend.info() for backend in self.backends]}
@@ -0,0 +1,362 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+import requests
+from bs4 import BeautifulSoup, SoupStrainer
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import http_client
+import metrics
+from episode_parser import Episode, parse_episode_page
+from title_index import CATALOGUE_PATH, MAX_CATALOGUE_PAGES, normalize
+
+LIST_INTERVAL = int(os.getenv('CATALOGUE_LIST_INTERVAL', 6 * 3600))  # pagine dell'elenco delle serie
+AIRING_INTERVAL = int(os.getenv('CATALOGUE_AIRING_INTERVAL', 3600))  # serie in corso
+STABLE_INTERVAL = int(os.getenv('CATALOGUE_STABLE_INTERVAL', 7 * 24 * 3600))  # serie concluse o ferme
+# Una serie con episodi nuovi da meno di così è considerata in corso anche se la pagina non lo dice
+AIRING_WINDOW = int(os.getenv('CATALOGUE_AIRING_WINDOW', 21 * 24 * 3600))
+# Letta da get_episodes dopo così tanto tempo dall'ultimo controllo: servita subito e ricontrollata a breve
+REVALIDATE_AFTER = int(os.getenv('CATALOGUE_REVALIDATE_AFTER', 24 * 3600))
+MAX_RATE = float(os.getenv('CATALOGUE_MAX_RATE', 2))  # richieste/s del crawler, per lasciare spazio agli utenti
+TICK = 30  # ogni quanto il crawler cerca serie da ricontrollare
+BATCH = 50
+CLAIM_TTL = 300  # una serie presa da un worker che si blocca torna disponibile dopo questo tempo
+
+_series_path_re = re.compile(r'/anime/[^/]+')
+_airing_re = re.compile(r'Stato:\s*(?:</?\w+[^>]*>\s*)*In corso', re.IGNORECASE)
+_badge_strainer = SoupStrainer('a', class_='badge-archivio')
+
+log = metrics.get_logger('catalogue_store')
+fetches = metrics.counter('animescraper_catalogue_fetches_total', "Pagine ricontrollate dal crawler del catalogo",
+                          ('kind', 'result'))
+new_episodes = metrics.counter('animescraper_catalogue_new_episodes_total', "Episodi nuovi trovati dal crawler")
+
+
+def _digest(value):
+    return hashlib.sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _conditional_headers(row):
+    headers = {}
+    if row is not None and row.etag:
+        headers['If-None-Match'] = row.etag
+    if row is not None and row.last_modified:
+        headers['If-Modified-Since'] = row.last_modified
+    return headers
+
+
+class CatalogueStore:
+    """Copia locale del catalogo (serie, episodi, copertine) aggiornata in background.
+
+    Le pagine vengono riscaricate con If-None-Match/If-Modified-Since e confrontate
+    con l'hash del contenuto estratto, così il database cambia solo quando cambia
+    il sito. Le serie in corso vengono ricontrollate ogni AIRING_INTERVAL, le altre
+    ogni STABLE_INTERVAL; i worker si dividono il lavoro prendendo le righe scadute
+    con un UPDATE condizionato.
+    """
+
+    def __init__(self, app, db, series_model, episode_model, page_model, base_url, site=None, on_change=None):
+        self.app = app
+        self.db = db
+        self.series = series_model.__table__
+        self.episodes_table = episode_model.__table__
+        self.pages = page_model.__table__
+        self.base_url = base_url
+        # Con site (un mirrors.MirrorPool) le pagine arrivano dal mirror migliore e gli URL salvati sono canonici
+        self.get = site.get if site else http_client.get
+        self.canonical = site.canonical if site else (lambda url: url)
+        self.on_change = on_change  # chiamata con l'URL di una serie i cui episodi sono cambiati
+        self._ready = False
+        self._last_fetch = 0.0
+        self._pace_lock = threading.Lock()
+        self._engine = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = self.db.engine
+        return self._engine
+
+    # Lettura
+
+    def ready(self):
+        """True quando l'elenco delle serie è stato percorso tutto almeno una volta."""
+        if not self._ready:
+            p = self.pages
+            with self.engine.connect() as conn:
+                self._ready = conn.execute(select(p.c.page).where(p.c.entry_count == 0, p.c.fetched_at.is_not(None))
+                                           .limit(1)).first() is not None
+        return self._ready
+
+    def search(self, query):
+        """Serie il cui titolo contiene la ricerca, nel formato di search_anime; None se il catalogo non è pronto."""
+        q = normalize(query)
+        if not q or not self.ready():
+            return None
+        s = self.series
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(s.c.title, s.c.url).where(s.c.search_title.contains(q, autoescape=True))
+                                .order_by(s.c.title)).all()
+        return [{"title": row.title, "url": row.url} for row in rows]
+
+    def titles(self):
+        s = self.series
+        with self.engine.connect() as conn:
+            return [{"title": row.title, "url": row.url}
+                    for row in conn.execute(select(s.c.title, s.c.url))]
+
+    def series_url(self, url):
+        """URL canonico della pagina di una serie (senza query e frammento), None se non lo è."""
+        parts = urlsplit(self.canonical(urljoin(self.base_url, url)))
+        path = parts.path.rstrip('/')
+        if parts.netloc != urlsplit(self.base_url).netloc or not _series_path_re.fullmatch(path):
+            return None
+        return urlunsplit((parts.scheme, parts.netloc, path, '', ''))
+
+    def episodes(self, series_url, refresh=True):
+        """Episodi della serie dalla copia locale; se mancano (e refresh) li scarica subito.
+
+        None per le serie che il crawler dell'elenco non conosce: il chiamante le legge
+        dal sito senza salvarle, così un client non può far crescere la tabella.
+        """
+        s, e = self.series, self.episodes_table
+        now = time.time()
+        series_url = self.series_url(series_url)
+        if series_url is None:
+            return None
+        with self.engine.connect() as conn:
+            row = conn.execute(select(s.c.thumbnail, s.c.fetched_at).where(s.c.url == series_url)).first()
+            if row is not None and row.fetched_at is not None:
+                episodes = [Episode(ep.label, ep.title, ep.url, row.thumbnail) for ep in conn.execute(
+                    select(e.c.label, e.c.title, e.c.url).where(e.c.series_url == series_url).order_by(e.c.position))]
+        if row is None:
+            return None
+        if row.fetched_at is None:
+            return self.refresh_series(series_url) if refresh else None
+        if now - row.fetched_at > REVALIDATE_AFTER:
+            # Servita dalla copia locale, ma il crawler la ricontrolla al prossimo giro
+            with self.engine.begin() as conn:
+                conn.execute(update(s).where(s.c.url == series_url, s.c.next_check_at > now).values(next_check_at=now))
+        return episodes
+
+    # Crawler
+
+    def _pace(self):
+        if MAX_RATE <= 0:
+            return
+        with self._pace_lock:
+            wait = self._last_fetch + 1 / MAX_RATE - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self._last_fetch = time.monotonic()
+
+    def _claim_page(self, page, now):
+        p = self.pages
+        with self.engine.begin() as conn:
+            if conn.execute(update(p).where(p.c.page == page, p.c.next_check_at <= now)
+                            .values(next_check_at=now + LIST_INTERVAL)).rowcount:
+                return True
+            try:
+                with conn.begin_nested():
+                    conn.execute(insert(p).values(page=page, entry_count=-1, next_check_at=now + LIST_INTERVAL))
+                return True
+            except IntegrityError:
+                return False  # già presa da un altro worker, o non ancora scaduta
+
+    def crawl_list(self, max_pages=MAX_CATALOGUE_PAGES):
+        """Ricontrolla le pagine scadute dell'elenco delle serie; restituisce quante serie nuove ha trovato."""
+        p = self.pages
+        with self.engine.connect() as conn:
+            next_check_at = conn.execute(select(func.min(p.c.next_check_at))).scalar()
+        if next_check_at is not None and next_check_at > time.time():
+            return 0
+        added = 0
+        for page in range(1, max_pages + 1):
+            now = time.time()
+            if not self._claim_page(page, now):
+                with self.engine.connect() as conn:
+                    if conn.execute(select(p.c.entry_count).where(p.c.page == page)).scalar() == 0:
+                        break  # ultima pagina già vista
+                continue
+            with self.engine.connect() as conn:
+                row = conn.execute(select(p).where(p.c.page == page)).first()
+            self._pace()
+            try:
+                response = self.get(urljoin(self.base_url, CATALOGUE_PATH.format(page=page)), headers=_conditional_headers(row))
+                response.raise_for_status()
+            except requests.RequestException:
+                # La pagina torna disponibile dopo CLAIM_TTL invece che dopo LIST_INTERVAL
+                with self.engine.begin() as conn:
+                    conn.execute(update(p).where(p.c.page == page).values(next_check_at=now + CLAIM_TTL))
+                raise
+            if response.status_code == 304:
+                fetches.inc(kind='list', result='not_modified')
+                with self.engine.begin() as conn:
+                    conn.execute(update(p).where(p.c.page == page).values(fetched_at=now))
+                if row.entry_count == 0:
+                    break
+                continue
+            with metrics.span('html_parse'):
+                soup = BeautifulSoup(response.text, 'html.parser', parse_only=_badge_strainer)
+            entries = {}
+            for a in soup.find_all('a', href=True):
+                url = self.series_url(a['href'])
+                if url:
+                    entries[url] = a.text.strip()
+            digest = _digest(entries)
+            if digest == row.content_hash:
+                fetches.inc(kind='list', result='unchanged')
+            else:
+                fetches.inc(kind='list', result='changed')
+                added += self._store_entries(entries)
+            with self.engine.begin() as conn:
+                conn.execute(update(p).where(p.c.page == page).values(
+                    etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'),
+                    content_hash=digest, entry_count=len(entries), fetched_at=now))
+            if not entries:
+                break
+        return added
+
+    def _store_entries(self, entries):
+        s = self.series
+        added = 0
+        with self.engine.begin() as conn:
+            known = dict(conn.execute(select(s.c.url, s.c.title).where(s.c.url.in_(list(entries)))).all())
+            for url, title in entries.items():
+                if url not in known:
+                    try:
+                        with conn.begin_nested():
+                            # next_check_at=0: gli episodi di una serie nuova vengono scaricati al primo giro
+                            conn.execute(insert(s).values(url=url, title=title, search_title=normalize(title),
+                                                          episode_count=0, airing=False, next_check_at=0))
+                        added += 1
+                    except IntegrityError:
+                        pass
+                elif known[url] != title:
+                    conn.execute(update(s).where(s.c.url == url).values(title=title, search_title=normalize(title)))
+        return added
+
+    def _claim_series(self, series_url, now):
+        s = self.series
+        with self.engine.begin() as conn:
+            return bool(conn.execute(update(s).where(s.c.url == series_url, s.c.next_check_at <= now)
+                                     .values(next_check_at=now + CLAIM_TTL)).rowcount)
+
+    def refresh_series(self, series_url):
+        """Riscarica la pagina della serie (richiesta condizionata) e aggiorna gli episodi se sono cambiati.
+
+        Solo per le serie trovate dal crawler dell'elenco: per le altre restituisce None.
+        """
+        s, e = self.series, self.episodes_table
+        with self.engine.connect() as conn:
+            row = conn.execute(select(s).where(s.c.url == series_url)).first()
+        if row is None:
+            return None
+        fetched = row.fetched_at is not None
+        response = self.get(series_url, headers=_conditional_headers(row) if fetched else {})
+        now = time.time()
+        html = None
+        if response.status_code == 304 and fetched:
+            changed = False
+            fetches.inc(kind='series', result='not_modified')
+        else:
+            response.raise_for_status()
+            html = response.text
+            episodes = [ep._replace(url=self.canonical(ep.url)) for ep in parse_episode_page(html, series_url)]
+            digest = _digest(episodes)
+            changed = digest != row.content_hash
+            fetches.inc(kind='series', result='changed' if changed else 'unchanged')
+
+        with self.engine.begin() as conn:
+            # Blocca la riga: due aggiornamenti concorrenti della stessa serie non si sovrappongono
+            conn.execute(select(s.c.url).where(s.c.url == series_url).with_for_update())
+            values = {'fetched_at': now}
+            changed_at = row.changed_at
+            if changed:
+                old_urls = set(conn.execute(select(e.c.url).where(e.c.series_url == series_url)).scalars())
+                conn.execute(delete(e).where(e.c.series_url == series_url))
+                if episodes:
+                    conn.execute(insert(e), [{'series_url': series_url, 'position': position, 'label': ep.label,
+                                              'title': ep.title, 'url': ep.url} for position, ep in enumerate(episodes)])
+                added = [ep.url for ep in episodes if ep.url not in old_urls]
+                if fetched and added:
+                    changed_at = now
+                    new_episodes.inc(len(added))
+                    log.info("%d episodi nuovi in %s", len(added), series_url)
+                values.update(content_hash=digest, episode_count=len(episodes), changed_at=changed_at,
+                              thumbnail=episodes[0].thumbnail if episodes else None)
+            if html is not None:
+                values.update(etag=response.headers.get('ETag'), last_modified=response.headers.get('Last-Modified'))
+                airing = bool(_airing_re.search(html))
+            else:
+                airing = bool(row.airing)
+            airing = airing or (changed_at is not None and now - changed_at < AIRING_WINDOW)
+            values.update(airing=airing, next_check_at=now + (AIRING_INTERVAL if airing else STABLE_INTERVAL))
+            conn.execute(update(s).where(s.c.url == series_url).values(**values))
+            if not changed:
+                episodes = [Episode(ep.label, ep.title, ep.url, row.thumbnail) for ep in conn.execute(
+                    select(e.c.label, e.c.title, e.c.url).where(e.c.series_url == series_url).order_by(e.c.position))]
+
+        if changed and fetched and self.on_change:
+            self.on_change(series_url)
+        return episodes
+
+    def due_series(self, limit=BATCH):
+        """Serie da ricontrollare: prima quelle in corso, poi le altre, dalla più in ritardo."""
+        s = self.series
+        with self.engine.connect() as conn:
+            return list(conn.execute(select(s.c.url).where(s.c.next_check_at <= time.time())
+                                     .order_by(s.c.airing.desc(), s.c.next_check_at).limit(limit)).scalars())
+
+    def sync(self):
+        """Un giro del crawler: elenco delle serie (se scaduto) e serie da ricontrollare."""
+        try:
+            added = self.crawl_list()
+            if added:
+                log.info("Catalogo: %d serie nuove", added)
+        except Exception as e:
+            log.warning("Errore durante la lettura dell'elenco delle serie: %s", e)
+        refreshed = 0
+        for series_url in self.due_series():
+            if not self._claim_series(series_url, time.time()):
+                continue
+            self._pace()
+            try:
+                self.refresh_series(series_url)
+                refreshed += 1
+            except Exception as e:
+                fetches.inc(kind='series', result='error')
+                log.warning("Errore durante l'aggiornamento di %s: %s", series_url, e)
+        return refreshed
+
+    def start_background_sync(self, tick=TICK):
+        def run():
+            while True:
+                try:
+                    # Finché ci sono serie scadute si continua senza pause
+                    while self.sync():
+                        pass
+                except Exception as e:
+                    log.warning("Errore durante l'aggiornamento del catalogo: %s", e)
+                time.sleep(tick)
+
+        thread = threading.Thread(target=run, name='catalogue-sync', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        s, e = self.series, self.episodes_table
+        with self.engine.connect() as conn:
+            series_count, airing, fetched = conn.execute(select(
+                func.count(), func.count().filter(s.c.airing), func.count(s.c.fetched_at)).select_from(s)).one()
+            episodes = conn.execute(select(func.count()).select_from(e)).scalar()
+            due = conn.execute(select(func.count()).select_from(s).where(s.c.next_check_at <= time.time())).scalar()
+        return {'ready': self.ready(), 'series': series_count, 'airing': airing, 'fetched': fetched,
+                'due': due, 'episodes': episodes}
@@ -0,0 +1,260 @@
+"""Interfaccia a riga di comando non interattiva per animedownloader.
+
+    python cli.py search "one piece"
+    python cli.py list-episodes --query "one piece"
+    python cli.py resolve https://www.animesaturn.cx/ep/...
+    python cli.py download jobs.yaml
+    python cli.py download --query "frieren" --episodes 1-10 --output-dir ./anime
+
+Tutto l'output su stdout è JSON (una riga per evento in download); i
+messaggi leggibili finiscono su stderr. Il codice di uscita è il numero di
+episodi non scaricati (massimo 100), 0 se tutto è andato a buon fine,
+EXIT_ERROR se il file di job o la ricerca non sono utilizzabili.
+
+File di job (YAML se PyYAML è installato, altrimenti JSON):
+
+    output_dir: /data/anime
+    resolve_workers: 2
+    download_workers: 5
+    bandwidth_kbps: 0
+    jobs:
+      - query: "Frieren"
+        episodes: "1-10,12"
+      - url: https://www.animesaturn.cx/anime/...
+        title: One Piece
+        episodes: all
+        output_dir: /data/onepiece
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import animedownloader
+import metrics
+
+try:
+    import yaml
+except ImportError:
+    yaml = None
+
+MAX_FAILURES_EXIT = 100
+EXIT_ERROR = 101
+
+log = metrics.get_logger('cli')
+
+
+class JobFileError(Exception):
+    pass
+
+
+class JSONEmitter:
+    """Scrive eventi JSON (uno per riga) sullo stdout originale, anche da più thread."""
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        line = json.dumps(dict(fields, event=event, time=round(time.time(), 3)), ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + '\n')
+            self.stream.flush()
+
+
+def parse_episode_range(spec, count):
+    """Numeri di episodio (da 1) selezionati da spec: 'all', '5', '1-12,15', oppure una lista."""
+    if spec is None or spec == 'all':
+        return list(range(1, count + 1))
+    if isinstance(spec, int):
+        parts = [str(spec)]
+    elif isinstance(spec, (list, tuple)):
+        parts = [str(part) for part in spec]
+    else:
+        parts = str(spec).split(',')
+    numbers = set()
+    for part in parts:
+        part = part.strip()
+        if not part:
+            continue
+        start, _, end = part.partition('-')
+        try:
+            start = int(start)
+            end = int(end) if end else (count if part.endswith('-') else start)
+        except ValueError:
+            raise JobFileError(f"Range di episodi non valido: {part!r}")
+        numbers.update(n for n in range(start, end + 1) if 1 <= n <= count)
+    return sorted(numbers)
+
+
+def load_job_file(path):
+    with open(path, encoding='utf-8') as f:
+        text = f.read()
+    if path.endswith(('.yaml', '.yml')):
+        if yaml is None:
+            raise JobFileError("Per i file YAML serve PyYAML (pip install pyyaml), oppure usa JSON")
+        data = yaml.safe_load(text)
+    else:
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            raise JobFileError(f"File di job non valido: {e}")
+    if isinstance(data, list):
+        data = {'jobs': data}
+    if not isinstance(data, dict) or not isinstance(data.get('jobs'), list):
+        raise JobFileError("Il file di job deve contenere una lista 'jobs'")
+    for job in data['jobs']:
+        if not isinstance(job, dict) or not (job.get('url') or job.get('query')):
+            raise JobFileError(f"Ogni job deve avere 'url' o 'query': {job!r}")
+    return data
+
+
+def find_series(query):
+    results = animedownloader.search_anime(query)
+    if not results:
+        raise JobFileError(f"Nessun risultato per {query!r}")
+    return results[0]
+
+
+def expand_job(job, default_output_dir):
+    """Risolve serie ed episodi di un job: restituisce (titolo, cartella, [(cartella, numero, titolo, url)])."""
+    if job.get('url'):
+        title, url = job.get('title'), job['url']
+        title = title or url.rstrip('/').rsplit('/', 1)[-1]
+    else:
+        title, url = find_series(job['query'])
+        title = job.get('title') or title
+    episodes = animedownloader.get_episodes(url)
+    output_dir = job.get('output_dir') or os.path.join(default_output_dir, title)
+    numbers = parse_episode_range(job.get('episodes'), len(episodes))
+    os.makedirs(output_dir, exist_ok=True)
+    return title, output_dir, [(output_dir, n, episodes[n - 1][0], episodes[n - 1][1]) for n in numbers]
+
+
+def cmd_search(args, out):
+    results = animedownloader.search_anime(args.query)
+    out.emit('search', query=args.query, results=[{'title': title, 'url': url} for title, url in results])
+    return 0
+
+
+def cmd_list_episodes(args, out):
+    title, url = (args.title, args.url) if args.url else find_series(args.query)
+    episodes = animedownloader.get_episodes(url)
+    out.emit('episodes', title=title, url=url,
+             episodes=[{'number': i, 'title': ep_title, 'url': ep_url} for i, (ep_title, ep_url) in enumerate(episodes, 1)])
+    return 0
+
+
+def cmd_resolve(args, out):
+    failed = 0
+    with ThreadPoolExecutor(max_workers=args.resolve_workers) as executor:
+        for episode_url, video_url in zip(args.episode_urls, executor.map(_safe_resolve, args.episode_urls)):
+            failed += not video_url
+            out.emit('resolved', episode_url=episode_url, video_url=video_url, ok=bool(video_url))
+    return min(failed, MAX_FAILURES_EXIT)
+
+
+def _safe_resolve(episode_url):
+    try:
+        return animedownloader.resolve_episode(episode_url)
+    except requests.RequestException as e:
+        log.warning("Errore nella risoluzione di %s: %s", episode_url, e)
+        return None
+
+
+def cmd_download(args, out):
+    if args.job_file:
+        config = load_job_file(args.job_file)
+    elif args.url or args.query:
+        config = {'jobs': [{'url': args.url, 'query': args.query, 'title': args.title, 'episodes': args.episodes}]}
+    else:
+        raise JobFileError("Indica un file di job oppure --url/--query")
+    output_dir = args.output_dir or config.get('output_dir') or os.getcwd()
+    resolve_workers = args.resolve_workers or config.get('resolve_workers') or animedownloader.MAX_CONCURRENT_RESOLVES
+    download_workers = args.download_workers or config.get('download_workers') or animedownloader.MAX_CONCURRENT_DOWNLOADS
+    bandwidth_kbps = args.bandwidth_kbps if args.bandwidth_kbps is not None else config.get('bandwidth_kbps', animedownloader.MAX_BANDWIDTH_KBPS)
+
+    # Elenco episodi di tutte le serie (in parallelo, con lo stesso limite dei resolver)
+    episodes = {}  # (cartella, numero) -> job: due job sulla stessa serie non scaricano due volte lo stesso file
+    failed_series = 0
+    with ThreadPoolExecutor(max_workers=resolve_workers) as executor:
+        futures = [(job, executor.submit(expand_job, job, output_dir)) for job in config['jobs']]
+        for job, future in futures:
+            try:
+                title, series_dir, series_episodes = future.result()
+            except (requests.RequestException, JobFileError) as e:
+                failed_series += 1
+                out.emit('series_failed', job=job, error=str(e))
+                continue
+            for episode in series_episodes:
+                episodes.setdefault(episode[:2], episode)
+            out.emit('series', title=title, episodes=len(series_episodes), output_dir=series_dir)
+
+    def finished(job, ok):
+        directory, ep_num, ep_title, ep_url = job
+        out.emit('episode', output_dir=directory, number=ep_num, title=ep_title, url=ep_url, ok=ok)
+
+    results = animedownloader.download_jobs(
+        list(episodes.values()), resolve_workers=resolve_workers, download_workers=download_workers, bandwidth_kbps=bandwidth_kbps,
+        report=lambda progress: out.emit('progress', **progress.snapshot()), on_finished=finished)
+    failed = sum(1 for ok in results.values() if not ok)
+    out.emit('summary', episodes=len(results), ok=len(results) - failed, failed=failed, failed_series=failed_series)
+    if failed_series and not results:
+        return EXIT_ERROR
+    return min(failed, MAX_FAILURES_EXIT)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="AnimeSaturn downloader non interattivo (output JSON)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    search = subparsers.add_parser('search', help="cerca una serie")
+    search.add_argument('query')
+    search.set_defaults(handler=cmd_search)
+
+    list_episodes = subparsers.add_parser('list-episodes', help="elenca gli episodi di una serie")
+    source = list_episodes.add_mutually_exclusive_group(required=True)
+    source.add_argument('--url', help="URL della pagina della serie")
+    source.add_argument('--query', help="usa il primo risultato della ricerca")
+    list_episodes.add_argument('--title')
+    list_episodes.set_defaults(handler=cmd_list_episodes)
+
+    resolve = subparsers.add_parser('resolve', help="trova l'URL video degli episodi")
+    resolve.add_argument('episode_urls', nargs='+', metavar='episode_url')
+    resolve.add_argument('--resolve-workers', type=int, default=animedownloader.MAX_CONCURRENT_RESOLVES)
+    resolve.set_defaults(handler=cmd_resolve)
+
+    download = subparsers.add_parser('download', help="scarica le serie di un file di job (o di una sola serie)")
+    download.add_argument('job_file', nargs='?', help="file di job YAML/JSON")
+    download.add_argument('--url', help="URL della serie (senza file di job)")
+    download.add_argument('--query', help="cerca la serie e usa il primo risultato (senza file di job)")
+    download.add_argument('--title')
+    download.add_argument('--episodes', default='all', help="es. 'all', '1-12', '1-3,7'")
+    download.add_argument('--output-dir')
+    download.add_argument('--resolve-workers', type=int)
+    download.add_argument('--download-workers', type=int)
+    download.add_argument('--bandwidth-kbps', type=int)
+    download.set_defaults(handler=cmd_download)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    out = JSONEmitter(sys.stdout)
+    # I print dei moduli (colorati, per umani) vanno su stderr come i log di metrics: stdout resta JSON puro
+    with contextlib.redirect_stdout(sys.stderr):
+        try:
+            return args.handler(args, out)
+        except (JobFileError, OSError, requests.RequestException) as e:
+            out.emit('error', error=str(e))
+            return EXIT_ERROR
+
+
+if __name__ == '__main__':
+    sys.exit(main())
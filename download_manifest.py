@@ -0,0 +1,94 @@
+import json
+import os
+import threading
+import time
+
+import metrics
+
+MANIFEST_NAME = '.download_manifest.json'
+
+_manifests = {}
+_manifests_lock = threading.Lock()
+
+log = metrics.get_logger('download_manifest')
+
+
+def merge_ranges(ranges):
+    """Unisce i range [inizio, fine] sovrapposti o adiacenti, in ordine."""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+
+class DownloadManifest:
+    """Stato dei download di una serie, salvato come JSON nella sua cartella.
+
+    Per ogni file registra URL risolto, ETag/Last-Modified, dimensione attesa e
+    i range già scritti nel file .part, così un nuovo avvio scarica solo i byte
+    mancanti e salta gli episodi già completi.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                log.warning("Manifest non leggibile, riparto da zero (%s): %s", path, e)
+
+    def _save(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._entries, f, indent=1)
+        os.replace(tmp_path, self.path)
+
+    def get(self, name):
+        with self._lock:
+            entry = self._entries.get(name)
+            return dict(entry) if entry else None
+
+    def update(self, name, **fields):
+        with self._lock:
+            entry = self._entries.setdefault(name, {'completed': []})
+            entry.update(fields, updated_at=time.time())
+            self._save()
+
+    def start(self, name, video_url, size, etag=None, last_modified=None, **fields):
+        """Nuovo download (o file remoto cambiato): azzera i range completati."""
+        with self._lock:
+            self._entries[name] = dict(fields, video_url=video_url, size=size, etag=etag, last_modified=last_modified,
+                                       completed=[], status='partial', updated_at=time.time())
+            self._save()
+
+    def add_range(self, name, start, end):
+        with self._lock:
+            entry = self._entries.setdefault(name, {'completed': []})
+            entry['completed'] = merge_ranges(entry['completed'] + [[start, end]])
+            entry['updated_at'] = time.time()
+            self._save()
+
+    def complete(self, name, size):
+        self.update(name, status='complete', size=size, completed=[[0, size - 1]] if size else [])
+
+    def is_complete(self, name, path):
+        """True se il file finale esiste ed ha la dimensione registrata a fine download."""
+        entry = self.get(name)
+        return bool(entry and entry.get('status') == 'complete' and os.path.exists(path)
+                    and os.path.getsize(path) == entry.get('size'))
+
+
+def open_manifest(directory):
+    """Manifest condiviso (una sola istanza per cartella nel processo)."""
+    path = os.path.join(directory, MANIFEST_NAME)
+    with _manifests_lock:
+        manifest = _manifests.get(path)
+        if manifest is None:
+            manifest = _manifests[path] = DownloadManifest(path)
+        return manifest
@@ -0,0 +1,209 @@
+import itertools
+import queue
+import threading
+import time
+from collections import deque
+
+import metrics
+
+# Valore di priorità che fa terminare i thread di uno stadio
+_STOP = float('inf')
+
+log = metrics.get_logger('download_pipeline')
+
+
+class TokenBucket:
+    """Limite di banda globale: consume(n) blocca finché n byte sono concessi.
+
+    rate in byte/s (0 o None = nessun limite), burst = byte spendibili di colpo.
+    Il debito è ammesso: un blocco più grande del burst attende il tempo necessario.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate or 0
+        self.burst = burst or max(self.rate, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, n):
+        if not self.rate:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= n
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class ProgressTracker:
+    """Avanzamento aggregato di tutti i download: byte, velocità ed ETA.
+
+    La velocità è calcolata sugli ultimi window secondi. Gli episodi di cui non
+    si conosce ancora la dimensione vengono stimati con la media di quelli noti.
+    """
+
+    def __init__(self, total_jobs=0, window=10):
+        self.total_jobs = total_jobs
+        self.window = window
+        self.done_jobs = 0
+        self.failed_jobs = 0
+        self.bytes_done = 0
+        self.bytes_expected = 0
+        self.sized_jobs = 0
+        self.started_at = time.monotonic()
+        self._samples = deque()  # (istante, byte)
+        self._lock = threading.Lock()
+
+    def expect(self, size):
+        """Registra la dimensione (byte ancora da scaricare) di un episodio appena avviato."""
+        with self._lock:
+            self.bytes_expected += size
+            self.sized_jobs += 1
+
+    def add(self, n):
+        now = time.monotonic()
+        with self._lock:
+            self.bytes_done += n
+            self._samples.append((now, n))
+            while self._samples and self._samples[0][0] < now - self.window:
+                self._samples.popleft()
+
+    def job_finished(self, ok):
+        with self._lock:
+            self.done_jobs += 1
+            if not ok:
+                self.failed_jobs += 1
+
+    def rate(self):
+        with self._lock:
+            if not self._samples:
+                return 0.0
+            elapsed = max(time.monotonic() - max(self._samples[0][0], self.started_at), 1.0)
+            return sum(n for _, n in self._samples) / elapsed
+
+    def eta(self):
+        rate = self.rate()
+        with self._lock:
+            unsized = max(self.total_jobs - self.sized_jobs, 0)
+            average = self.bytes_expected / self.sized_jobs if self.sized_jobs else 0
+            remaining = self.bytes_expected + average * unsized - self.bytes_done
+        if rate <= 0 or remaining <= 0 or not average:
+            return None
+        return remaining / rate
+
+    def snapshot(self):
+        return {
+            'jobs': self.total_jobs,
+            'done': self.done_jobs,
+            'failed': self.failed_jobs,
+            'bytes': self.bytes_done,
+            'expected_bytes': self.bytes_expected,
+            'bytes_per_second': round(self.rate()),
+            'eta': self.eta(),
+        }
+
+    def format(self):
+        snapshot = self.snapshot()
+        eta = snapshot['eta']
+        eta_text = time.strftime('%H:%M:%S', time.gmtime(eta)) if eta is not None else '--:--:--'
+        return (f"{snapshot['done']}/{snapshot['jobs']} episodi, {snapshot['bytes'] / 1048576:.1f} MB, "
+                f"{snapshot['bytes_per_second'] / 1048576:.2f} MB/s, ETA {eta_text}")
+
+
+class DownloadPipeline:
+    """Pipeline a due stadi: risoluzione degli URL video e download dei byte.
+
+    I due stadi hanno pool di thread separati collegati da una coda limitata:
+    lo scraping lento non occupa slot di download, e i resolver si fermano
+    quando hanno queue_size episodi risolti in attesa (niente raffiche verso
+    il sito). Entrambe le code sono a priorità, così gli episodi con numero
+    più basso vengono risolti e scaricati per primi.
+
+    resolve(job) restituisce l'URL video (None se non trovato);
+    download(job, video_url, progress, on_size) restituisce True se riuscito.
+    I job devono essere hashable: run() restituisce {job: True/False}.
+    """
+
+    def __init__(self, resolve, download, resolve_workers=2, download_workers=5, queue_size=None,
+                 bandwidth=None, on_finished=None):
+        self.resolve = resolve
+        self.download = download
+        self.resolve_workers = resolve_workers
+        self.download_workers = download_workers
+        self.bucket = TokenBucket(bandwidth, burst=bandwidth // 4 if bandwidth else None)
+        self.progress = ProgressTracker()
+        self.on_finished = on_finished
+        self.results = {}
+        self._pending = queue.PriorityQueue()
+        self._resolved = queue.PriorityQueue(maxsize=queue_size or download_workers)
+        self._counter = itertools.count()  # a parità di priorità mantiene l'ordine di inserimento
+
+    def submit(self, priority, job):
+        self.progress.total_jobs += 1
+        self._pending.put((priority, next(self._counter), job))
+
+    def _finish(self, priority, job, ok):
+        self.results[job] = ok
+        self.progress.job_finished(ok)
+        if self.on_finished:
+            self.on_finished(job, ok)
+
+    def _resolve_loop(self):
+        while True:
+            priority, order, job = self._pending.get()
+            if priority == _STOP:
+                return
+            try:
+                video_url = self.resolve(job)
+            except Exception as e:
+                log.warning("Risoluzione fallita per %s: %s", job, e)
+                video_url = None
+            if video_url:
+                self._resolved.put((priority, order, (job, video_url)))
+            else:
+                self._finish(priority, job, False)
+
+    def _transferred(self, n):
+        self.bucket.consume(n)
+        self.progress.add(n)
+
+    def _download_loop(self):
+        while True:
+            priority, _, item = self._resolved.get()
+            if priority == _STOP:
+                return
+            job, video_url = item
+            try:
+                ok = bool(self.download(job, video_url, self._transferred, self.progress.expect))
+            except Exception as e:
+                log.warning("Download fallito per %s: %s", job, e)
+                ok = False
+            self._finish(priority, job, ok)
+
+    def run(self, report=None, report_interval=2.0):
+        """Esegue tutti i job inviati e attende la fine; report(progress) viene chiamata periodicamente."""
+        resolvers = [threading.Thread(target=self._resolve_loop, name=f'resolver-{i}', daemon=True)
+                     for i in range(self.resolve_workers)]
+        downloaders = [threading.Thread(target=self._download_loop, name=f'downloader-{i}', daemon=True)
+                       for i in range(self.download_workers)]
+        for thread in resolvers + downloaders:
+            thread.start()
+        for _ in resolvers:
+            self._pending.put((_STOP, next(self._counter), None))
+
+        def wait(threads):
+            for thread in threads:
+                while thread.is_alive():
+                    thread.join(report_interval)
+                    if report and thread.is_alive():
+                        report(self.progress)
+
+        wait(resolvers)
+        for _ in downloaders:
+            self._resolved.put((_STOP, next(self._counter), None))
+        wait(downloaders)
+        return self.results
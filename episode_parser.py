@@ -0,0 +1,58 @@
+from collections import namedtuple
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+import metrics
+
+EPISODE_CLASS = 'bottone-ep'
+COVER_CLASSES = frozenset(('img-fluid', 'cover-anime', 'rounded'))
+
+# label: testo del bottone, title: attributo title (può essere vuoto)
+Episode = namedtuple('Episode', 'label title url thumbnail')
+
+
+class EpisodePageParser(HTMLParser):
+    """Legge la pagina di una serie in un solo passaggio, senza costruire l'albero.
+
+    Raccoglie la copertina (la prima <img> con le classi di COVER_CLASSES) e tutti
+    i link con classe bottone-ep, nell'ordine in cui compaiono.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.thumbnail = None
+        self.anchors = []  # [(href, title, testo)]
+        self._current = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            if self._current is not None:
+                # <a> non chiuso: lo chiude il link successivo
+                self.handle_endtag('a')
+            attrs = dict(attrs)
+            classes = (attrs.get('class') or '').split()
+            if EPISODE_CLASS in classes and attrs.get('href'):
+                self._current = (attrs['href'], attrs.get('title') or '', [])
+        elif tag == 'img' and self.thumbnail is None:
+            attrs = dict(attrs)
+            if COVER_CLASSES.issubset((attrs.get('class') or '').split()) and attrs.get('src'):
+                self.thumbnail = attrs['src']
+
+    def handle_data(self, data):
+        if self._current is not None:
+            self._current[2].append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._current is not None:
+            href, title, text = self._current
+            self.anchors.append((href, title, ''.join(text).strip()))
+            self._current = None
+
+
+@metrics.timed('html_parse')
+def parse_episode_page(html, base_url):
+    parser = EpisodePageParser()
+    parser.feed(html)
+    parser.close()
+    thumbnail = parser.thumbnail
+    return [Episode(label, title, urljoin(base_url, href), thumbnail) for href, title, label in parser.anchors]
@@ -0,0 +1,225 @@
+import os
+import re
+import shutil
+import subprocess
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+
+import metrics
+from range_downloader import session
+
+# Decifratura AES-128 opzionale: cryptography o pycryptodome, se installati
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+    def _aes_cbc_decrypt(key, iv, data):
+        decryptor = Cipher(algorithms.AES(key), modes.CBC(iv)).decryptor()
+        return decryptor.update(data) + decryptor.finalize()
+except ImportError:
+    try:
+        from Crypto.Cipher import AES
+
+        def _aes_cbc_decrypt(key, iv, data):
+            return AES.new(key, AES.MODE_CBC, iv).decrypt(data)
+    except ImportError:
+        _aes_cbc_decrypt = None
+
+WORKERS = int(os.getenv('HLS_DOWNLOAD_WORKERS', 8))
+SEGMENT_RETRIES = int(os.getenv('HLS_SEGMENT_RETRIES', 3))
+
+log = metrics.get_logger('hls_downloader')
+
+ATTRIBUTE_RE = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+Variant = namedtuple('Variant', 'url bandwidth resolution')
+Key = namedtuple('Key', 'method url iv')
+Segment = namedtuple('Segment', 'url sequence duration key byterange')
+MediaPlaylist = namedtuple('MediaPlaylist', 'segments init_segment')
+
+
+class UnsupportedPlaylist(Exception):
+    """Playlist che il downloader nativo non sa gestire (es. cifratura non AES-128)."""
+
+
+def parse_attributes(text):
+    return {name: value.strip('"') for name, value in ATTRIBUTE_RE.findall(text)}
+
+
+def _parse_byterange(value, previous_end):
+    length, _, offset = value.partition('@')
+    start = int(offset) if offset else previous_end
+    return start, start + int(length) - 1
+
+
+def parse_master_playlist(text, base_url):
+    variants = []
+    pending = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-STREAM-INF:'):
+            pending = parse_attributes(line.split(':', 1)[1])
+        elif line and not line.startswith('#') and pending is not None:
+            variants.append(Variant(urljoin(base_url, line), int(pending.get('BANDWIDTH', 0)), pending.get('RESOLUTION')))
+            pending = None
+    return variants
+
+
+def parse_media_playlist(text, base_url):
+    segments = []
+    init_segment = None
+    sequence = 0
+    key = None
+    duration = None
+    byterange = None
+    previous_end = 0
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith('#EXT-X-MEDIA-SEQUENCE:'):
+            sequence = int(line.split(':', 1)[1])
+        elif line.startswith('#EXT-X-KEY:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            method = attrs.get('METHOD', 'NONE')
+            if method == 'NONE':
+                key = None
+            elif method == 'AES-128':
+                iv = attrs.get('IV')
+                key = Key(method, urljoin(base_url, attrs['URI']), bytes.fromhex(iv[2:]) if iv else None)
+            else:
+                raise UnsupportedPlaylist(f"Cifratura {method} non supportata")
+        elif line.startswith('#EXT-X-MAP:'):
+            attrs = parse_attributes(line.split(':', 1)[1])
+            map_range = _parse_byterange(attrs['BYTERANGE'], 0) if 'BYTERANGE' in attrs else None
+            init_segment = Segment(urljoin(base_url, attrs['URI']), None, 0, None, map_range)
+        elif line.startswith('#EXTINF:'):
+            duration = float(line.split(':', 1)[1].split(',', 1)[0])
+        elif line.startswith('#EXT-X-BYTERANGE:'):
+            byterange = _parse_byterange(line.split(':', 1)[1], previous_end)
+            previous_end = byterange[1] + 1
+        elif line and not line.startswith('#'):
+            segments.append(Segment(urljoin(base_url, line), sequence, duration, key, byterange))
+            sequence += 1
+            duration = None
+            byterange = None
+    return MediaPlaylist(segments, init_segment)
+
+
+def choose_variant(variants, max_bandwidth=None):
+    """La variante con la banda più alta, entro max_bandwidth se indicato."""
+    allowed = [v for v in variants if not max_bandwidth or v.bandwidth <= max_bandwidth]
+    return max(allowed or variants, key=lambda v: v.bandwidth)
+
+
+class HLSDownloader:
+    def __init__(self, workers=WORKERS, retries=SEGMENT_RETRIES, max_bandwidth=None, progress=None, on_size=None):
+        self.workers = workers
+        self.retries = retries
+        self.max_bandwidth = max_bandwidth
+        self.progress = progress
+        self.on_size = on_size
+        self._keys = {}
+
+    def _get(self, url, byterange=None):
+        headers = {'Range': f'bytes={byterange[0]}-{byterange[1]}'} if byterange else None
+        for attempt in range(self.retries + 1):
+            try:
+                response = session.get(url, headers=headers)
+                response.raise_for_status()
+                return response
+            except requests.RequestException:
+                if attempt == self.retries:
+                    raise
+
+    def load_playlist(self, url):
+        """Scarica la playlist; se è una master sceglie la variante e scarica quella."""
+        response = self._get(url)
+        text, base_url = response.text, response.url or url
+        if '#EXT-X-STREAM-INF' in text:
+            variant = choose_variant(parse_master_playlist(text, base_url), self.max_bandwidth)
+            log.info("Variante HLS scelta: %s (%s bps)", variant.resolution or '?', variant.bandwidth)
+            response = self._get(variant.url)
+            text, base_url = response.text, response.url or variant.url
+        playlist = parse_media_playlist(text, base_url)
+        if any(segment.key for segment in playlist.segments) and _aes_cbc_decrypt is None:
+            raise UnsupportedPlaylist("Segmenti cifrati AES-128: installa cryptography o pycryptodome")
+        return playlist
+
+    def _key(self, key):
+        if key.url not in self._keys:
+            self._keys[key.url] = self._get(key.url).content
+        return self._keys[key.url]
+
+    def fetch_segment(self, segment):
+        data = self._get(segment.url, segment.byterange).content
+        if segment.key is not None:
+            iv = segment.key.iv or segment.sequence.to_bytes(16, 'big')
+            data = _aes_cbc_decrypt(self._key(segment.key), iv, data)
+            data = data[:-data[-1]] if data and 0 < data[-1] <= 16 else data  # padding PKCS7
+        if self.progress:
+            self.progress(len(data))
+        return data
+
+    def download(self, url, output_path):
+        """Scarica tutti i segmenti in parallelo e li concatena in ordine in output_path.
+
+        Restituisce il numero di segmenti scaricati.
+        """
+        playlist = self.load_playlist(url)
+        segments = playlist.segments
+        with open(output_path, 'wb') as output, ThreadPoolExecutor(max_workers=self.workers) as executor:
+            if playlist.init_segment:
+                output.write(self.fetch_segment(playlist.init_segment))
+            # Finestra scorrevole: al massimo 2 x workers segmenti in memoria, scritti nell'ordine della playlist
+            pending = deque()
+            queue = iter(segments)
+            for segment in queue:
+                pending.append(executor.submit(self.fetch_segment, segment))
+                if len(pending) >= self.workers * 2:
+                    break
+            try:
+                first = True
+                while pending:
+                    data = pending.popleft().result()
+                    if first and self.on_size:
+                        # Dimensione ignota in anticipo: stima dal primo segmento
+                        self.on_size(len(data) * len(segments))
+                    first = False
+                    output.write(data)
+                    segment = next(queue, None)
+                    if segment is not None:
+                        pending.append(executor.submit(self.fetch_segment, segment))
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+        return len(segments)
+
+
+def remux(input_path, output_path):
+    """Converte il flusso TS concatenato in MP4 con ffmpeg (senza ricodifica)."""
+    subprocess.run(['ffmpeg', '-y', '-loglevel', 'error', '-i', input_path, '-c', 'copy', '-f', 'mp4', output_path],
+                   check=True)
+
+
+def download(url, output_path, workers=WORKERS, max_bandwidth=None, progress=None, remux_to_mp4=True, on_size=None):
+    """Scarica lo stream HLS url in output_path.
+
+    I segmenti vengono concatenati in un file TS; se ffmpeg è disponibile (e
+    remux_to_mp4) il risultato viene poi convertito in MP4, altrimenti
+    output_path contiene direttamente il flusso TS.
+    """
+    downloader = HLSDownloader(workers=workers, max_bandwidth=max_bandwidth, progress=progress, on_size=on_size)
+    if not (remux_to_mp4 and shutil.which('ffmpeg')):
+        downloader.download(url, output_path)
+        return output_path
+
+    ts_path = output_path + '.ts'
+    try:
+        downloader.download(url, ts_path)
+        remux(ts_path, output_path)
+    finally:
+        if os.path.exists(ts_path):
+            os.remove(ts_path)
+    return output_path
@@ -0,0 +1,240 @@
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+
+from flask import Response
+
+import http_client
+import metrics
+from cache import Coalescer
+
+# Gli .mp4 interi non sono inclusi: i segmenti fMP4 vengono riconosciuti dalla playlist
+SEGMENT_EXTENSIONS = ('.ts', '.m4s', '.aac', '.m4a', '.vtt')
+PLAYLIST_MIMETYPE = 'application/vnd.apple.mpegurl'
+
+CACHE_BYTES = int(os.getenv('HLS_CACHE_BYTES', 128 * 1024 * 1024))
+CACHE_DIR = os.getenv('HLS_CACHE_DIR')  # se impostata, i segmenti espulsi dalla memoria restano su disco
+CACHE_DISK_BYTES = int(os.getenv('HLS_CACHE_DISK_BYTES', 1024 * 1024 * 1024))
+PREFETCH_SEGMENTS = int(os.getenv('HLS_PREFETCH_SEGMENTS', 3))
+PREFETCH_WORKERS = int(os.getenv('HLS_PREFETCH_WORKERS', 4))
+MAX_INDEXED_SEGMENTS = 100000
+
+URI_ATTRIBUTE_RE = re.compile(r'URI="([^"]*)"')
+
+log = metrics.get_logger('hls_proxy')
+
+
+def is_playlist_url(url):
+    return urlparse(url).path.lower().endswith('.m3u8')
+
+
+def is_segment_url(url):
+    return urlparse(url).path.lower().endswith(SEGMENT_EXTENSIONS)
+
+
+class SegmentCache:
+    """Cache LRU dei segmenti HLS, condivisa tra tutti gli spettatori del worker.
+
+    I segmenti stanno in memoria fino a max_bytes; con una directory, quelli
+    espulsi dalla memoria vengono conservati su disco fino a max_disk_bytes.
+    """
+
+    def __init__(self, max_bytes=CACHE_BYTES, directory=CACHE_DIR, max_disk_bytes=CACHE_DISK_BYTES):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()  # url -> (content_type, byte)
+        self._disk = OrderedDict()  # url -> (percorso, dimensione)
+        self._disk_size = 0
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __contains__(self, url):
+        return url in self._data or url in self._disk
+
+    def get(self, url):
+        with self._lock:
+            entry = self._data.get(url)
+            if entry is not None:
+                self._data.move_to_end(url)
+                self.hits += 1
+                return entry
+            disk_entry = self._disk.get(url)
+        if disk_entry is not None:
+            try:
+                with open(disk_entry[0], 'rb') as f:
+                    content_type, _, data = f.read().partition(b'\n')
+                entry = (content_type.decode('ascii'), data)
+                self.set(url, *entry)
+                with self._lock:
+                    self.hits += 1
+                return entry
+            except OSError:
+                with self._lock:
+                    self._forget_disk(url)
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, url, content_type, data):
+        evicted = []
+        with self._lock:
+            old = self._data.pop(url, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self._data[url] = (content_type, data)
+            self.size += len(data)
+            while self._data and self.size > self.max_bytes:
+                evicted_url, evicted_entry = self._data.popitem(last=False)
+                self.size -= len(evicted_entry[1])
+                evicted.append((evicted_url, evicted_entry))
+        if self.directory:
+            for evicted_url, (evicted_type, evicted_data) in evicted:
+                self._write_disk(evicted_url, evicted_type, evicted_data)
+
+    def _write_disk(self, url, content_type, data):
+        path = os.path.join(self.directory, hashlib.sha1(url.encode('utf-8')).hexdigest())
+        try:
+            with open(path, 'wb') as f:
+                f.write(content_type.encode('ascii') + b'\n' + data)
+        except OSError as e:
+            log.warning("Impossibile salvare il segmento su disco: %s", e)
+            return
+        with self._lock:
+            self._forget_disk(url)
+            self._disk[url] = (path, len(data))
+            self._disk_size += len(data)
+            while self._disk and self._disk_size > self.max_disk_bytes:
+                self._forget_disk(next(iter(self._disk)), remove=True)
+
+    def _forget_disk(self, url, remove=False):
+        entry = self._disk.pop(url, None)
+        if entry is None:
+            return
+        self._disk_size -= entry[1]
+        if remove:
+            try:
+                os.remove(entry[0])
+            except OSError:
+                pass
+
+    def info(self):
+        return {
+            'segments': len(self._data),
+            'bytes': self.size,
+            'disk_segments': len(self._disk),
+            'disk_bytes': self._disk_size,
+            'hits': self.hits,
+            'misses': self.misses,
+        }
+
+
+class HLSProxy:
+    """Riscrive le playlist m3u8 perché segmenti e varianti passino dal proxy,
+    e mette in cache/prefetch i segmenti successivi a quello richiesto."""
+
+    def __init__(self, segment_cache=None, prefetch_segments=PREFETCH_SEGMENTS, prefetch_workers=PREFETCH_WORKERS):
+        self.cache = segment_cache or SegmentCache()
+        self.prefetch_segments = prefetch_segments
+        self.prefetched = 0
+        self._positions = OrderedDict()  # url segmento -> (segmenti della playlist, indice)
+        self._lock = threading.Lock()
+        self._coalescer = Coalescer()
+        self._executor = ThreadPoolExecutor(max_workers=prefetch_workers, thread_name_prefix='hls-prefetch')
+        self._pending = set()
+
+    def rewrite_playlist(self, text, playlist_url, proxy_url):
+        """Restituisce la playlist con gli URI riscritti tramite proxy_url(url assoluto)."""
+        lines = []
+        segments = []
+        is_media_playlist = '#EXTINF' in text
+        for line in text.splitlines():
+            stripped = line.strip()
+            if not stripped:
+                lines.append(line)
+            elif stripped.startswith('#'):
+                lines.append(URI_ATTRIBUTE_RE.sub(
+                    lambda match: f'URI="{proxy_url(urljoin(playlist_url, match.group(1)))}"', line))
+            else:
+                absolute = urljoin(playlist_url, stripped)
+                if is_media_playlist:
+                    segments.append(absolute)
+                lines.append(proxy_url(absolute))
+        if segments:
+            self._register_segments(segments)
+        return '\n'.join(lines) + '\n'
+
+    def _register_segments(self, segments):
+        segments = tuple(segments)
+        with self._lock:
+            for index, url in enumerate(segments):
+                self._positions[url] = (segments, index)
+                self._positions.move_to_end(url)
+            while len(self._positions) > MAX_INDEXED_SEGMENTS:
+                self._positions.popitem(last=False)
+
+    def is_known_segment(self, url):
+        return url in self._positions or is_segment_url(url)
+
+    def proxy_playlist(self, url, proxy_url):
+        response = http_client.get(url)
+        response.raise_for_status()
+        body = self.rewrite_playlist(response.text, response.url or url, proxy_url)
+        return Response(body, mimetype=PLAYLIST_MIMETYPE, headers={'Cache-Control': 'no-cache'})
+
+    def fetch_segment(self, url):
+        entry = self.cache.get(url)
+        if entry is not None:
+            return entry
+
+        def download():
+            response = http_client.get(url)
+            response.raise_for_status()
+            entry = (response.headers.get('Content-Type', 'video/mp2t'), response.content)
+            self.cache.set(url, *entry)
+            return entry
+
+        # Più spettatori (o un prefetch) sullo stesso segmento: un solo download dall'origine
+        return self._coalescer.do(url, download)
+
+    def proxy_segment(self, url):
+        content_type, data = self.fetch_segment(url)
+        self.prefetch_after(url)
+        return Response(data, mimetype=content_type, headers={'Cache-Control': 'public, max-age=3600'})
+
+    def prefetch_after(self, url):
+        with self._lock:
+            position = self._positions.get(url)
+        if position is None:
+            return
+        segments, index = position
+        for next_url in segments[index + 1:index + 1 + self.prefetch_segments]:
+            with self._lock:
+                if next_url in self._pending or next_url in self.cache:
+                    continue
+                self._pending.add(next_url)
+            self._executor.submit(self._prefetch, next_url)
+
+    def _prefetch(self, url):
+        fetched = False
+        try:
+            self.fetch_segment(url)
+            fetched = True
+        except Exception as e:
+            log.debug("Prefetch del segmento fallito (%s): %s", url, e)
+        finally:
+            # Contatore aggiornato sotto lock: += non è atomico tra i thread del prefetch
+            with self._lock:
+                self._pending.discard(url)
+                self.prefetched += fetched
+
+    def info(self):
+        return dict(self.cache.info(), prefetched=self.prefetched, indexed_segments=len(self._positions))
@@ -0,0 +1,139 @@
+import os
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.exceptions import EmptyPoolError, InvalidHeader
+from urllib3.util import make_headers
+from urllib3.util.retry import Retry
+
+import metrics
+import rate_limiter
+
+# Dimensione del pool per host: di default pari ai thread di gunicorn x worker (Procfile)
+POOL_SIZE = int(os.getenv('HTTP_POOL_SIZE', 16))
+# Numero di host diversi per cui mantenere un pool di connessioni (animesaturn, iframe, CDN, TMDb...)
+POOL_HOSTS = int(os.getenv('HTTP_POOL_HOSTS', 10))
+CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 5))
+READ_TIMEOUT = float(os.getenv('HTTP_READ_TIMEOUT', 30))
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, READ_TIMEOUT)
+# Attesa massima per una connessione libera quando il pool di un host è pieno
+POOL_TIMEOUT = float(os.getenv('HTTP_POOL_TIMEOUT', 10))
+
+MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', 3))
+RETRY_BACKOFF = float(os.getenv('HTTP_RETRY_BACKOFF', 0.5))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Attesa massima di un retry di urllib3 per un Retry-After: le pause più lunghe le gestisce il rate limiter
+RETRY_AFTER_MAX = float(os.getenv('HTTP_RETRY_AFTER_MAX', 5))
+
+
+# Limiti per host (sito e TMDb, configurati da app.py e animedownloader.py) condivisi tra i worker
+limiter = rate_limiter.RateLimiter(rate_limiter.default_backend())
+
+
+class TimeoutSession(requests.Session):
+    """Session che applica un timeout di default e i limiti per host a ogni richiesta e ne misura la durata."""
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+        parsed = urlparse(url)
+        host = parsed.hostname or ''
+        lease = limiter.acquire(parsed.netloc)
+        try:
+            with metrics.span('upstream_fetch'):
+                try:
+                    response = super().request(method, url, **kwargs)
+                except requests.RequestException:
+                    metrics.UPSTREAM_RESPONSES.inc(host=host, status='error')
+                    raise
+        finally:
+            limiter.release(parsed.netloc, lease)
+        metrics.UPSTREAM_RESPONSES.inc(host=host, status=response.status_code)
+        if limiter.is_limited(parsed.netloc):
+            # Anche i 429/503 già ritentati da urllib3 contano per il backoff
+            retries = getattr(response.raw, 'retries', None)
+            for attempt in (retries.history if retries else ()):
+                if attempt.status in rate_limiter.THROTTLE_STATUSES:
+                    limiter.record(parsed.netloc, attempt.status)
+            limiter.record(parsed.netloc, response.status_code,
+                           rate_limiter.parse_retry_after(response.headers.get('Retry-After')))
+        return response
+
+
+class _BoundedHTTPConnectionPool(HTTPConnectionPool):
+    def urlopen(self, *args, pool_timeout=None, **kwargs):
+        if pool_timeout is None:
+            pool_timeout = POOL_TIMEOUT
+        return super().urlopen(*args, pool_timeout=pool_timeout, **kwargs)
+
+
+class _BoundedHTTPSConnectionPool(HTTPSConnectionPool):
+    def urlopen(self, *args, pool_timeout=None, **kwargs):
+        if pool_timeout is None:
+            pool_timeout = POOL_TIMEOUT
+        return super().urlopen(*args, pool_timeout=pool_timeout, **kwargs)
+
+
+class BoundedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter con un limite di connessioni per host che non blocca all'infinito."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _BoundedHTTPConnectionPool,
+            'https': _BoundedHTTPSConnectionPool,
+        }
+
+    def send(self, request, **kwargs):
+        try:
+            return super().send(request, **kwargs)
+        except EmptyPoolError as e:
+            raise requests.ConnectionError(e, request=request)
+
+
+class CappedRetry(Retry):
+    """Retry che rispetta Retry-After fino a RETRY_AFTER_MAX secondi (un thread non resta fermo per minuti)."""
+
+    def get_retry_after(self, response):
+        try:
+            retry_after = super().get_retry_after(response)
+        except InvalidHeader:
+            return None
+        if retry_after is None:
+            return None
+        return min(retry_after, RETRY_AFTER_MAX)
+
+
+def create_session(pool_size=POOL_SIZE):
+    retry = CappedRetry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES,
+        status=MAX_RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(['GET', 'HEAD']),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    # pool_block=True limita le connessioni aperte verso ogni host a pool_size
+    adapter = BoundedHTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=pool_size, max_retries=retry, pool_block=True)
+
+    session = TimeoutSession()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    session.headers.update(make_headers(keep_alive=True, accept_encoding=True))
+    return session
+
+
+# Session condivisa da app.py, Scraper.py e animedownloader.py
+session = create_session()
+
+
+def get(url, **kwargs):
+    return session.get(url, **kwargs)
+
+
+def head(url, **kwargs):
+    return session.head(url, **kwargs)
@@ -0,0 +1,247 @@
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode, urljoin, urlparse
+
+from flask import Response
+
+import http_client
+import metrics
+from cache import Coalescer
+
+try:
+    from PIL import Image
+except ImportError:  # senza Pillow le immagini vengono servite (e messe in cache) così come sono
+    Image = None
+
+# Larghezze delle varianti: miniature degli episodi, schede dei risultati, poster nel dettaglio della serie
+SIZES = {'thumb': 160, 'card': 320, 'poster': 500}
+CACHE_DIR = os.getenv('IMG_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'animescraper-img'))
+CACHE_BYTES = int(os.getenv('IMG_CACHE_BYTES', 256 * 1024 * 1024))
+MAX_AGE = int(os.getenv('IMG_MAX_AGE', 30 * 24 * 3600))  # gli URL delle immagini di origine non cambiano contenuto
+MAX_SOURCE_BYTES = 10 * 1024 * 1024
+# Oltre questi pixel Pillow rifiuta l'immagine (DecompressionBombError) invece di decomprimerla in memoria
+MAX_PIXELS = int(os.getenv('IMG_MAX_PIXELS', 25_000_000))
+MAX_REDIRECTS = 3
+QUALITY = 80
+
+log = metrics.get_logger('image_proxy')
+
+if Image is not None:
+    Image.MAX_IMAGE_PIXELS = MAX_PIXELS
+
+
+class ImageNotAllowed(Exception):
+    pass
+
+
+class ImageCache:
+    """Cache LRU su disco limitata a max_bytes, condivisa tra i worker della stessa macchina.
+
+    Ogni voce è un file (tipo, ETag e dati); l'ordine LRU di un worker parte da
+    quello delle date di modifica dei file, aggiornate a ogni lettura.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._files = OrderedDict()  # nome del file -> dimensione
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        entries = []
+        for name in os.listdir(directory):
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            if not name.endswith('.tmp'):
+                entries.append((stat.st_mtime, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._files[name] = size
+            self.size += size
+
+    @staticmethod
+    def _name(key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """(content_type, etag, dati) o None."""
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        try:
+            with open(path, 'rb') as f:
+                content_type, etag, data = f.read().split(b'\n', 2)
+            os.utime(path)
+        except (OSError, ValueError):
+            with self._lock:
+                # Espulsa da un altro worker
+                self.size -= self._files.pop(name, 0)
+                self.misses += 1
+            return None
+        with self._lock:
+            if name in self._files:
+                self._files.move_to_end(name)
+            self.hits += 1
+        return content_type.decode('ascii'), etag.decode('ascii'), data
+
+    def set(self, key, content_type, etag, data):
+        name = self._name(key)
+        path = os.path.join(self.directory, name)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(content_type.encode('ascii') + b'\n' + etag.encode('ascii') + b'\n' + data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning("Impossibile salvare l'immagine su disco: %s", e)
+            return
+        evicted = []
+        with self._lock:
+            self.size -= self._files.pop(name, 0)
+            self._files[name] = len(data)
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self._files) > 1:
+                evicted_name, evicted_size = self._files.popitem(last=False)
+                self.size -= evicted_size
+                evicted.append(evicted_name)
+        for evicted_name in evicted:
+            try:
+                os.remove(os.path.join(self.directory, evicted_name))
+            except OSError:
+                pass
+
+    def info(self):
+        return {'files': len(self._files), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+
+
+def _etag(data):
+    return '"%s"' % hashlib.sha1(data).hexdigest()[:20]
+
+
+def _read_limited(response, url):
+    """Corpo di una risposta in streaming, interrotto appena supera MAX_SOURCE_BYTES."""
+    length = response.headers.get('Content-Length', '')
+    if length.isdigit() and int(length) > MAX_SOURCE_BYTES:
+        raise ImageNotAllowed(f"{url} supera {MAX_SOURCE_BYTES} byte")
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(64 * 1024):
+        size += len(chunk)
+        if size > MAX_SOURCE_BYTES:
+            raise ImageNotAllowed(f"{url} supera {MAX_SOURCE_BYTES} byte")
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+
+class ImageProxy:
+    """Immagini di origine scaricate una volta sola e servite ridimensionate (WebP se il browser lo accetta).
+
+    is_allowed(url) limita gli host: il proxy non deve scaricare (e salvare) URL qualsiasi.
+    """
+
+    def __init__(self, is_allowed, cache=None):
+        self.is_allowed = is_allowed
+        self.cache = cache or ImageCache()
+        self._coalescer = Coalescer()
+
+    def _follow(self, url):
+        """Risposta in streaming per url, con i redirect seguiti a mano: anche la destinazione passa is_allowed."""
+        target = url
+        for _ in range(MAX_REDIRECTS + 1):
+            response = http_client.get(target, allow_redirects=False, stream=True)
+            if not response.is_redirect:
+                return response
+            response.close()
+            target = urljoin(target, response.headers['Location'])
+            if not self.is_allowed(target):
+                raise ImageNotAllowed(f"Redirect verso un host non consentito: {urlparse(target).netloc}")
+        raise ImageNotAllowed(f"Troppi redirect per {url}")
+
+    def _original(self, url):
+        entry = self.cache.get(url)
+        if entry is not None:
+            return entry
+
+        def download():
+            response = self._follow(url)
+            try:
+                response.raise_for_status()
+                content_type = response.headers.get('Content-Type', '').split(';')[0].strip()
+                if not content_type.startswith('image/'):
+                    raise ImageNotAllowed(f"{url} non è un'immagine")
+                data = _read_limited(response, url)
+            finally:
+                response.close()
+            entry = (content_type, _etag(data), data)
+            self.cache.set(url, *entry)
+            return entry
+
+        # Più schede con la stessa copertina caricate insieme: un solo download dall'origine
+        return self._coalescer.do(url, download)
+
+    def _variant(self, url, width, webp):
+        key = f"{url}|{width}|{'webp' if webp else 'orig'}"
+        entry = self.cache.get(key)
+        if entry is not None:
+            return entry
+
+        def render():
+            source_type, _, data = self._original(url)
+            content_type = source_type
+            if Image is None:
+                return content_type, _etag(data), data
+            with metrics.span('image_resize'):
+                try:
+                    image = Image.open(io.BytesIO(data))
+                    if getattr(image, 'is_animated', False):
+                        return content_type, _etag(data), data
+                    image.thumbnail((width, width * 4))
+                    output = io.BytesIO()
+                    if webp:
+                        image.save(output, 'WEBP', quality=QUALITY, method=2)
+                        content_type = 'image/webp'
+                    elif image.mode in ('RGBA', 'LA', 'P'):
+                        image.save(output, 'PNG', optimize=True)
+                        content_type = 'image/png'
+                    else:
+                        image.convert('RGB').save(output, 'JPEG', quality=QUALITY, optimize=True, progressive=True)
+                        content_type = 'image/jpeg'
+                except (Image.DecompressionBombError, Image.UnidentifiedImageError, OSError, ValueError) as e:
+                    # Immagine troppo grande o non decodificabile: servita così com'è
+                    log.warning("Impossibile ridimensionare %s: %s", url, e)
+                    return content_type, _etag(data), data
+            variant = output.getvalue()
+            if len(variant) >= len(data) and not webp:
+                variant, content_type = data, source_type  # l'originale è già piccolo
+            entry = (content_type, _etag(variant), variant)
+            self.cache.set(key, *entry)
+            return entry
+
+        return self._coalescer.do(key, render)
+
+    def serve(self, request, url, size):
+        if not self.is_allowed(url):
+            raise ImageNotAllowed(f"Host non consentito: {urlparse(url).netloc}")
+        webp = Image is not None and 'image/webp' in request.headers.get('Accept', '')
+        content_type, etag, data = self._variant(url, SIZES[size], webp)
+        response = Response(data, mimetype=content_type)
+        response.set_etag(etag.strip('"'))
+        response.headers['Cache-Control'] = f'public, max-age={MAX_AGE}, immutable'
+        response.headers['Vary'] = 'Accept'
+        return response.make_conditional(request)
+
+    def info(self):
+        return dict(self.cache.info(), resize=Image is not None)
+
+
+def image_path(url, size):
+    """Percorso /img da restituire ai client al posto dell'URL dell'immagine di origine."""
+    if not url:
+        return url
+    return '/img?' + urlencode({'url': url, 'size': size})
@@ -0,0 +1,72 @@
+import json
+import time
+
+from sqlalchemy import select
+
+import metrics
+from cache import MISSING, Coalescer, MemoryBackend, upsert
+
+log = metrics.get_logger('metadata_store')
+
+
+class MetadataStore:
+    """Metadata TMDb salvati nel database, con una copia in memoria davanti.
+
+    Le voci più vecchie di ttl vengono riscaricate; se TMDb non risponde si
+    continua a usare la copia scaduta. Le richieste concorrenti per la stessa
+    chiave producono un solo giro di chiamate a TMDb.
+    """
+
+    def __init__(self, app, db, model, ttl, negative_ttl, max_memory_entries=2000):
+        self.app = app
+        self.db = db
+        self.table = model.__table__
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.memory = MemoryBackend(max_entries=max_memory_entries)
+        self._coalescer = Coalescer()
+        self._engine = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = self.db.engine
+        return self._engine
+
+    def _expires_at(self, value, fetched_at):
+        return fetched_at + (self.ttl if value is not None else self.negative_ttl)
+
+    def get(self, key, fetch):
+        entry = self.memory.get(key)
+        if entry is not MISSING:
+            return entry[1]
+        return self._coalescer.do(key, lambda: self._load(key, fetch))
+
+    def _load(self, key, fetch):
+        t = self.table
+        with self.engine.connect() as conn:
+            row = conn.execute(select(t.c.data, t.c.fetched_at).where(t.c.key == key)).first()
+
+        stale = None
+        if row is not None:
+            stale = json.loads(row.data)
+            expires_at = self._expires_at(stale, row.fetched_at)
+            if expires_at > time.time():
+                self.memory.set(key, stale, expires_at)
+                return stale
+
+        try:
+            value = fetch()
+        except Exception as e:
+            log.warning("Errore nel recupero dei metadata da TMDb per '%s': %s", key, e)
+            return stale
+
+        fetched_at = time.time()
+        with self.engine.begin() as conn:
+            upsert(conn, t, 'key', key, {'data': json.dumps(value), 'fetched_at': fetched_at})
+        self.memory.set(key, value, self._expires_at(value, fetched_at))
+        return value
+
+    def invalidate(self, key):
+        self.memory.delete(key)
@@ -0,0 +1,272 @@
+"""Log a livelli, tempi per fase e metriche in formato Prometheus (senza dipendenze esterne).
+
+I log sono spenti sotto WARNING a meno di LOG_LEVEL=DEBUG/INFO; LOG_FORMAT=json
+produce una riga JSON per messaggio. span('fase') misura una fase (fetch,
+parsing, estrazione, TMDb, database) nell'istogramma animescraper_stage_duration_seconds
+e, se la richiesta ha una traccia attiva, la aggiunge alla traccia.
+"""
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'WARNING').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')  # 'text' o 'json'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_logging_configured = False
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        trace = _trace.get()
+        if trace is not None:
+            entry['trace_id'] = trace.id
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def configure_logging(level=LOG_LEVEL, fmt=LOG_FORMAT):
+    global _logging_configured
+    if _logging_configured:
+        return
+    _logging_configured = True
+    handler = logging.StreamHandler(sys.stderr)
+    if fmt == 'json':
+        handler.setFormatter(JSONFormatter())
+    else:
+        handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    logger = logging.getLogger('animescraper')
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = False
+
+
+def get_logger(name):
+    configure_logging()
+    return logging.getLogger(f'animescraper.{name}')
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple((name, str(labels.get(name, ''))) for name in self.labelnames)
+
+    def samples(self):
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            for key, (counts, total, count) in self._values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    samples.append((f'{self.name}_bucket', key + (('le', _format_value(bound)),), cumulative))
+                samples.append((f'{self.name}_sum', key, total))
+                samples.append((f'{self.name}_count', key, count))
+        return samples
+
+
+class Registry:
+    """Metriche registrate più collector, funzioni che leggono contatori già esistenti
+    (cache, proxy) e restituiscono [(nome, tipo, help, [(etichette, valore)])]."""
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        with self._lock:
+            self._collectors.append(fn)
+        return fn
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics, collectors = list(self._metrics), list(self._collectors)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for fn in collectors:
+            try:
+                families = fn()
+            except Exception as e:
+                get_logger('metrics').warning("Collector di metriche fallito: %s", e)
+                continue
+            for name, metric_type, help, samples in families:
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(sorted(labels.items()))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def counter(name, help, labelnames=()):
+    return REGISTRY.register(Counter(name, help, labelnames))
+
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help, labelnames, buckets))
+
+
+STAGE_SECONDS = histogram('animescraper_stage_duration_seconds', "Durata delle fasi interne", ('stage',))
+UPSTREAM_RESPONSES = counter('animescraper_upstream_responses_total', "Risposte HTTP dai siti esterni", ('host', 'status'))
+
+
+class Trace:
+    def __init__(self, trace_id=None):
+        self.id = trace_id or uuid.uuid4().hex[:16]
+        self.spans = []
+
+    def add(self, stage, seconds):
+        self.spans.append((stage, seconds))
+
+    def server_timing(self):
+        """Le fasi nel formato dell'header Server-Timing (somma e conteggio per fase)."""
+        totals = {}
+        for stage, seconds in self.spans:
+            total, count = totals.get(stage, (0.0, 0))
+            totals[stage] = (total + seconds, count + 1)
+        return ', '.join(f'{stage};desc="{count}x";dur={total * 1000:.1f}' for stage, (total, count) in totals.items())
+
+
+_trace = contextvars.ContextVar('animescraper_trace', default=None)
+
+
+def start_trace(trace_id=None):
+    trace = Trace(trace_id)
+    _trace.set(trace)
+    return trace
+
+
+def current_trace():
+    return _trace.get()
+
+
+def end_trace():
+    _trace.set(None)
+
+
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(stage, elapsed)
+
+
+def timed(stage):
+    """Decoratore: ogni chiamata della funzione è una span di questa fase."""
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def instrument_engine(engine, stage='db_query'):
+    """Misura ogni query SQL eseguita dall'engine SQLAlchemy."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('animescraper_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['animescraper_query_start'].pop()
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.add(stage, elapsed)
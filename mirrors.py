@@ -0,0 +1,226 @@
+"""Domini alternativi (mirror) del sito con scelta del più veloce e failover automatico.
+
+Ogni mirror ha una latenza media mobile esponenziale (EWMA) aggiornata dalle
+richieste vere e da probe periodiche, e un circuit breaker: dopo
+FAILURE_THRESHOLD errori consecutivi il mirror viene escluso per COOLDOWN
+secondi, poi riceve una sola richiesta di prova. Le richieste vanno al mirror
+sano più veloce e, se falliscono, agli altri.
+
+Gli URL restituiti ai client usano sempre il dominio canonico (il primo della
+lista): cache, playlist condivise e link restano validi quando il mirror attivo
+cambia, e vengono riscritti verso il mirror scelto solo al momento della richiesta.
+"""
+import os
+import threading
+import time
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+import requests
+
+import http_client
+import metrics
+import rate_limiter
+
+DEFAULT_MIRRORS = "https://www.animesaturn.cx,https://www.animesaturn.mx"
+# ANIMESATURN_URL (un solo dominio) resta valido se la lista non è configurata
+MIRRORS = [url.strip().rstrip('/') for url in
+           os.getenv('ANIMESATURN_MIRRORS', os.getenv('ANIMESATURN_URL', DEFAULT_MIRRORS)).split(',') if url.strip()]
+EWMA_ALPHA = 0.3
+FAILURE_THRESHOLD = int(os.getenv('MIRROR_FAILURE_THRESHOLD', 3))
+COOLDOWN = float(os.getenv('MIRROR_COOLDOWN', 60))
+PROBE_INTERVAL = float(os.getenv('MIRROR_PROBE_INTERVAL', 60))  # 0 disabilita le probe
+PROBE_PATH = os.getenv('MIRROR_PROBE_PATH', '/animelist?search=a')
+PROBE_MARKER = os.getenv('MIRROR_PROBE_MARKER', 'badge-archivio')  # una pagina senza risultati è un dominio parcheggiato
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+log = metrics.get_logger('mirrors')
+failovers = metrics.counter('animescraper_mirror_failovers_total', "Richieste ripetute su un altro mirror", ('mirror',))
+
+
+class MirrorUnavailable(requests.ConnectionError):
+    pass
+
+
+class Mirror:
+    def __init__(self, url, index):
+        parts = urlsplit(url)
+        self.url = url
+        self.scheme = parts.scheme
+        self.netloc = parts.netloc
+        self.index = index
+        self.ewma = None  # secondi
+        self.failures = 0
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.trial = False  # richiesta di prova in corso (half-open)
+
+    def score(self):
+        # Mirror mai misurati dopo quelli misurati, nell'ordine della lista
+        return (self.ewma if self.ewma is not None else float('inf'), self.index)
+
+
+class MirrorPool:
+    def __init__(self, urls=None, fetch=None, alpha=EWMA_ALPHA, failure_threshold=FAILURE_THRESHOLD, cooldown=COOLDOWN):
+        urls = urls or MIRRORS
+        self.mirrors = [Mirror(url, index) for index, url in enumerate(urls)]
+        self.canonical_url = self.mirrors[0].url
+        self.fetch = fetch or http_client.get
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._by_netloc = {mirror.netloc: mirror for mirror in self.mirrors}
+        self._lock = threading.Lock()
+        self._probe_thread = None
+
+    # Riscrittura degli URL
+
+    def mirror_for(self, url):
+        return self._by_netloc.get(urlsplit(url).netloc)
+
+    def canonical(self, url):
+        """URL stabile da restituire ai client: il dominio di un mirror diventa quello canonico."""
+        parts = urlsplit(url)
+        if parts.netloc not in self._by_netloc:
+            return url
+        canonical = self.mirrors[0]
+        return urlunsplit((canonical.scheme, canonical.netloc, parts.path, parts.query, parts.fragment))
+
+    def on(self, mirror, url):
+        """Lo stesso URL (assoluto su un mirror o solo percorso) sul mirror indicato."""
+        parts = urlsplit(urljoin(self.canonical_url + '/', url))
+        return urlunsplit((mirror.scheme, mirror.netloc, parts.path, parts.query, parts.fragment))
+
+    def is_site_url(self, url):
+        return not urlsplit(url).netloc or urlsplit(url).netloc in self._by_netloc
+
+    # Scelta del mirror
+
+    def _available(self, mirror, now):
+        if mirror.state == OPEN and now - mirror.opened_at >= self.cooldown:
+            mirror.state = HALF_OPEN
+            mirror.trial = False
+        if mirror.state == HALF_OPEN:
+            return not mirror.trial
+        return mirror.state == CLOSED
+
+    def claim(self, mirror):
+        """Un mirror half-open riceve una sola richiesta di prova alla volta."""
+        with self._lock:
+            if mirror.state != HALF_OPEN:
+                return True
+            if mirror.trial:
+                return False
+            mirror.trial = True
+            return True
+
+    def release(self, mirror):
+        with self._lock:
+            mirror.trial = False
+
+    def candidates(self):
+        """Mirror in ordine di preferenza: i sani dal più veloce, poi quelli esclusi (ultima spiaggia)."""
+        now = time.monotonic()
+        with self._lock:
+            available = sorted((m for m in self.mirrors if self._available(m, now)), key=Mirror.score)
+            excluded = sorted((m for m in self.mirrors if m not in available), key=lambda m: m.opened_at)
+        return available + excluded
+
+    def active(self):
+        return self.candidates()[0]
+
+    def record(self, mirror, elapsed, ok):
+        with self._lock:
+            if ok:
+                mirror.ewma = elapsed if mirror.ewma is None else self.alpha * elapsed + (1 - self.alpha) * mirror.ewma
+                if mirror.state != CLOSED:
+                    log.warning("Mirror %s di nuovo disponibile", mirror.url)
+                mirror.failures = 0
+                mirror.state = CLOSED
+            else:
+                mirror.failures += 1
+                if mirror.state == HALF_OPEN or mirror.failures >= self.failure_threshold:
+                    if mirror.state != OPEN:
+                        log.warning("Mirror %s escluso per %ss dopo %d errori", mirror.url, self.cooldown, mirror.failures)
+                    mirror.state = OPEN
+                    mirror.opened_at = time.monotonic()
+            mirror.trial = False
+
+    # Richieste
+
+    def get(self, url, **kwargs):
+        """GET di un URL del sito (percorso o URL di qualunque mirror) sul mirror migliore, con failover.
+
+        Gli URL di altri host (iframe, CDN) passano direttamente da fetch. Errori di rete e
+        risposte 5xx fanno provare il mirror successivo; le altre risposte vengono restituite.
+        """
+        if not self.is_site_url(url):
+            return self.fetch(url, **kwargs)
+        error = None
+        attempt = 0
+        for mirror in self.candidates():
+            if not self.claim(mirror):
+                continue
+            if attempt:
+                failovers.inc(mirror=mirror.netloc)
+            attempt += 1
+            started = time.perf_counter()
+            try:
+                response = self.fetch(self.on(mirror, url), **kwargs)
+            except rate_limiter.RateLimitTimeout:
+                self.release(mirror)
+                raise  # limite nostro, non un problema del mirror
+            except requests.RequestException as e:
+                self.record(mirror, time.perf_counter() - started, ok=False)
+                error = e
+                continue
+            if response.status_code >= 500:
+                self.record(mirror, time.perf_counter() - started, ok=False)
+                error = requests.HTTPError(f"{response.status_code} da {mirror.netloc}", response=response)
+                response.close()  # con stream=True la connessione tornerebbe al pool solo a risposta letta
+                continue
+            self.record(mirror, time.perf_counter() - started, ok=True)
+            return response
+        raise error or MirrorUnavailable("Nessun mirror configurato")
+
+    def probe(self, mirror):
+        if not self.claim(mirror):
+            return
+        started = time.perf_counter()
+        try:
+            response = self.fetch(self.on(mirror, PROBE_PATH))
+            ok = response.status_code == 200 and PROBE_MARKER in response.text
+        except rate_limiter.RateLimitTimeout:
+            self.release(mirror)
+            return
+        except requests.RequestException:
+            ok = False
+        self.record(mirror, time.perf_counter() - started, ok)
+
+    def probe_all(self):
+        for mirror in self.mirrors:
+            with self._lock:
+                # Un mirror escluso viene riprovato solo a fine cooldown, come per le richieste
+                skip = mirror.state == OPEN and time.monotonic() - mirror.opened_at < self.cooldown
+            if not skip:
+                self.probe(mirror)
+
+    def start_probes(self, interval=PROBE_INTERVAL):
+        if interval <= 0 or len(self.mirrors) < 2 or self._probe_thread is not None:
+            return
+
+        def run():
+            while True:
+                try:
+                    self.probe_all()
+                except Exception as e:
+                    log.warning("Errore durante le probe dei mirror: %s", e)
+                time.sleep(interval)
+
+        self._probe_thread = threading.Thread(target=run, name='mirror-probes', daemon=True)
+        self._probe_thread.start()
+
+    def snapshot(self):
+        with self._lock:
+            return [{'url': m.url, 'state': m.state, 'ewma_ms': round(m.ewma * 1000, 1) if m.ewma is not None else None,
+                     'failures': m.failures} for m in self.mirrors]
@@ -0,0 +1,229 @@
+import json
+import time
+import uuid
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+
+log = metrics.get_logger('playlist_store')
+
+
+class PlaylistNotFound(Exception):
+    pass
+
+
+class PlaylistStore:
+    """Playlist condivise salvate in tabelle normalizzate (playlist, serie, episodi).
+
+    Ogni modifica tocca solo le serie interessate e aggiorna i contatori
+    precalcolati e la versione della playlist, così il riepilogo e l'ETag
+    dell'M3U non richiedono di leggere gli episodi. Le playlist salvate nel
+    vecchio formato (un unico JSON in legacy_model) vengono convertite al
+    primo accesso.
+    """
+
+    def __init__(self, app, db, playlist_model, series_model, episode_model, legacy_model=None):
+        self.app = app
+        self.db = db
+        self.playlists = playlist_model.__table__
+        self.series = series_model.__table__
+        self.episodes = episode_model.__table__
+        self.legacy = legacy_model.__table__ if legacy_model is not None else None
+        self._engine = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = self.db.engine
+        return self._engine
+
+    # Scrittura
+
+    def create(self, name, playlist, share_id=None):
+        share_id = share_id or str(uuid.uuid4())
+        with self.engine.begin() as conn:
+            conn.execute(insert(self.playlists).values(id=share_id, name=name, series_count=0, episode_count=0,
+                                                       version=1, updated_at=time.time()))
+            for position, series in enumerate(playlist):
+                self._insert_series(conn, share_id, position, series)
+            self._refresh_counts(conn, share_id)
+        return share_id
+
+    def replace(self, share_id, name, playlist):
+        """Sostituisce tutto il contenuto (compatibilità con /update_shared_playlist)."""
+        with self.engine.begin() as conn:
+            self._lock(conn, share_id)
+            self._delete_series(conn, share_id)
+            for position, series in enumerate(playlist):
+                self._insert_series(conn, share_id, position, series)
+            self._refresh_counts(conn, share_id, name=name)
+        return self.version(share_id)
+
+    def patch(self, share_id, operations):
+        """Applica una lista di modifiche e restituisce la nuova versione.
+
+        Operazioni: {"op": "append", "series": {...}}, {"op": "remove", "index": i},
+        {"op": "replace", "index": i, "series": {...}}, {"op": "rename", "index": i, "title": ...},
+        {"op": "set_name", "name": ...}.
+        """
+        s = self.series
+        with self.engine.begin() as conn:
+            self._lock(conn, share_id)
+            name = None
+            for operation in operations:
+                op = operation.get('op')
+                if op == 'append':
+                    position = conn.execute(select(func.count()).select_from(s).where(s.c.playlist_id == share_id)).scalar()
+                    self._insert_series(conn, share_id, position, operation['series'])
+                elif op == 'remove':
+                    series_id = self._series_id(conn, share_id, operation['index'])
+                    conn.execute(delete(self.episodes).where(self.episodes.c.series_id == series_id))
+                    conn.execute(delete(s).where(s.c.id == series_id))
+                    conn.execute(update(s).where(s.c.playlist_id == share_id, s.c.position > operation['index'])
+                                 .values(position=s.c.position - 1))
+                elif op == 'replace':
+                    series_id = self._series_id(conn, share_id, operation['index'])
+                    conn.execute(delete(self.episodes).where(self.episodes.c.series_id == series_id))
+                    conn.execute(delete(s).where(s.c.id == series_id))
+                    self._insert_series(conn, share_id, operation['index'], operation['series'])
+                elif op == 'rename':
+                    series_id = self._series_id(conn, share_id, operation['index'])
+                    conn.execute(update(s).where(s.c.id == series_id).values(title=operation['title']))
+                elif op == 'set_name':
+                    name = operation['name']
+                else:
+                    raise ValueError(f"Operazione non valida: {op!r}")
+            self._refresh_counts(conn, share_id, name=name)
+        return self.version(share_id)
+
+    def _lock(self, conn, share_id):
+        """Blocca la riga della playlist fino alla fine della transazione (modifiche concorrenti in ordine)."""
+        if not self._ensure(conn, share_id):
+            raise PlaylistNotFound(share_id)
+        conn.execute(select(self.playlists.c.id).where(self.playlists.c.id == share_id).with_for_update())
+
+    def _series_id(self, conn, share_id, index):
+        s = self.series
+        series_id = conn.execute(select(s.c.id).where(s.c.playlist_id == share_id, s.c.position == index)).scalar()
+        if series_id is None:
+            raise ValueError(f"Serie {index} non presente nella playlist")
+        return series_id
+
+    def _insert_series(self, conn, share_id, position, series):
+        episodes = series.get('episodes') or []
+        series_id = conn.execute(insert(self.series).values(
+            playlist_id=share_id, position=position, title=series['title'], episode_count=len(episodes)
+        )).inserted_primary_key[0]
+        if episodes:
+            conn.execute(insert(self.episodes), [
+                {'series_id': series_id, 'position': i, 'title': episode.get('title') or '', 'url': episode.get('url') or '',
+                 'episode_url': episode.get('episode_url')}
+                for i, episode in enumerate(episodes)
+            ])
+
+    def _delete_series(self, conn, share_id):
+        series_ids = select(self.series.c.id).where(self.series.c.playlist_id == share_id)
+        conn.execute(delete(self.episodes).where(self.episodes.c.series_id.in_(series_ids)))
+        conn.execute(delete(self.series).where(self.series.c.playlist_id == share_id))
+
+    def _refresh_counts(self, conn, share_id, name=None):
+        s = self.series
+        series_count, episode_count = conn.execute(
+            select(func.count(), func.coalesce(func.sum(s.c.episode_count), 0)).where(s.c.playlist_id == share_id)
+        ).one()
+        values = {'series_count': series_count, 'episode_count': episode_count,
+                  'version': self.playlists.c.version + 1, 'updated_at': time.time()}
+        if name is not None:
+            values['name'] = name
+        conn.execute(update(self.playlists).where(self.playlists.c.id == share_id).values(**values))
+
+    # Lettura
+
+    def _query(self, share_id, query):
+        """Esegue la query; se non trova la playlist prova a convertirla dal vecchio formato e la ripete."""
+        with self.engine.begin() as conn:
+            rows = conn.execute(query).all()
+            if not rows and self._ensure(conn, share_id):
+                rows = conn.execute(query).all()
+        return rows
+
+    def version(self, share_id):
+        """(nome, versione) della playlist, None se non esiste: basta per l'ETag senza leggere gli episodi."""
+        p = self.playlists
+        rows = self._query(share_id, select(p.c.name, p.c.version).where(p.c.id == share_id))
+        return tuple(rows[0]) if rows else None
+
+    def summary(self, share_id):
+        """Nome, contatori e serie (titolo, numero episodi) con una sola query indicizzata."""
+        p, s = self.playlists, self.series
+        rows = self._query(share_id, select(p.c.name, p.c.series_count, p.c.episode_count, s.c.title,
+                                            s.c.episode_count.label('series_episodes'))
+                           .select_from(p.outerjoin(s, s.c.playlist_id == p.c.id))
+                           .where(p.c.id == share_id)
+                           .order_by(s.c.position))
+        if not rows:
+            return None
+        first = rows[0]
+        return {
+            'name': first.name,
+            'total_series': first.series_count,
+            'total_episodes': first.episode_count,
+            'series': [{'title': row.title, 'episode_count': row.series_episodes} for row in rows if row.title is not None],
+        }
+
+    def get(self, share_id):
+        """Playlist completa nel formato del frontend: {'name', 'version', 'playlist': [serie con episodi]}."""
+        s, e = self.series, self.episodes
+        header = self.version(share_id)
+        if header is None:
+            return None
+        with self.engine.connect() as conn:
+            rows = conn.execute(
+                select(s.c.id, s.c.title, e.c.title.label('episode_title'), e.c.url, e.c.episode_url)
+                .select_from(s.outerjoin(e, e.c.series_id == s.c.id))
+                .where(s.c.playlist_id == share_id)
+                .order_by(s.c.position, e.c.position)
+            ).all()
+        playlist = []
+        series_by_id = {}
+        for row in rows:
+            series = series_by_id.get(row.id)
+            if series is None:
+                series = series_by_id[row.id] = {'title': row.title, 'episodes': []}
+                playlist.append(series)
+            if row.url is not None:
+                episode = {'title': row.episode_title, 'url': row.url}
+                if row.episode_url:
+                    episode['episode_url'] = row.episode_url
+                series['episodes'].append(episode)
+        return {'name': header[0], 'version': header[1], 'playlist': playlist}
+
+    def _ensure(self, conn, share_id):
+        """True se la playlist esiste, convertendola dal vecchio formato JSON se necessario."""
+        p = self.playlists
+        if conn.execute(select(p.c.id).where(p.c.id == share_id)).first() is not None:
+            return True
+        if self.legacy is None:
+            return False
+        legacy = conn.execute(select(self.legacy.c.name, self.legacy.c.playlist)
+                              .where(self.legacy.c.id == share_id)).first()
+        if legacy is None:
+            return False
+        log.info("Conversione della playlist %s nelle tabelle normalizzate", share_id)
+        try:
+            # In un savepoint: se un'altra richiesta la converte nello stesso momento
+            # l'inserimento fallisce sulla chiave primaria e la sua conversione vale anche qui
+            with conn.begin_nested():
+                conn.execute(insert(p).values(id=share_id, name=legacy.name, series_count=0, episode_count=0,
+                                              version=1, updated_at=time.time()))
+                for position, series in enumerate(json.loads(legacy.playlist)):
+                    self._insert_series(conn, share_id, position, series)
+                self._refresh_counts(conn, share_id)
+        except IntegrityError:
+            if conn.execute(select(p.c.id).where(p.c.id == share_id)).first() is None:
+                raise
+            log.info("Playlist %s già convertita da un'altra richiesta", share_id)
+        return True
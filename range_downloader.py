@@ -0,0 +1,207 @@
+import os
+import threading
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+import http_client
+
+# Connessioni parallele per file e dimensione di ogni range
+SEGMENTS = int(os.getenv('DOWNLOAD_SEGMENTS', 8))
+SEGMENT_SIZE = int(os.getenv('DOWNLOAD_SEGMENT_SIZE', 8 * 1024 * 1024))
+SEGMENT_RETRIES = int(os.getenv('DOWNLOAD_SEGMENT_RETRIES', 3))
+CHUNK_SIZE = 1024 * 1024
+# Pool separato da quello dello scraping: episodi x segmenti connessioni verso lo stesso CDN
+POOL_SIZE = int(os.getenv('DOWNLOAD_POOL_SIZE', 64))
+
+session = http_client.create_session(pool_size=POOL_SIZE)
+
+RemoteFile = namedtuple('RemoteFile', 'size accept_ranges etag last_modified')
+
+
+def probe(url):
+    """Dimensione e supporto ai Range del file remoto (HEAD, o GET di un solo byte se HEAD non va)."""
+    response = session.head(url, allow_redirects=True)
+    if response.ok and response.headers.get('Content-Length'):
+        size = int(response.headers['Content-Length'])
+        accept_ranges = response.headers.get('Accept-Ranges', '').lower() == 'bytes'
+    else:
+        response = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True)
+        response.close()
+        response.raise_for_status()
+        content_range = response.headers.get('Content-Range', '')
+        accept_ranges = response.status_code == 206 and '/' in content_range
+        if accept_ranges and content_range.rsplit('/', 1)[1].isdigit():
+            size = int(content_range.rsplit('/', 1)[1])
+        else:
+            size = int(response.headers.get('Content-Length', 0))
+            accept_ranges = False
+    return RemoteFile(size, accept_ranges, response.headers.get('ETag'), response.headers.get('Last-Modified'))
+
+
+def split_ranges(size, segment_size=SEGMENT_SIZE):
+    return [(start, min(start + segment_size, size) - 1) for start in range(0, size, segment_size)]
+
+
+class _PositionalFile:
+    """File scritto da più thread a offset diversi (os.pwrite dove disponibile)."""
+
+    def __init__(self, path, size=None, mode='r+b'):
+        if size is not None:
+            with open(path, 'wb') as f:
+                f.truncate(size)  # preallocazione
+        self._file = open(path, mode)
+        self._lock = threading.Lock()
+
+    def write_at(self, offset, data):
+        if hasattr(os, 'pwrite'):
+            os.pwrite(self._file.fileno(), data, offset)
+        else:
+            with self._lock:
+                self._file.seek(offset)
+                self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+
+def fetch_range(url, output, start, end, progress=None, retries=SEGMENT_RETRIES, validator=None):
+    """Scarica i byte [start, end] scrivendoli nella stessa posizione di output.
+
+    Se la connessione cade riprende dal primo byte mancante, fino a retries volte.
+    Restituisce il numero di byte scritti.
+    """
+    offset = start
+    attempt = 0
+    while offset <= end:
+        headers = {'Range': f'bytes={offset}-{end}'}
+        if validator:
+            headers['If-Range'] = validator
+        try:
+            with session.get(url, headers=headers, stream=True) as response:
+                response.raise_for_status()
+                if response.status_code != 206 or not response.headers.get('Content-Range', '').startswith(f'bytes {offset}-'):
+                    raise requests.HTTPError(f"Il server non ha rispettato il range {offset}-{end}", response=response)
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if not chunk:
+                        continue
+                    chunk = chunk[:end - offset + 1]
+                    output.write_at(offset, chunk)
+                    offset += len(chunk)
+                    if progress:
+                        progress(len(chunk))
+                    if offset > end:
+                        break
+            if offset <= end:
+                raise requests.ConnectionError(f"Range {start}-{end} interrotto a {offset}")
+        except requests.RequestException:
+            attempt += 1
+            if attempt > retries:
+                raise
+    return end - start + 1
+
+
+def missing_ranges(size, completed, segment_size=SEGMENT_SIZE):
+    """Range ancora da scaricare dato l'elenco (ordinato e unito) di quelli completati."""
+    gaps = []
+    offset = 0
+    for start, end in completed:
+        if start > offset:
+            gaps.append((offset, start - 1))
+        offset = max(offset, end + 1)
+    if offset < size:
+        gaps.append((offset, size - 1))
+    return [(start, min(start + segment_size, end + 1) - 1)
+            for gap_start, end in gaps for start in range(gap_start, end + 1, segment_size)]
+
+
+def _same_remote_file(entry, remote):
+    if not entry or entry.get('size') != remote.size:
+        return False
+    if entry.get('etag') and remote.etag:
+        return entry['etag'] == remote.etag
+    if entry.get('last_modified') and remote.last_modified:
+        return entry['last_modified'] == remote.last_modified
+    return True
+
+
+def download_single(url, output_path, progress=None):
+    with session.get(url, stream=True) as response:
+        response.raise_for_status()
+        with open(output_path, 'wb') as file:
+            for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                if chunk:
+                    file.write(chunk)
+                    if progress:
+                        progress(len(chunk))
+    return output_path
+
+
+def download(url, output_path, segments=SEGMENTS, segment_size=SEGMENT_SIZE, progress=None, manifest=None, name=None,
+             on_size=None):
+    """Scarica url in output_path con più connessioni Range in parallelo.
+
+    I byte vengono scritti in output_path + '.part', rinominato solo a download
+    completo e verificato. Con un manifest (DownloadManifest) i range scritti
+    vengono registrati sotto name, e un nuovo avvio sullo stesso file remoto
+    scarica solo quelli mancanti. Se il server non supporta i Range (o non
+    dichiara la dimensione) usa un solo stream.
+    progress(n) viene chiamata per ogni blocco di n byte scritto, on_size(n)
+    una volta con i byte ancora da scaricare.
+    """
+    name = name or os.path.basename(output_path)
+    part_path = output_path + '.part'
+    remote = probe(url)
+
+    if not remote.accept_ranges or not remote.size or segments <= 1:
+        if manifest:
+            manifest.start(name, url, remote.size or None, remote.etag, remote.last_modified)
+        if on_size and remote.size:
+            on_size(remote.size)
+        download_single(url, part_path, progress)
+    else:
+        entry = manifest.get(name) if manifest else None
+        if entry and os.path.exists(part_path) and _same_remote_file(entry, remote):
+            completed = entry['completed']
+            output = _PositionalFile(part_path)
+            if manifest:
+                manifest.update(name, video_url=url)
+        else:
+            completed = []
+            output = _PositionalFile(part_path, size=remote.size)
+            if manifest:
+                manifest.start(name, url, remote.size, remote.etag, remote.last_modified)
+
+        # If-Range accetta solo ETag forti o Last-Modified: se il file cambia il server risponde 200 e il range fallisce
+        validator = remote.etag if remote.etag and not remote.etag.startswith('W/') else remote.last_modified
+
+        ranges = missing_ranges(remote.size, completed, segment_size)
+        if on_size:
+            on_size(sum(end - start + 1 for start, end in ranges))
+
+        def fetch(start, end):
+            fetch_range(url, output, start, end, progress, validator=validator)
+            if manifest:
+                manifest.add_range(name, start, end)
+
+        try:
+            with ThreadPoolExecutor(max_workers=segments) as executor:
+                futures = [executor.submit(fetch, start, end) for start, end in ranges]
+                try:
+                    for future in futures:
+                        future.result()
+                except BaseException:
+                    for future in futures:
+                        future.cancel()
+                    raise
+        finally:
+            output.close()
+
+    size = os.path.getsize(part_path)
+    if remote.size and size != remote.size:
+        raise requests.ConnectionError(f"Download incompleto: {size} byte su {remote.size}")
+    os.replace(part_path, output_path)
+    if manifest:
+        manifest.complete(name, size)
+    return output_path
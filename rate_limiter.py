@@ -0,0 +1,254 @@
+"""Limite di richieste per host (token bucket + richieste in volo) condiviso tra worker e thread.
+
+Lo stato di ogni host (token, richieste in volo, blocco dopo un 429/503) sta in
+un backend: in memoria (un solo processo), in un file con lock (tutti i worker
+di gunicorn sulla stessa macchina) o nel database di SQLAlchemy (più macchine).
+Dopo un 429/503 l'host resta bloccato per il Retry-After (o un backoff
+esponenziale) e la velocità scende a metà; risale gradualmente con le risposte
+andate a buon fine.
+"""
+import itertools
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
+
+import requests
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: il backend su file vale solo per il processo corrente
+    fcntl = None
+
+# rate in richieste/s, burst = richieste consentite di colpo, max_in_flight = richieste contemporanee (0 = nessun limite)
+Policy = namedtuple('Policy', 'rate burst max_in_flight')
+
+SITE_POLICY = Policy(float(os.getenv('UPSTREAM_RATE', 10)), int(os.getenv('UPSTREAM_BURST', 20)),
+                     int(os.getenv('UPSTREAM_MAX_IN_FLIGHT', 16)))
+TMDB_POLICY = Policy(float(os.getenv('TMDB_RATE', 20)), int(os.getenv('TMDB_BURST', 40)),
+                     int(os.getenv('TMDB_MAX_IN_FLIGHT', 20)))
+
+BACKEND = os.getenv('RATE_LIMIT_BACKEND', 'file' if fcntl else 'local')  # 'local', 'file' o 'db'
+STATE_DIR = os.getenv('RATE_LIMIT_DIR', os.path.join(tempfile.gettempdir(), 'animescraper-ratelimit'))
+MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', 30))  # oltre questa attesa la richiesta fallisce
+LEASE_TTL = 120  # una richiesta in volo di un worker terminato smette di contare dopo questo tempo
+THROTTLE_STATUSES = (429, 503)
+BACKOFF_BASE = 1.0
+BACKOFF_MAX = 60.0
+MIN_FACTOR = 0.1  # velocità minima dopo ripetuti 429, come frazione di quella configurata
+RECOVERY_STEP = 0.05  # quanto risale la velocità a ogni risposta riuscita
+
+log = metrics.get_logger('rate_limiter')
+wait_seconds = metrics.histogram('animescraper_rate_limit_wait_seconds', "Attesa per uno slot verso l'host", ('host',))
+throttled = metrics.counter('animescraper_upstream_throttled_total', "Risposte 429/503 ricevute dall'host", ('host',))
+
+
+class RateLimitTimeout(requests.ConnectionError):
+    """Nessuno slot libero entro MAX_WAIT: trattata dai chiamanti come un errore di rete."""
+
+
+def parse_retry_after(value):
+    """Secondi di un header Retry-After (numero o data HTTP) tra 0 e BACKOFF_MAX, None se assente o non valido."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return min(float(value), BACKOFF_MAX)
+    try:
+        seconds = parsedate_to_datetime(value).timestamp() - time.time()
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return min(max(seconds, 0), BACKOFF_MAX)
+
+
+class LocalBackend:
+    """Stato in memoria: coordina solo i thread del processo corrente."""
+
+    def __init__(self):
+        self._states = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self, host):
+        with self._lock:
+            yield self._states.setdefault(host, {})
+
+
+class FileBackend:
+    """Stato in un file JSON per host, protetto da flock: coordina i processi della stessa macchina."""
+
+    def __init__(self, directory=STATE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def transaction(self, host):
+        with self._lock:
+            thread_lock = self._locks.setdefault(host, threading.Lock())
+        # flock è per file aperto: il lock dei thread evita che due thread dello stesso processo si sovrappongano
+        with thread_lock, open(os.path.join(self.directory, quote(host, safe='') + '.json'), 'a+') as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            text = f.read()
+            try:
+                state = json.loads(text) if text else {}
+            except ValueError:
+                state = {}
+            yield state
+            f.seek(0)
+            f.truncate()
+            f.write(json.dumps(state))
+            f.flush()
+
+
+class DBBackend:
+    """Stato in una tabella (host, state JSON) del database: coordina worker su più macchine."""
+
+    def __init__(self, app, db, model):
+        self.app = app
+        self.db = db
+        self.table = model.__table__
+        self._engine = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            with self.app.app_context():
+                self._engine = self.db.engine
+        return self._engine
+
+    @contextmanager
+    def transaction(self, host):
+        t = self.table
+        with self.engine.begin() as conn:
+            # Una scrittura come prima istruzione: su SQLite prende subito il lock di scrittura
+            # del database, su Postgres blocca la riga fino alla fine della transazione
+            if not conn.execute(update(t).where(t.c.host == host).values(host=host)).rowcount:
+                try:
+                    with conn.begin_nested():
+                        conn.execute(insert(t).values(host=host, state='{}'))
+                except IntegrityError:
+                    conn.execute(update(t).where(t.c.host == host).values(host=host))
+            state = json.loads(conn.execute(select(t.c.state).where(t.c.host == host)).scalar() or '{}')
+            yield state
+            conn.execute(update(t).where(t.c.host == host).values(state=json.dumps(state)))
+
+
+def default_backend():
+    if BACKEND == 'file':
+        return FileBackend()
+    return LocalBackend()
+
+
+class RateLimiter:
+    """Token bucket e limite di richieste in volo per gli host configurati con limit().
+
+    acquire() attende uno slot e restituisce un identificativo da passare a release();
+    record() registra lo status della risposta per il backoff adattivo. Gli host non
+    configurati non vengono limitati.
+    """
+
+    def __init__(self, backend=None, max_wait=MAX_WAIT):
+        self.backend = backend or LocalBackend()
+        self.max_wait = max_wait
+        self.policies = {}
+        self._degraded = {}  # host -> True se la velocità è ridotta (serve aggiornarla dopo un successo)
+        self._ids = itertools.count()
+
+    def limit(self, host, policy):
+        if policy.rate > 0 or policy.max_in_flight > 0:
+            self.policies[host] = policy
+        else:
+            self.policies.pop(host, None)
+
+    def is_limited(self, host):
+        return host in self.policies
+
+    def acquire(self, host):
+        policy = self.policies.get(host)
+        if policy is None:
+            return None
+        started = time.monotonic()
+        lease = f"{os.getpid()}-{next(self._ids)}"
+        while True:
+            with self.backend.transaction(host) as state:
+                now = time.time()
+                leases = {key: expires for key, expires in state.get('leases', {}).items() if expires > now}
+                factor = state.get('factor', 1.0)
+                self._degraded[host] = factor < 1.0 or state.get('strikes', 0) > 0
+                rate = policy.rate * factor
+                burst = max(policy.burst, 1)
+                tokens = state.get('tokens', burst)
+                if rate > 0:
+                    tokens = min(burst, tokens + (now - state.get('updated', now)) * rate)
+                blocked = state.get('blocked_until', 0) - now
+                if blocked > 0:
+                    wait = min(blocked, 1.0)
+                elif rate > 0 and tokens < 1:
+                    wait = (1 - tokens) / rate
+                elif policy.max_in_flight and len(leases) >= policy.max_in_flight:
+                    wait = 0.02  # non si sa quando finirà una richiesta in volo: si riprova presto
+                else:
+                    wait = 0
+                    if rate > 0:
+                        tokens -= 1
+                    if policy.max_in_flight:
+                        leases[lease] = now + LEASE_TTL
+                state.update(tokens=tokens, updated=now, leases=leases)
+            waited = time.monotonic() - started
+            if not wait:
+                wait_seconds.observe(waited, host=host)
+                return lease if policy.max_in_flight else None
+            if waited + wait > self.max_wait:
+                wait_seconds.observe(waited, host=host)
+                raise RateLimitTimeout(f"Nessuno slot libero per {host} dopo {waited:.1f}s")
+            time.sleep(wait)
+
+    def release(self, host, lease):
+        if lease is None:
+            return
+        with self.backend.transaction(host) as state:
+            state.get('leases', {}).pop(lease, None)
+
+    def record(self, host, status, retry_after=None):
+        """Aggiorna il backoff dopo una risposta: 429/503 bloccano l'host e dimezzano la velocità."""
+        if host not in self.policies:
+            return
+        if status in THROTTLE_STATUSES:
+            throttled.inc(host=host)
+            with self.backend.transaction(host) as state:
+                now = time.time()
+                strikes = state.get('strikes', 0) + 1
+                if retry_after is not None:
+                    delay = min(max(retry_after, 0), BACKOFF_MAX)
+                else:
+                    delay = min(BACKOFF_BASE * 2 ** (strikes - 1), BACKOFF_MAX)
+                state.update(strikes=strikes, factor=max(MIN_FACTOR, state.get('factor', 1.0) * 0.5),
+                             blocked_until=max(state.get('blocked_until', 0), now + delay), tokens=0, updated=now)
+            self._degraded[host] = True
+            log.warning("%s ha risposto %d: pausa di %.1fs e velocità ridotta", host, status, delay)
+        elif status < 400 and self._degraded.get(host):
+            with self.backend.transaction(host) as state:
+                factor = min(1.0, state.get('factor', 1.0) + RECOVERY_STEP)
+                state.update(factor=factor, strikes=0)
+            self._degraded[host] = factor < 1.0
+
+    @contextmanager
+    def slot(self, host):
+        lease = self.acquire(host)
+        try:
+            yield
+        finally:
+            self.release(host, lease)
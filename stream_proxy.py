@@ -0,0 +1,141 @@
+import os
+import threading
+import time
+from collections import deque
+
+from flask import Response, jsonify
+
+import http_client
+
+CHUNK_SIZE = int(os.getenv('PROXY_CHUNK_SIZE', 256 * 1024))
+MAX_STREAMS = int(os.getenv('PROXY_MAX_STREAMS', 12))  # per worker, sotto i thread di gunicorn
+SLOT_TIMEOUT = float(os.getenv('PROXY_SLOT_TIMEOUT', 2))
+THROUGHPUT_WINDOW = 10  # secondi usati per il calcolo dei bytes/s
+
+# Header della richiesta del player inoltrati all'origine
+FORWARDED_REQUEST_HEADERS = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since', 'Accept')
+# Header della risposta dell'origine restituiti al player
+FORWARDED_RESPONSE_HEADERS = ('Content-Type', 'Content-Length', 'Content-Range', 'Content-Encoding', 'Accept-Ranges',
+                              'ETag', 'Last-Modified', 'Cache-Control', 'Expires')
+
+
+class ProxyStats:
+    def __init__(self, window=THROUGHPUT_WINDOW):
+        self.window = window
+        self.active = 0
+        self.total = 0
+        self.rejected = 0
+        self.bytes_total = 0
+        self._buckets = deque()  # [secondo, byte]
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            self.active += 1
+            self.total += 1
+
+    def finish(self):
+        with self._lock:
+            self.active -= 1
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def add_bytes(self, count):
+        second = int(time.time())
+        with self._lock:
+            self.bytes_total += count
+            if self._buckets and self._buckets[-1][0] == second:
+                self._buckets[-1][1] += count
+            else:
+                self._buckets.append([second, count])
+                while self._buckets[0][0] <= second - self.window:
+                    self._buckets.popleft()
+
+    def snapshot(self):
+        now = int(time.time())
+        with self._lock:
+            recent = sum(count for second, count in self._buckets if second > now - self.window)
+            return {
+                'active_streams': self.active,
+                'max_streams': MAX_STREAMS,
+                'total_streams': self.total,
+                'rejected_streams': self.rejected,
+                'bytes_total': self.bytes_total,
+                'bytes_per_second': round(recent / self.window),
+            }
+
+
+stats = ProxyStats()
+_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+class _UpstreamStream:
+    """Iteratore sul corpo della risposta dell'origine che libera lo slot una sola volta.
+
+    close() viene chiamato sia a fine stream sia da Werkzeug quando il client si
+    disconnette, così la connessione verso l'origine non resta aperta.
+    """
+
+    def __init__(self, upstream, chunk_size):
+        self.upstream = upstream
+        self.chunk_size = chunk_size
+        self._closed = False
+        self._lock = threading.Lock()
+
+    def __iter__(self):
+        try:
+            # decode_content=False: i byte passano così come arrivano, senza decomprimere
+            for chunk in self.upstream.raw.stream(self.chunk_size, decode_content=False):
+                stats.add_bytes(len(chunk))
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.upstream.close()
+        stats.finish()
+        _slots.release()
+
+
+def proxy_stream(url, request_headers, chunk_size=CHUNK_SIZE, timeout=None, default_content_type=None):
+    """Inoltra url al client rispettando Range/If-Range; restituisce una Response Flask.
+
+    Solleva requests.RequestException se l'origine non risponde o risponde con un errore.
+    """
+    if not _slots.acquire(timeout=SLOT_TIMEOUT):
+        stats.reject()
+        response = jsonify({"error": "Troppi stream attivi, riprova tra poco"})
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+        return response
+
+    stats.start()
+    headers = {name: request_headers[name] for name in FORWARDED_REQUEST_HEADERS if name in request_headers}
+    upstream = None
+    try:
+        upstream = http_client.get(url, headers=headers, stream=True, timeout=timeout or http_client.DEFAULT_TIMEOUT)
+        # 416: range non valido, va restituito al player così com'è
+        if upstream.status_code >= 400 and upstream.status_code != 416:
+            upstream.raise_for_status()
+    except BaseException:
+        if upstream is not None:
+            upstream.close()
+        stats.finish()
+        _slots.release()
+        raise
+
+    body = _UpstreamStream(upstream, chunk_size)
+    response_headers = [(name, upstream.headers[name]) for name in FORWARDED_RESPONSE_HEADERS if name in upstream.headers]
+    if 'Accept-Ranges' not in upstream.headers and upstream.status_code == 206:
+        response_headers.append(('Accept-Ranges', 'bytes'))
+    if 'Content-Type' not in upstream.headers and default_content_type:
+        response_headers.append(('Content-Type', default_content_type))
+    response = Response(body, status=upstream.status_code, headers=response_headers, direct_passthrough=True)
+    response.call_on_close(body.close)
+    return response
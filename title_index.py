@@ -0,0 +1,267 @@
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from bisect import bisect_left, insort
+from collections import Counter
+from urllib.parse import urljoin
+
+from bs4 import BeautifulSoup, SoupStrainer
+from fuzzywuzzy import fuzz
+
+import http_client
+import metrics
+
+CATALOGUE_PATH = "/animelist?page={page}"
+MAX_CATALOGUE_PAGES = 500
+FUZZY_CANDIDATES = 50
+FUZZY_THRESHOLD = 70
+# Limite di voci lette dalle liste dei trigrammi (le più rare per prime) per ogni ricerca approssimata
+FUZZY_MAX_POSTINGS = 5000
+# Oltre questa frazione di titoli nuovi conviene ricostruire l'indice invece di inserirli uno per uno
+REBUILD_FRACTION = 0.1
+
+_non_alnum = re.compile(r'[^a-z0-9]+')
+_badge_strainer = SoupStrainer('a', class_='badge-archivio')
+
+log = metrics.get_logger('title_index')
+
+
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return _non_alnum.sub(' ', text.lower()).strip()
+
+
+def suffixes(norm):
+    """Chiavi di un titolo normalizzato: ogni suffisso che inizia con una parola."""
+    words = norm.split(' ')
+    return [' '.join(words[i:]) for i in range(len(words))]
+
+
+def trigrams(text):
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TitleIndex:
+    """Indice locale dei titoli del catalogo per i suggerimenti di ricerca.
+
+    Le chiavi (ogni suffisso del titolo che inizia con una parola) sono in un
+    array ordinato interrogato con bisect per i prefissi; un indice di trigrammi
+    fornisce i candidati per la ricerca approssimata.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.updated_at = 0
+        self._titles = {}  # url -> titolo
+        self._keys = []  # [(chiave normalizzata, url)] ordinato
+        self._trigrams = {}  # trigramma -> {url}
+        self._normalized = {}  # url -> titolo normalizzato
+        self._dirty = False  # titoli non ancora salvati su disco
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._titles)
+
+    def _rebuild(self, titles):
+        keys = []
+        grams = {}
+        normalized = {}
+        for url, title in titles.items():
+            norm = normalize(title)
+            normalized[url] = norm
+            keys.extend((key, url) for key in suffixes(norm))
+            for gram in trigrams(norm):
+                grams.setdefault(gram, set()).add(url)
+        keys.sort()
+        self._publish(keys, grams, normalized, titles)
+
+    def _publish(self, keys, grams, normalized, titles):
+        # Sostituzione atomica, i lettori non prendono mai il lock: titoli prima di chiavi e
+        # trigrammi, così un URL trovato nelle chiavi appena pubblicate ha già il suo titolo
+        self._titles, self._normalized = titles, normalized
+        self._trigrams, self._keys = grams, keys
+
+    def _insert(self, changed):
+        """Aggiunge o aggiorna i titoli di changed {url: titolo} con insort, senza riordinare l'indice.
+
+        Le modifiche vanno su copie delle strutture, pubblicate insieme alla fine:
+        i lettori vedono l'indice prima o dopo l'aggiornamento, mai a metà.
+        """
+        keys, grams = list(self._keys), dict(self._trigrams)
+        normalized, titles = dict(self._normalized), {**self._titles, **changed}
+        for url, title in changed.items():
+            old = normalized.get(url)
+            norm = normalize(title)
+            if old == norm:
+                continue
+            for key in (suffixes(old) if old is not None else ()):
+                i = bisect_left(keys, (key, url))
+                if i < len(keys) and keys[i] == (key, url):
+                    del keys[i]
+            for key in suffixes(norm):
+                insort(keys, (key, url))
+            old_grams = trigrams(old) if old is not None else set()
+            new_grams = trigrams(norm)
+            for gram in old_grams - new_grams:
+                grams[gram] = grams[gram] - {url}
+            for gram in new_grams - old_grams:
+                grams[gram] = grams.get(gram, set()) | {url}
+            normalized[url] = norm
+        self._publish(keys, grams, normalized, titles)
+
+    def add(self, entries):
+        """Aggiunge voci {"title", "url"} all'indice; restituisce quante erano nuove.
+
+        Non scrive su disco: il file viene aggiornato da save_if_dirty (nel thread di refresh).
+        """
+        with self._lock:
+            changed = {}
+            for entry in entries:
+                if self._titles.get(entry['url']) != entry['title']:
+                    changed[entry['url']] = entry['title']
+            if not changed:
+                return 0
+            if len(changed) > len(self._titles) * REBUILD_FRACTION:
+                self._rebuild({**self._titles, **changed})
+            else:
+                self._insert(changed)
+            self.updated_at = time.time()
+            self._dirty = True
+        return len(changed)
+
+    def suggest(self, query, limit=10):
+        q = normalize(query)
+        if not q:
+            return []
+        keys, titles = self._keys, self._titles
+
+        found = []
+        seen = set()
+        i = bisect_left(keys, (q,))
+        while i < len(keys) and len(found) < limit and keys[i][0].startswith(q):
+            url = keys[i][1]
+            if url not in seen:
+                seen.add(url)
+                found.append(url)
+            i += 1
+
+        if not found and len(q) >= 3:
+            found = self._fuzzy(q, limit)
+
+        # Un URL pubblicato tra la lettura delle chiavi e quella dei titoli viene saltato
+        return [{"title": titles[url], "url": url} for url in found if url in titles]
+
+    def _fuzzy(self, q, limit):
+        grams, normalized = self._trigrams, self._normalized
+        postings = sorted((grams[gram] for gram in trigrams(q) if gram in grams), key=len)
+        counts = Counter()
+        visited = 0
+        for urls in postings:
+            if visited and visited + len(urls) > FUZZY_MAX_POSTINGS:
+                break
+            counts.update(urls)
+            visited += len(urls)
+        scored = []
+        for url, _ in counts.most_common(FUZZY_CANDIDATES):
+            norm = normalized.get(url)
+            if norm is None:
+                continue
+            score = fuzz.partial_ratio(q, norm)
+            if score >= FUZZY_THRESHOLD:
+                scored.append((-score, len(norm), url))
+        scored.sort()
+        return [url for _, _, url in scored[:limit]]
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Impossibile caricare l'indice dei titoli: %s", e)
+            return False
+        with self._lock:
+            self._rebuild(data['titles'])
+            self.updated_at = data.get('updated_at', 0)
+            self._dirty = False
+        return True
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {'updated_at': self.updated_at, 'titles': self._titles}
+            self._dirty = False
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            self._dirty = True
+            raise
+
+    def save_if_dirty(self):
+        """Salva su disco solo se ci sono modifiche dall'ultimo salvataggio."""
+        if self._dirty:
+            self.save()
+
+    def crawl(self, base_url, max_pages=MAX_CATALOGUE_PAGES, site=None):
+        """Scorre le pagine del catalogo e aggiunge i titoli nuovi; restituisce quanti.
+
+        Con site (un mirrors.MirrorPool) le pagine vengono scaricate dal mirror migliore
+        e gli URL dei titoli salvati sul dominio canonico.
+        """
+        get = site.get if site else http_client.get
+        canonical = site.canonical if site else (lambda url: url)
+        entries_found = []
+        seen = set()
+        for page in range(1, max_pages + 1):
+            response = get(urljoin(base_url, CATALOGUE_PATH.format(page=page)))
+            response.raise_for_status()
+            with metrics.span('html_parse'):
+                soup = BeautifulSoup(response.text, 'html.parser', parse_only=_badge_strainer)
+            entries = [{"title": a.text.strip(), "url": canonical(urljoin(base_url, a['href']))}
+                       for a in soup.find_all('a', href=True)]
+            # Pagina vuota o ripetuta: siamo oltre l'ultima pagina
+            if not entries or all(entry['url'] in seen for entry in entries):
+                break
+            seen.update(entry['url'] for entry in entries)
+            entries_found.extend(entries)
+        # Un solo rebuild alla fine, e solo se il catalogo è cambiato
+        return self.add(entries_found)
+
+    def start_background_refresh(self, base_url, interval, site=None, source=None):
+        """Aggiorna l'indice ogni interval secondi dal catalogo del sito.
+
+        source (es. la copia locale del catalogo) è una lettura economica: viene
+        interrogata a ogni giro e l'indice si aggiorna solo se ci sono titoli nuovi.
+        Il file su disco viene riscritto al più una volta per giro, anche per i
+        titoli aggiunti dai suggerimenti.
+        """
+        def run():
+            while True:
+                if source or time.time() - self.updated_at >= interval or not len(self):
+                    try:
+                        added = self.add(source()) if source else self.crawl(base_url, site=site)
+                        self.updated_at = time.time()
+                        if not source:
+                            self._dirty = True  # salva l'ora del crawl anche senza titoli nuovi
+                        if added:
+                            log.info("Indice dei titoli aggiornato: %d nuovi, %d totali", added, len(self))
+                    except Exception as e:
+                        log.warning("Errore durante l'aggiornamento dell'indice dei titoli: %s", e)
+                try:
+                    self.save_if_dirty()
+                except OSError as e:
+                    log.warning("Impossibile salvare l'indice dei titoli: %s", e)
+                time.sleep(min(interval, 300))
+
+        thread = threading.Thread(target=run, name='title-index-refresh', daemon=True)
+        thread.start()
+        return thread
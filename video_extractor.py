@@ -0,0 +1,128 @@
+import html
+import re
+from collections import namedtuple
+from urllib.parse import urljoin
+
+import http_client
+import metrics
+
+# Parser opzionali più veloci di html.parser, usati solo se il regex non basta
+try:
+    from selectolax.parser import HTMLParser as _SelectolaxParser
+except ImportError:
+    _SelectolaxParser = None
+
+try:
+    import lxml  # noqa: F401
+    BS_PARSER = 'lxml'
+except ImportError:
+    BS_PARSER = 'html.parser'
+
+VIDEO_URL_RE = re.compile(r'https?://[^\s"\'<>\\]+?\.(m3u8|mp4)(?:\?[^\s"\'<>\\]*)?', re.IGNORECASE)
+IFRAME_SRC_RE = re.compile(r'<iframe\b[^>]*?\bsrc\s*=\s*["\']([^"\']+)["\']', re.IGNORECASE)
+WATCH_LINK_RE = re.compile(r'<a\b[^>]*?\bhref\s*=\s*["\']([^"\']*watch\?file=[^"\']*)["\']', re.IGNORECASE)
+QUALITY_RE = re.compile(r'(?<!\d)(2160|1440|1080|720|576|480|360|240)p?(?!\d)')
+MASTER_HINTS = ('master', 'playlist', 'index')
+
+VideoCandidate = namedtuple('VideoCandidate', 'url kind quality position')
+
+
+def _parse_tree(text):
+    if _SelectolaxParser is not None:
+        return _SelectolaxParser(text)
+    from bs4 import BeautifulSoup
+    return BeautifulSoup(text, BS_PARSER)
+
+
+def _find_attr_with_parser(text, tag, attr, predicate=lambda value: True):
+    tree = _parse_tree(text)
+    if _SelectolaxParser is not None:
+        for node in tree.css(tag):
+            value = node.attributes.get(attr)
+            if value and predicate(value):
+                return value
+        return None
+    for node in tree.find_all(tag):
+        value = node.get(attr)
+        if value and predicate(value):
+            return value
+    return None
+
+
+@metrics.timed('regex_extract')
+def find_iframe_src(text):
+    match = IFRAME_SRC_RE.search(text)
+    if match:
+        return html.unescape(match.group(1))
+    # HTML insolito (attributi senza virgolette, ecc.): serve l'albero del documento
+    if '<iframe' in text.lower():
+        return _find_attr_with_parser(text, 'iframe', 'src')
+    return None
+
+
+@metrics.timed('regex_extract')
+def find_watch_link(text):
+    match = WATCH_LINK_RE.search(text)
+    if match:
+        return html.unescape(match.group(1))
+    if 'watch?file=' in text:
+        return _find_attr_with_parser(text, 'a', 'href', lambda href: 'watch?file=' in href)
+    return None
+
+
+def _rank_key(candidate, prefer):
+    return (
+        -(candidate.quality or 0),
+        0 if candidate.kind == prefer else 1,
+        candidate.position,
+    )
+
+
+@metrics.timed('regex_extract')
+def find_video_urls(text, prefer='m3u8'):
+    """Tutti gli URL video (m3u8/mp4) nel testo, dal migliore al peggiore, senza duplicati."""
+    if '\\/' in text:
+        # URL dentro stringhe JavaScript/JSON con gli slash escapati
+        text = text.replace('\\/', '/')
+    candidates = {}
+    for position, match in enumerate(VIDEO_URL_RE.finditer(text)):
+        url = html.unescape(match.group(0))
+        if url in candidates:
+            continue
+        quality = QUALITY_RE.search(url)
+        quality = int(quality.group(1)) if quality else None
+        kind = match.group(1).lower()
+        if quality is None and kind == 'm3u8' and any(hint in url.lower() for hint in MASTER_HINTS):
+            # Una master playlist contiene tutte le qualità disponibili
+            quality = 10000
+        candidates[url] = VideoCandidate(url, kind, quality, position)
+    return sorted(candidates.values(), key=lambda candidate: _rank_key(candidate, prefer))
+
+
+def extract_video_urls(url, prefer='m3u8', get=None):
+    """Scarica la pagina watch (e il suo iframe) e restituisce i candidati ordinati.
+
+    I candidati trovati nell'iframe vengono prima di quelli della pagina principale.
+    get sostituisce http_client.get (per esempio MirrorPool.get per il failover tra mirror).
+    Le eccezioni di requests vengono propagate al chiamante.
+    """
+    get = get or http_client.get
+    response = get(url)
+    response.raise_for_status()
+    page = response.text
+
+    candidates = []
+    iframe_src = find_iframe_src(page)
+    if iframe_src:
+        iframe_response = get(urljoin(url, iframe_src))
+        iframe_response.raise_for_status()
+        candidates.extend(find_video_urls(iframe_response.text, prefer))
+
+    seen = {candidate.url for candidate in candidates}
+    candidates.extend(candidate for candidate in find_video_urls(page, prefer) if candidate.url not in seen)
+    return candidates
+
+
+def extract_video_url(url, prefer='m3u8', get=None):
+    candidates = extract_video_urls(url, prefer, get)
+    return candidates[0].url if candidates else None